@@ -3,7 +3,10 @@
 Implementation of some simple and dumb audio codecs, like Delta Modualtion
 """
 
-from .aux import pack, unpack
-from .dm import lin2dm, dm2lin, calc_a_value
-from .btc import lin2btc, btc2lin, calc_rc
+from .aux import pack, pack_into, unpack
+from .bitstream import BitStream
+from .dm import lin2dm, dm2lin, dm2lin_packed, calc_a_value, DmEncoder, \
+                DmDecoder
+from .btc import lin2btc, lin2btc_c8, btc2lin, btc2lin_packed, calc_rc, \
+                 BtcEncoder, BtcDecoder, BtcFixedEncoder, BtcFixedDecoder
 from ._version import __version__
@@ -3,14 +3,79 @@
 Some auxiliar functions to work with bitstreams
 
 """
-import array
+import importlib.util
+import re
+import sys
+from math import gcd
+from itertools import chain, islice
 
+from .bitstream import BitStream, BIT_REVERSE, _BITS
 
+
+def _lazy_import(name):
+    """
+    Returns a module that is executed the first time that one of his
+    attributes is used, so importing it is instant. Raises ImportError if the
+    module isn't installed
+    """
+    if name in sys.modules:
+        module = sys.modules[name]
+        if module is None:
+            raise ImportError('No module named %s' % name, name)
+        return module
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError('No module named %s' % name, name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+# Type of the modules of _lazy_import until they are executed
+_LazyModule = getattr(importlib.util, '_LazyModule', ())
+
+
+def _loaded(name):
+    """
+    Returns a module if it's imported and executed, or None. A lazy module
+    that isn't used yet isn't loaded by this
+    """
+    module = sys.modules.get(name)
+    if module is None or issubclass(type(module), _LazyModule):
+        return None
+    return module
+
+
+# Try to grab NumPy. It's loaded when it's used the first time
+try:
+    numpy = _lazy_import('numpy')
+    _NUMPY = True
+except ImportError:
+    _NUMPY = False
+
+
+# Typecodes of signed samples of each width. They must be of fixed size, so
+# 'i' for 4 bytes ('l' is 8 bytes in 64 bit Linux)
 WIDTH_TYPE = {1 : 'b',
               2 : 'h',
-              4 : 'l',
+              4 : 'i',
              }
 
+# Table that converts a bit in a byte (0 or not 0) to a ASCII '0' or '1'
+_ASCII_BIT = b'0' + b'1' * 255
+
+# Runs of equal samples (silence, DC) of at least RUN samples are encoded
+# detecting the cycle of the encoder state. None disables it
+RUN = 64
+CYCLE = 4096        # Max. steps searched for a cycle in each run
+
+# Cache of compiled regular expressions that find runs of equal samples
+_RUN_PATTERNS = {}
+
 def max_int(width):
     """ Returns Max signed Int of desired width """
     return 2 ** (width*8 -1) - 1
@@ -21,15 +86,240 @@ def min_int(width):
     return -(2 ** (width*8 -1)) + 1
 
 
+def _bytes(fragment, width = 1):
+    """
+    Returns a flat memoryview of the bytes of a bytes like object (bytes,
+    bytearray, memoryview, mmap, array.array, NumPy array...) without copy.
+
+    Only non contiguous buffers and NumPy arrays that aren't in native byte
+    order are copied. Buffers of items of other size than 1 or width bytes,
+    and NumPy arrays that aren't of signed integers, are rejected.
+
+    NumPy isn't loaded by this. If it isn't loaded yet, fragment can't be a
+    NumPy array.
+    """
+
+    numpy = _loaded('numpy')
+    if numpy is not None and isinstance(fragment, numpy.ndarray):
+        if fragment.dtype.kind != 'i' and fragment.dtype != numpy.uint8:
+            raise Exception('Invalid sample type %s' % fragment.dtype, \
+                            fragment.dtype)
+        if not fragment.dtype.isnative:
+            fragment = fragment.astype(fragment.dtype.newbyteorder('='))
+
+    view = memoryview(fragment)
+    if view.itemsize != 1 and view.itemsize != width:
+        raise Exception('Invalid sample size %d' % view.itemsize, \
+                        view.itemsize)
+    if not view.c_contiguous:
+        view = memoryview(view.tobytes())
+    return view.cast('B')
+
+
+def _samples(fragment, width):
+    """ Returns a view of the signed integer samples of a bytes like object """
+    return _bytes(fragment, width).cast(WIDTH_TYPE[width])
+
+
+def _runs(view, width):
+    """
+    Splits a flat view of bytes in runs of at least RUN equal samples and
+    the samples between them
+
+    Returns a list of (start, stop, run) were start and stop are offsets in
+    bytes and run is True if all the samples are equal
+    """
+
+    if not RUN:
+        return [(0, len(view), False)]
+
+    key = (width, RUN)
+    pattern = _RUN_PATTERNS.get(key)
+    if pattern is None:
+        pattern = re.compile(b'(?s)(' + b'.' * width + b')\\1{%d,}' % \
+                             (RUN - 1))
+        _RUN_PATTERNS[key] = pattern
+
+    segments = []
+    pos = 0
+    for match in pattern.finditer(view):
+        # A match could begin in the middle of a sample
+        start = match.start() + (-match.start() % width)
+        stop = match.end() - (match.end() - start) % width
+        if (stop - start) // width < RUN:
+            continue
+        if start > pos:
+            segments.append((pos, start, False))
+        segments.append((start, stop, True))
+        pos = stop
+    if pos < len(view) or not segments:
+        segments.append((pos, len(view), False))
+    return segments
+
+
+def _encode_constant(step, state, acc, count):
+    """
+    Encodes count equal samples with the step function of a encoder
+
+    A encoder is deterministic, so with a constant input the sequence of
+    states begins to repeat when a state is seen again. From there, the bits
+    are the cycle repeated, written a whole pattern of bytes at a time, and
+    the end state is the state at the end phase of the cycle. If there isn't
+    a cycle in the first CYCLE steps, all the samples are encoded.
+
+    Parameters
+    ----------
+
+    step : callable
+           step(state) returns a tuple of (bit, newstate). States must be
+           hashable and keep all the state of the encoder
+    state : hashable
+            Start state
+    acc : int
+          Bit accumulator of the encoder, with a sentinel bit
+    count : int
+            Number of samples
+
+    Returns
+    -------
+
+    Returns a tuple of (bytes, acc, state) with the whole bytes generated, the
+    new bit accumulator and the end state
+    """
+
+    seen = {}
+    states = []
+    bits = []
+    n = 0
+    limit = min(count, CYCLE)
+    while n < limit and state not in seen:
+        seen[state] = n
+        states.append(state)
+        bit, state = step(state)
+        bits.append(bit)
+        n += 1
+
+    if n < count and state not in seen:
+        # Without cycle. Encodes the rest step by step
+        for i in range(count - n):
+            bit, state = step(state)
+            bits.append(bit)
+        n = count
+
+    output = bytearray()
+    for bit in bits:
+        acc = (acc << 1) | bit
+        if acc > 0xFF:          # A byte is full
+            output.append(acc & 0xFF)
+            acc = 1
+
+    remaining = count - n
+    if not remaining:
+        return output, acc, state
+
+    first = seen[state]
+    cycle = bits[first:]
+    period = len(cycle)
+    phase = 0
+
+    # Fills the incomplete byte
+    while remaining and acc != 1:
+        acc = (acc << 1) | cycle[phase]
+        phase = (phase + 1) % period
+        remaining -= 1
+        if acc > 0xFF:
+            output.append(acc & 0xFF)
+            acc = 1
+
+    # Whole bytes are a pattern of lcm(period, 8) bits repeated
+    nbytes = remaining // 8
+    if nbytes:
+        length = period * 8 // gcd(period, 8)
+        pattern = bytearray()
+        byte = 1
+        for i in range(length):
+            byte = (byte << 1) | cycle[(phase + i) % period]
+            if byte > 0xFF:
+                pattern.append(byte & 0xFF)
+                byte = 1
+        output += pattern * (nbytes // len(pattern))
+        output += pattern[:nbytes % len(pattern)]
+        phase = (phase + nbytes * 8) % period
+        remaining -= nbytes * 8
+
+    for i in range(remaining):
+        acc = (acc << 1) | cycle[phase]
+        phase = (phase + 1) % period
+
+    return output, acc, states[first + phase]
+
+
+def __bitview(bitstream):
+    """
+    Returns a bytes like object with a bit by byte (0 or not 0) of a bitstream
+
+    Contiguous buffers of 1 byte items (bytes, bytearray, numpy bool or int8
+    arrays, etc.) are used without copy.
+    """
+
+    try:
+        view = memoryview(bitstream)
+    except TypeError:
+        view = None
+
+    if view is not None and view.itemsize == 1 and view.c_contiguous:
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
+        return view
+
+    if _NUMPY:
+        if isinstance(bitstream, numpy.ndarray):
+            bits = bitstream.ravel() != 0
+        else:
+            bits = numpy.fromiter(bitstream, dtype=bool)
+        return bits.view(numpy.uint8)
+
+    return bytes(map(bool, bitstream))
+
+
+def __packbits(bits, bitendianness):
+    """ Packs a bytes like object with a bit by byte in a bytestring """
+
+    if _NUMPY:
+        if bitendianness == 'LSB':
+            order = 'little'
+        else:
+            order = 'big'
+        return numpy.packbits(numpy.frombuffer(bits, dtype=numpy.uint8), \
+                              bitorder=order).tobytes()
+
+    nbits = len(bits)
+    if nbits == 0:
+        return b''
+
+    # Converts to a string of '0' and '1', that int() converts to the
+    # packed value in a single step
+    digits = bytes(bits).translate(_ASCII_BIT) + b'0' * (-nbits % 8)
+    output = int(digits, 2).to_bytes((nbits + 7) // 8, 'big')
+    if bitendianness == 'LSB':
+        output = output.translate(BIT_REVERSE)
+    return output
+
+
 def pack(bitstream, bitendianness = 'MSB'):
     """
     Converts a Bitstream to a Bytestring and return it
+
+    The last byte is filled with 0s if the number of bits isn't a multiple of
+    8.
     
     Parameters
     ----------
     
     bitstream : iterable 
-                Iterable that contains a bit stream
+                Iterable that contains a bit stream, like a BitStream. Buffers
+                with a bit in each byte, like bytes or numpy bool arrays, are
+                read without copy
     bitendianness : {'MSB', 'LSB'} optinal
                     How should fill each byte. Can be 'MSB' or 'LSB'. By 
                     default it's MSB
@@ -40,49 +330,66 @@ def pack(bitstream, bitendianness = 'MSB'):
         A Bytestring representation of the Bitstream
     """
 
-    output = array.array('B')
-    byte = 0
-    
-    if bitendianness == 'LSB':
-        i = 0
-        for bit in bitstream:
-            byte = (byte >> 1) | bit    # Fills a Byte from LSB to MSB
-            i += 1
-            if i > 7:
-                i = 0
-                output.append(byte)
-                byte = 0
-
-        if i != 0:                      # Parcial data in the last byte
-            output.append(byte)
-    else:
-        i = 7
-        for bit in bitstream:
-            byte = (byte << 1) | bit    # Fills a Byte from MSB to LSB
-            i -= 1
-            if i < 0:
-                i = 7
-                output.append(byte)
-                byte = 0
-
-        if i != 7:                      # Parcial data in the last byte
-            output.append(byte)
-
-    return output.tostring()
-
-
-def unpack(bytestring, bitendianness = 'MSB'):
+    if bitendianness != 'MSB' and bitendianness != 'LSB':
+        raise Exception('Invalid bit endiannes %s' % bitendianness, \
+                        bitendianness)
+
+    if isinstance(bitstream, BitStream): # Already packed
+        return bitstream.tobitorder(bitendianness).tobytes()
+
+    return __packbits(__bitview(bitstream), bitendianness)
+
+
+def pack_into(bitstream, buffer, offset = 0, bitendianness = 'MSB'):
+    """
+    Packs a Bitstream into a preallocated writable buffer
+
+    Parameters
+    ----------
+
+    bitstream : iterable
+                Iterable that contains a bit stream, like a BitStream
+    buffer : writable bytes like
+             Buffer were write the packed bitstream, like a bytearray, mmap or
+             shared memory
+    offset : int, optional
+             Offset in bytes of buffer were begins to write. By default 0
+    bitendianness : {'MSB', 'LSB'} optinal
+                    How should fill each byte. Can be 'MSB' or 'LSB'. By 
+                    default it's MSB
+
+    Returns
+    -------
+    int
+        Number of bytes written
+    """
+
+    packed = pack(bitstream, bitendianness)
+    view = memoryview(buffer).cast('B')
+    if offset < 0 or offset + len(packed) > len(view):
+        raise Exception('Buffer too small. Needs %d bytes' % \
+                        (offset + len(packed)), offset + len(packed))
+
+    view[offset:offset + len(packed)] = packed
+    return len(packed)
+
+
+def unpack(bytestring, bitendianness = 'MSB', nbits = None):
     """
     Converts a Bytestring to a Bitstream and return it
+
+    Use BitStream(bytestring) to get a compact Bitstream instead of a list.
     
     Parameters
     ----------
     
-    bytestring : iterable 
-                 Iterable that contains a bytestring
+    bytestring : bytes like
+                 Bytestring, or any buffer, that contains the packed bits
     bitendianness : {'MSB', 'LSB'} optinal
                     How should fill each byte. Can be 'MSB' or 'LSB'. By 
                     default it's MSB
+    nbits : int, optional
+            Number of bits to unpack. By default are all bits of bytestring
     
     Returns
     -------
@@ -90,20 +397,28 @@ def unpack(bytestring, bitendianness = 'MSB'):
         A Bitstream representation of the Bytestring
     """
 
-    input = array.array('B')
-    input.fromstring(bytestring)
-    output = []
+    if bitendianness != 'MSB' and bitendianness != 'LSB':
+        raise Exception('Invalid bit endiannes %s' % bitendianness, \
+                        bitendianness)
 
-    if bitendianness == 'LSB':
-        for byte in input:
-            for i in range(0, 7):
-                bit = byte & (1 << i)   # Get I bit
-                output.append(bit)
-
-    else:
-        for byte in input:
-            for i in range(7, 0, -1):
-                bit = byte & (1 << i)   # Get I bit
-                output.append(bit)
-
-    return output.tostring()
+    view = memoryview(bytestring)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+
+    if nbits is None:
+        nbits = len(view) * 8
+    elif nbits < 0 or nbits > len(view) * 8:
+        raise Exception('Invalid number of bits %d' % nbits, nbits)
+
+    if _NUMPY:
+        if bitendianness == 'LSB':
+            order = 'little'
+        else:
+            order = 'big'
+        return numpy.unpackbits(numpy.frombuffer(view, dtype=numpy.uint8), \
+                                count=nbits, bitorder=order) \
+                    .astype(bool).tolist()
+
+    table = _BITS[bitendianness]
+    return list(islice(chain.from_iterable(map(table.__getitem__, view)), \
+                       nbits))
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Encodes and decodes many independent sounds at the same time
+
+Each sample of a BTc/DM stream depends of the previous one, so a sound can't
+be vectorized over the time. But many independent sounds can be stacked in a
+2-D array and advanced together, doing a single vector operation in each
+time step. The output is the same that calling lin2btc, btc2lin, lin2dm and
+dm2lin over each sound.
+
+Requires NumPy.
+
+"""
+from __future__ import division
+
+from .aux import max_int, min_int, WIDTH_TYPE, _bytes, _lazy_import
+from .bitstream import BitStream
+from .btc import _frac_1_7, _check_args, _VUP, _VDW
+
+# Raises ImportError without NumPy. It's loaded when it's used the first time
+numpy = _lazy_import('numpy')
+
+
+def _stack_samples(fragments, width):
+    """
+    Stacks sounds of different length in a 2-D array
+
+    Sounds are sorted by length, from the longest to the shortest, so at any
+    time step the active sounds are the first rows. Returns a tuple of
+    (samples, lengths, order) were order[i] is the original index of row i.
+    """
+
+    dtype = numpy.dtype(WIDTH_TYPE[width])
+    rows = [numpy.frombuffer(_bytes(fragment, width), dtype=dtype) \
+            for fragment in fragments]
+    order = sorted(range(len(rows)), key=lambda i: -len(rows[i]))
+    lengths = numpy.array([len(rows[i]) for i in order], dtype=numpy.intp)
+
+    samples = numpy.zeros((len(rows), lengths[0] if len(rows) else 0))
+    for row, i in enumerate(order):
+        samples[row, :len(rows[i])] = rows[i]
+
+    return samples, lengths, order
+
+
+def _stack_bits(bitstreams):
+    """
+    Stacks bitstreams of different length in a 2-D bool array
+
+    Like _stack_samples, returns a tuple of (bits, lengths, order)
+    """
+
+    rows = []
+    for bitstream in bitstreams:
+        if isinstance(bitstream, BitStream):
+            if bitstream.bitorder == 'LSB':
+                order = 'little'
+            else:
+                order = 'big'
+            rows.append(numpy.unpackbits(numpy.frombuffer(bitstream.data, \
+                            dtype=numpy.uint8), count=len(bitstream), \
+                            bitorder=order).astype(bool))
+        else:
+            rows.append(numpy.array([bit >= 1 for bit in bitstream], \
+                                    dtype=bool))
+
+    order = sorted(range(len(rows)), key=lambda i: -len(rows[i]))
+    lengths = numpy.array([len(rows[i]) for i in order], dtype=numpy.intp)
+
+    bits = numpy.zeros((len(rows), lengths[0] if len(rows) else 0), dtype=bool)
+    for row, i in enumerate(order):
+        bits[row, :len(rows[i])] = rows[i]
+
+    return bits, lengths, order
+
+
+def _actives(lengths):
+    """ Returns the number of active streams in each time step """
+    if not len(lengths):
+        return []
+    steps = numpy.arange(lengths[0])
+    return numpy.searchsorted(-lengths, -steps, side='left').tolist()
+
+
+def _unstack_bits(bits, lengths, order):
+    """ Converts the rows of a 2-D bool array to BitStreams in input order """
+    packed = numpy.packbits(bits, axis=1)
+    output = [None] * len(order)
+    for row, i in enumerate(order):
+        nbits = int(lengths[row])
+        output[i] = BitStream(packed[row, :(nbits + 7) // 8].tobytes(), nbits)
+    return output
+
+
+def _unstack_samples(samples, lengths, order, width):
+    """ Converts the rows of a 2-D array to bytestrings in input order """
+    samples = samples.astype(numpy.dtype(WIDTH_TYPE[width]))
+    output = [None] * len(order)
+    for row, i in enumerate(order):
+        output[i] = samples[row, :lengths[row]].tobytes()
+    return output
+
+
+def _gather(states, order, key, default, dtype):
+    """ Gets a field of the states of each row as a array """
+    if states is None:
+        return numpy.full(len(order), default, dtype=dtype)
+    return numpy.array([default if states[i] is None else \
+                        states[i].get(key, default) for i in order], dtype=dtype)
+
+
+def lin2btc_many(fragments, width, soft, codec = '1.0', states = None):
+    """
+    Convert many sounds to 1 bit BTc encoding at the same time
+
+    Parameters
+    ----------
+
+    fragments : list of bytes like
+                Bytestrings with the sound data in signed integer samples.
+                Each one could have a different length.
+    width : int, {1, 2 , 4}
+            Size in bytes of each sample.
+    soft : int
+           Softness constant of BTc. 1/ softnees is how manyy dis/charge the
+           capacitor in each step
+    codec : {'1.0', '1.7'}, optional
+            BTc codec version to use. By default it's BTc 1.0
+    states : list, optional
+             States of previus call, one by sound. By default it's None
+
+    Returns
+    -------
+
+    Returns a tuple of (bitstreams, newstates) with a BitStream and a state for
+    each sound, like calling lin2btc over each one.
+    """
+
+    _check_args(width, soft, codec)
+
+    samples, lengths, order = _stack_samples(fragments, width)
+    MAX = max_int(width)
+    MIN = min_int(width)
+    up_frac, dw_frac = _frac_1_7(width)
+
+    lastbtc = _gather(states, order, 'lastbtc', 0.0, float)
+    lastbit = _gather(states, order, 'lastbit', False, bool)
+    high_target = MAX           # BTc 1.0 always charges to MAX
+    low_target = MIN            # and discharges to MIN
+
+    bits = numpy.zeros(samples.shape, dtype=bool)
+    for t, n in enumerate(_actives(lengths)):
+        last = lastbtc[:n]
+        if codec == '1.7':
+            high_target = numpy.where(lastbit[:n], MAX, up_frac)
+            low_target = numpy.where(lastbit[:n], dw_frac, MIN)
+
+        highbtc = last + (high_target - last) / soft
+        lowbtc = last - (last - low_target) / soft
+
+        sample = samples[:n, t]
+        bit = numpy.abs(highbtc - sample) < numpy.abs(lowbtc - sample)
+        bits[:n, t] = bit
+
+        last = numpy.where(bit, highbtc, lowbtc)
+        last = numpy.minimum(last, MAX)
+        lastbtc[:n] = numpy.maximum(last, MIN)
+        if codec == '1.7':
+            lastbit[:n] = bit
+
+    newstates = [None] * len(order)
+    for row, i in enumerate(order):
+        if codec == '1.7':
+            newstates[i] = {'lastbtc' : float(lastbtc[row]),
+                            'lastbit' : bool(lastbit[row]),
+                           }
+        else:
+            newstates[i] = {'lastbtc' : float(lastbtc[row])}
+
+    return _unstack_bits(bits, lengths, order), newstates
+
+
+def btc2lin_many(bitstreams, width, soft, codec = '1.0', states = None):
+    """
+    Convert many 1 bit BTc bitstreams to Lineal PCM samples at the same time
+
+    Parameters
+    ----------
+
+    bitstreams : list of boolean iterables
+                 Bitstreams of BTc data, like BitStreams. Each one could have
+                 a different length.
+    width : int, {1, 2 , 4}
+            Size in bytes of each output sample.
+    soft : int
+           Softness constant of BTc. 1/ softnees is how many dis/charge the
+           capacitor in each step
+    codec : {'1.0', '1.7'}, optional
+            BTc codec version to use. By default it's BTc 1.0
+    states : list, optional
+             States of previus call, one by bitstream. By default it's None
+
+    Returns
+    -------
+
+    Returns a tuple of (fragments, newstates) with a bytestring and a state for
+    each bitstream, like calling btc2lin over each one.
+    """
+
+    _check_args(width, soft, codec)
+
+    bits, lengths, order = _stack_bits(bitstreams)
+    MAX = max_int(width)
+
+    last = _gather(states, order, 'last', 0.5, float)
+    if codec == '1.7':
+        lastbit = _gather(states, order, 'lastbit', 0, int) >= 1
+    else:
+        lastbit = numpy.zeros(len(order), dtype=bool)
+
+    samples = numpy.zeros(bits.shape)
+    for t, n in enumerate(_actives(lengths)):
+        value = last[:n]
+        bit = bits[:n, t]
+        charge = (1 - value) / soft + value
+        discharge = value - value / soft
+
+        if codec == '1.7':
+            prev = lastbit[:n]
+            to_up = numpy.where(value <= _VUP, (_VUP - value) / soft + value, \
+                                value - (value - _VUP) / soft)
+            to_dw = numpy.where(value <= _VDW, (_VDW - value) / soft + value, \
+                                value - (value - _VDW) / soft)
+            value = numpy.where(bit, numpy.where(prev, charge, to_up), \
+                                numpy.where(prev, to_dw, discharge))
+            lastbit[:n] = bit
+        else:
+            value = numpy.where(bit, charge, discharge)
+
+        last[:n] = value
+        samples[:n, t] = (value - 0.5) * 2 * MAX
+
+    newstates = [None] * len(order)
+    for row, i in enumerate(order):
+        if codec == '1.7':
+            newstates[i] = {'last' : float(last[row]),
+                            'lastbit' : int(lastbit[row]),
+                           }
+        else:
+            newstates[i] = {'last' : float(last[row])}
+
+    return _unstack_samples(samples, lengths, order, width), newstates
+
+
+def lin2dm_many(fragments, width, delta = None, a_cte = 1.0, states = None):
+    """
+    Convert many sounds to 1 bit Delta Modulation encoding at the same time
+
+    Parameters
+    ----------
+
+    fragments : list of bytes like
+                Bytestrings with the sound data in signed integer samples.
+                Each one could have a different length.
+    width : int, {1, 2, 4}
+            Size in bytes of each sample.
+    delta : int
+            Delta constant of DM modulation. By default it's 1/21 of Max sample
+            value
+    a_cte : float
+            Sets Integrator decay value. By default it's 1.0 (no decay)
+    states : list, optional
+             States of previus call, one by sound. By default it's None
+
+    Returns
+    -------
+
+    Returns a tuple of (bitstreams, newstates) with a BitStream and a state for
+    each sound, like calling lin2dm over each one.
+    """
+
+    if width != 1 and width != 2 and width != 4:
+        raise Exception('Invalid width %d' % width, width)
+
+    MAX = max_int(width)
+    MIN = min_int(width)
+
+    if a_cte > 1.0 or a_cte <= 0:
+        raise Exception('Invalid a value %d. Must be 1 >= a > 0' % a_cte, a_cte)
+
+    if delta is None:
+        delta = MAX // 21
+    elif delta <= 0 or delta > MAX//2:
+        raise Exception('Invalid delta value %d. Must be > 0 and <= %d' %
+                        (delta, MAX//2), delta)
+
+    samples, lengths, order = _stack_samples(fragments, width)
+    samples = samples.astype(numpy.int64)
+    integrator = _gather(states, order, 'integrator', MAX//2, numpy.int64)
+
+    bits = numpy.zeros(samples.shape, dtype=bool)
+    for t, n in enumerate(_actives(lengths)):
+        value = integrator[:n]
+        highval = value + delta
+        lowval = value - delta
+
+        sample = samples[:n, t]
+        bit = numpy.abs(highval - sample) < numpy.abs(lowval - sample)
+        bits[:n, t] = bit
+
+        value = numpy.clip(numpy.where(bit, highval, lowval), MIN, MAX)
+        if a_cte != 1.0:
+            value = numpy.trunc(value * a_cte).astype(numpy.int64)
+        integrator[:n] = value
+
+    newstates = [None] * len(order)
+    for row, i in enumerate(order):
+        newstates[i] = {'integrator' : int(integrator[row])}
+
+    return _unstack_bits(bits, lengths, order), newstates
+
+
+def dm2lin_many(bitstreams, width, delta = None, a_cte = 1.0, states = None):
+    """
+    Convert many 1 bit Delta Modulation bitstreams to Lineal PCM at the same
+    time
+
+    Parameters
+    ----------
+
+    bitstreams : list of boolean iterables
+                 Bitstreams of DM data, like BitStreams. Each one could have
+                 a different length.
+    width : int, {1, 2, 4}
+            Size in bytes of each sample.
+    delta : int
+            Delta constant of DM modulation. By default it's 1/21 of Max sample
+            value
+    a_cte : float
+            Sets Integrator decay value. By default it's 1.0 (no decay)
+    states : list, optional
+             States of previus call, one by bitstream. By default it's None
+
+    Returns
+    -------
+
+    Returns a tuple of (fragments, newstates) with a bytestring and a state for
+    each bitstream, like calling dm2lin over each one.
+    """
+
+    if width != 1 and width != 2 and width != 4:
+        raise Exception('Invalid width %d' % width, width)
+
+    MAX = max_int(width)
+    MIN = min_int(width)
+
+    if a_cte > 1.0 or a_cte <= 0:
+        raise Exception('Invalid a value %d. Must be 1 >= a > 0' % a_cte, a_cte)
+
+    if delta is None:
+        delta = MAX // 21
+    elif delta <= 0 or delta > MAX//2:
+        raise Exception('Invalid delta value %d. Must be > 0 and <= %d' %
+                        (delta, MAX//2), delta)
+
+    bits, lengths, order = _stack_bits(bitstreams)
+    integrator = _gather(states, order, 'integrator', MAX//2, numpy.int64)
+
+    samples = numpy.zeros(bits.shape, dtype=numpy.int64)
+    for t, n in enumerate(_actives(lengths)):
+        value = numpy.where(bits[:n, t], integrator[:n] + delta, \
+                            integrator[:n] - delta)
+        value = numpy.clip(value, MIN, MAX)
+        if a_cte != 1.0:
+            value = numpy.trunc(value * a_cte).astype(numpy.int64)
+        integrator[:n] = value
+        samples[:n, t] = value
+
+    newstates = [None] * len(order)
+    for row, i in enumerate(order):
+        newstates[i] = {'integrator' : int(integrator[row])}
+
+    return _unstack_samples(samples, lengths, order, width), newstates
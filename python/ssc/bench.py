@@ -0,0 +1,587 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the Simple Sound Codecs
+
+Run it with python -m ssc.bench
+
+The throughput suite encodes and decodes deterministic corpora (sines,
+chirps, noise, speech like bursts and silence) at widths 1, 2 and 4, and
+reports the samples by second and the peak memory (traced by tracemalloc) of
+each operation. Results can be saved in a JSON file and compared against a
+saved baseline, flagging the regressions. The latency mode reports the p50
+and p99 latency of the codec objects by frame.
+
+"""
+from __future__ import division, print_function
+
+import argparse
+import array
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+from math import sin, pi
+
+from . import __version__
+from .aux import max_int, min_int, pack, WIDTH_TYPE, _NUMPY
+from .btc import BtcEncoder, BtcDecoder, BtcFixedEncoder, BtcFixedDecoder, \
+                 lin2btc, btc2lin, Q
+from .dm import DmEncoder, DmDecoder, lin2dm, dm2lin
+
+FRAMES = (64, 128, 256, 1024)   # Frame sizes in samples
+SOUNDS = (2, 8, 16, 32, 64)     # Number of sounds of the batch benchmark
+BITRATE = 22000
+SECONDS = 1.0       # Length of each corpus
+REPEAT = 5          # Runs of each operation. The fastest one is reported
+MIN_TIME = 0.01     # Minimum time in seconds of each run
+THRESHOLD = 0.25    # Change against the baseline flagged as regression
+SEED = 1234
+WIDTHS = (1, 2, 4)
+WRITERS = ('c', 'lib', 'lib_ihex', 'raw', 'raw_ihex')   # wav2ssc formats
+
+# Default wav2ssc script, in the source tree
+WAV2SSC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', \
+                       '..', 'tools', 'bin', 'wav2ssc.py')
+
+# Name : (Encoder factory, Decoder factory) of each codec
+CODECS = {'BTc1.0' : (lambda width: BtcEncoder(width, 21, '1.0'),
+                      lambda width: BtcDecoder(width, 21, '1.0')),
+          'BTc1.7' : (lambda width: BtcEncoder(width, 21, '1.7'),
+                      lambda width: BtcDecoder(width, 21, '1.7')),
+          'BTc1.0Q' : (lambda width: BtcFixedEncoder(width, 21, '1.0'),
+                       lambda width: BtcFixedDecoder(width, 21, '1.0')),
+          'BTc1.7Q' : (lambda width: BtcFixedEncoder(width, 21, '1.7'),
+                       lambda width: BtcFixedDecoder(width, 21, '1.7')),
+          'DM'     : (lambda width: DmEncoder(width),
+                      lambda width: DmDecoder(width)),
+         }
+
+
+def sine(samples, width, freq = 440.0, amplitude = 0.5):
+    """ Returns a bytestring with a sinusoidal sound of desired width """
+    raw = array.array(WIDTH_TYPE[width])
+    step = 2 * pi * freq / BITRATE
+    scale = max_int(width) * amplitude
+    for i in range(samples):
+        raw.append(int(scale * sin(step * i)))
+    return raw.tobytes()
+
+
+def _sines(samples, rng):
+    """ A 440 Hz tone with a quieter 1.1 kHz harmonic """
+    a = 2 * pi * 440.0 / BITRATE
+    b = 2 * pi * 1100.0 / BITRATE
+    return [0.6 * sin(a * i) + 0.2 * sin(b * i) for i in range(samples)]
+
+
+def _chirp(samples, rng):
+    """ A linear sweep from 100 Hz to 8 kHz """
+    f0, f1 = 100.0, 8000.0
+    k = (f1 - f0) / max(samples, 1)
+    return [0.8 * sin(2 * pi * (f0 * i + k * i * i / 2) / BITRATE) \
+            for i in range(samples)]
+
+
+def _noise(samples, rng):
+    """ Uniform white noise """
+    return [rng.uniform(-0.7, 0.7) for i in range(samples)]
+
+
+def _speech(samples, rng):
+    """
+    Bursts of 50 to 250 ms of a voiced like sound, a harmonic tone with a
+    fundamental of 100 to 250 Hz and a sinusoidal envelope, separated by 30
+    to 150 ms of low noise
+    """
+    output = []
+    while len(output) < samples:
+        length = rng.randint(BITRATE // 20, BITRATE // 4)
+        pitch = 2 * pi * rng.uniform(100, 250) / BITRATE
+        weights = [rng.uniform(0.1, 0.4) for i in range(4)]
+        for i in range(length):
+            envelope = sin(pi * i / length)
+            output.append(envelope * sum(w * sin(pitch * (h + 1) * i) \
+                                         for h, w in enumerate(weights)))
+        gap = rng.randint(BITRATE * 3 // 100, BITRATE * 15 // 100)
+        output.extend(rng.uniform(-0.01, 0.01) for i in range(gap))
+    return output[:samples]
+
+
+def _silence(samples, rng):
+    """ Digital silence """
+    return [0.0] * samples
+
+
+# Name : generator of float samples in [-1, 1] of each corpus
+CORPORA = {'sine' : _sines,
+           'chirp' : _chirp,
+           'noise' : _noise,
+           'speech' : _speech,
+           'silence' : _silence,
+          }
+
+
+def corpus(name, samples, width, seed = SEED):
+    """
+    Returns a bytestring with a deterministic test sound
+
+    Parameters
+    ----------
+
+    name : str
+           Name of the corpus in CORPORA
+    samples : int
+              Length of the sound in samples
+    width : int, {1, 2, 4}
+            Size in bytes of each sample
+    seed : int, optional
+           Seed of the random parts of the sound. The same seed always
+           gives the same sound. By default it's SEED
+    """
+
+    MAX = max_int(width)
+    MIN = min_int(width)
+    rng = random.Random('%s/%d' % (name, seed))
+    raw = array.array(WIDTH_TYPE[width])
+    for x in CORPORA[name](samples, rng):
+        raw.append(max(MIN, min(MAX, int(x * MAX))))
+    return raw.tobytes()
+
+
+def measure(function, repeat = REPEAT):
+    """
+    Returns a tuple of (seconds, peak) with the time by call of the fastest
+    of repeat runs of function and his peak of traced memory in bytes
+
+    Fast functions are called many times in each run, until a run takes
+    MIN_TIME, like timeit does. The memory is traced in a extra call,
+    because tracemalloc makes it slower
+    """
+
+    clock = time.perf_counter
+    number = 1
+    while True:
+        start = clock()
+        for i in range(number):
+            function()
+        elapsed = clock() - start
+        if elapsed >= MIN_TIME:
+            break
+        number *= 10 if elapsed < MIN_TIME / 10 else 2
+
+    best = elapsed / number
+    for i in range(repeat - 1):
+        start = clock()
+        for i in range(number):
+            function()
+        best = min(best, (clock() - start) / number)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def _result(operation, name, width, samples, seconds, peak):
+    """ Returns a dict with the result of a operation """
+    return {'operation' : operation,
+            'corpus' : name,
+            'width' : width,
+            'samples' : samples,
+            'seconds' : seconds,
+            'rate' : samples / seconds if seconds > 0 else float('inf'),
+            'peak' : peak,
+           }
+
+
+def codecs(samples, widths = WIDTHS, corpora = None, repeat = REPEAT, \
+           seed = SEED):
+    """
+    Measures lin2btc (1.0 and 1.7, with floats and in fixed point), lin2dm,
+    btc2lin, dm2lin and pack (MSB and LSB) over each corpus and width
+
+    Returns a list of dicts with the operation, corpus, width, samples,
+    seconds, rate (samples by second) and peak memory in bytes
+    """
+
+    results = []
+    for name in corpora or sorted(CORPORA):
+        for width in widths:
+            data = corpus(name, samples, width, seed)
+            btc10, _ = lin2btc(data, width, 21, '1.0')
+            btc17, _ = lin2btc(data, width, 21, '1.7')
+            btc10q, _ = lin2btc(data, width, 21, '1.0', q=Q)
+            btc17q, _ = lin2btc(data, width, 21, '1.7', q=Q)
+            dm, _ = lin2dm(data, width)
+            operations = ( \
+                ('lin2btc1.0', lambda: lin2btc(data, width, 21, '1.0')),
+                ('lin2btc1.7', lambda: lin2btc(data, width, 21, '1.7')),
+                ('lin2btc1.0q', lambda: lin2btc(data, width, 21, '1.0', q=Q)),
+                ('lin2btc1.7q', lambda: lin2btc(data, width, 21, '1.7', q=Q)),
+                ('lin2dm', lambda: lin2dm(data, width)),
+                ('btc2lin1.0', lambda: btc2lin(btc10, width, 21, '1.0')),
+                ('btc2lin1.7', lambda: btc2lin(btc17, width, 21, '1.7')),
+                ('btc2lin1.0q', lambda: btc2lin(btc10q, width, 21, '1.0', \
+                                                q=Q)),
+                ('btc2lin1.7q', lambda: btc2lin(btc17q, width, 21, '1.7', \
+                                                q=Q)),
+                ('dm2lin', lambda: dm2lin(dm, width)),
+                ('pack', lambda: pack(btc10)),
+                ('pack_lsb', lambda: pack(btc10, 'LSB')),
+            )
+            for operation, function in operations:
+                seconds, peak = measure(function, repeat)
+                results.append(_result(operation, name, width, samples, \
+                                       seconds, peak))
+    return results
+
+
+def load_wav2ssc(filename = WAV2SSC):
+    """ Loads the wav2ssc script as a module, or returns None if it's not
+    found
+    """
+    if not os.path.exists(filename):
+        return None
+    spec = importlib.util.spec_from_file_location('wav2ssc', filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def writers(samples, wav2ssc, formats = WRITERS, corpora = None, \
+            repeat = REPEAT, seed = SEED):
+    """
+    Measures the output formats of wav2ssc, writing a BTc1.0 library with a
+    sound of each corpus
+
+    Parameters
+    ----------
+
+    samples : int
+              Length of each sound in samples
+    wav2ssc : module
+              The wav2ssc script, loaded with load_wav2ssc
+
+    Returns a list of dicts like codecs, with the total samples of all sounds
+    """
+
+    with tempfile.TemporaryDirectory() as path, \
+            contextlib.redirect_stdout(io.StringIO()), \
+            contextlib.redirect_stderr(io.StringIO()):
+        lib = wav2ssc.SoundsLib(BITRATE)
+        names = corpora or sorted(CORPORA)
+        for name in names:
+            filename = os.path.join(path, name + '.wav')
+            wf = wave.open(filename, 'wb')
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(BITRATE)
+            wf.writeframes(corpus(name, samples, 2, seed))
+            wf.close()
+            lib.add_wav_sound(filename)
+        lib.process()
+
+        output = os.path.join(path, 'output')
+        results = []
+        for fmt in formats:
+            seconds, peak = measure(lambda: lib.write_to_file(output, fmt), \
+                                    repeat)
+            results.append(_result('write_' + fmt, 'all', 2, \
+                                   samples * len(names), seconds, peak))
+        del lib
+    return results
+
+
+def _key(row):
+    """ Returns the unique key of a result """
+    return '%s/%s/%d' % (row['operation'], row['corpus'], row['width'])
+
+
+def report(results, samples, repeat):
+    """ Returns a JSON serializable dict with the results of a run """
+    return {'version' : __version__,
+            'python' : sys.version.split()[0],
+            'numpy' : _NUMPY,
+            'samples' : samples,
+            'repeat' : repeat,
+            'results' : {_key(row) : row for row in results},
+           }
+
+
+def compare(current, baseline, threshold = THRESHOLD):
+    """
+    Compares two reports
+
+    A operation is flagged as 'slower' if his rate is threshold times lower
+    than in the baseline, and as 'memory' if his peak memory is threshold
+    times higher.
+
+    Returns a list of tuples of (key, baseline row, current row, flags) of
+    the operations in both reports
+    """
+
+    rows = []
+    for key in sorted(current['results']):
+        if key not in baseline['results']:
+            continue
+        old = baseline['results'][key]
+        new = current['results'][key]
+        flags = []
+        if new['rate'] < old['rate'] * (1 - threshold):
+            flags.append('slower')
+        if new['peak'] > old['peak'] * (1 + threshold):
+            flags.append('memory')
+        rows.append((key, old, new, flags))
+    return rows
+
+
+def print_throughput(results, f = sys.stdout):
+    """ Prints a table with throughput results """
+    f.write('%-16s %-8s %5s %14s %12s\n' % ('Operation', 'Corpus', \
+            'Width', 'Samples/s', 'Peak (KiB)'))
+    for row in results:
+        f.write('%-16s %-8s %5d %14.0f %12.1f\n' % (row['operation'], \
+                row['corpus'], row['width'], row['rate'], row['peak'] / 1024))
+
+
+def print_compare(rows, f = sys.stdout):
+    """ Prints a table with a comparison against a baseline """
+    f.write('%-32s %14s %8s %12s %8s  %s\n' % ('Operation', 'Samples/s', \
+            'Speed', 'Peak (KiB)', 'Memory', 'Flags'))
+    for key, old, new, flags in rows:
+        f.write('%-32s %14.0f %7.2fx %12.1f %7.2fx  %s\n' % (key, \
+                new['rate'], new['rate'] / old['rate'], new['peak'] / 1024, \
+                new['peak'] / old['peak'] if old['peak'] else 1.0, \
+                ' '.join(flags).upper()))
+
+
+def percentile(values, fraction):
+    """ Returns the percentile (nearest rank) of a sorted list """
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+
+def frame_latency(codec, width, frame, count):
+    """
+    Measures the latency of encoding and decoding frames with a codec object
+
+    Parameters
+    ----------
+
+    codec : str
+            Name of the codec in CODECS
+    width : int, {1, 2, 4}
+            Size in bytes of each sample
+    frame : int
+            Size in samples of each frame
+    count : int
+            Number of frames to measure
+
+    Returns
+    -------
+
+    Returns a tuple of (encode, decode) sorted lists with the time in seconds
+    of each frame
+    """
+
+    new_encoder, new_decoder = CODECS[codec]
+    data = sine(frame * count, width)
+    size = frame * width
+    clock = time.perf_counter
+
+    encoder = new_encoder(width)
+    encode = []
+    bits = []
+    for i in range(0, len(data), size):
+        chunk = data[i:i + size]
+        start = clock()
+        bitstream = encoder.feed(chunk)
+        encode.append(clock() - start)
+        bits.append(bitstream)
+
+    decoder = new_decoder(width)
+    decode = []
+    for bitstream in bits:
+        start = clock()
+        decoder.feed(bitstream)
+        decode.append(clock() - start)
+
+    encode.sort()
+    decode.sort()
+    return encode, decode
+
+
+def latency(frames = FRAMES, width = 2, count = 1000, codecs = None):
+    """
+    Measures the per frame latency of all codecs at several frame sizes
+
+    Returns a list of dicts with the codec, operation, frame size and the p50
+    and p99 latency in seconds
+    """
+
+    results = []
+    for codec in codecs or sorted(CODECS):
+        for frame in frames:
+            encode, decode = frame_latency(codec, width, frame, count)
+            for operation, times in (('encode', encode), ('decode', decode)):
+                results.append({'codec' : codec,
+                                'operation' : operation,
+                                'frame' : frame,
+                                'p50' : percentile(times, 0.50),
+                                'p99' : percentile(times, 0.99),
+                               })
+    return results
+
+
+def print_latency(results, f = sys.stdout):
+    """ Prints a table with latency results """
+    f.write('%-8s %-8s %6s %12s %12s %12s\n' % ('Codec', 'Op', 'Frame', \
+            'p50 (us)', 'p99 (us)', 'p50 us/smp'))
+    for row in results:
+        f.write('%-8s %-8s %6d %12.1f %12.1f %12.3f\n' % (row['codec'], \
+                row['operation'], row['frame'], row['p50'] * 10 ** 6, \
+                row['p99'] * 10 ** 6, row['p50'] * 10 ** 6 / row['frame']))
+
+
+def batch(sounds = SOUNDS, samples = 5000, width = 2, repeat = REPEAT, \
+          seed = SEED):
+    """
+    Measures the batch encoders of ssc.batch against encoding each sound
+    with lin2btc and lin2dm, with groups of sounds of the same length
+
+    Returns a list of dicts with the codec, number of sounds, samples by
+    sound and the seconds of the batch and sequential encoding. Returns a
+    empty list without NumPy
+    """
+
+    try:
+        import ssc.batch
+    except ImportError:
+        return []
+
+    results = []
+    for count in sounds:
+        waves = [corpus('speech', samples, width, seed + i) \
+                 for i in range(count)]
+        operations = ( \
+            ('BTc1.0', lambda: ssc.batch.lin2btc_many(waves, width, 21), \
+             lambda: [lin2btc(wave, width, 21) for wave in waves]),
+            ('DM', lambda: ssc.batch.lin2dm_many(waves, width), \
+             lambda: [lin2dm(wave, width) for wave in waves]),
+        )
+        for codec, many, sequential in operations:
+            results.append({'codec' : codec,
+                            'sounds' : count,
+                            'samples' : samples,
+                            'batch' : measure(many, repeat)[0],
+                            'sequential' : measure(sequential, repeat)[0],
+                           })
+    return results
+
+
+def print_batch(results, f = sys.stdout):
+    """ Prints a table with batch results """
+    f.write('%-8s %6s %8s %12s %12s %8s\n' % ('Codec', 'Sounds', 'Samples', \
+            'Batch (s)', 'Seq. (s)', 'Speedup'))
+    for row in results:
+        f.write('%-8s %6d %8d %12.4f %12.4f %7.2fx\n' % (row['codec'], \
+                row['sounds'], row['samples'], row['batch'], \
+                row['sequential'], row['sequential'] / row['batch']))
+
+
+def main(argv = None):
+    """ Command line entry point. Returns the exit status: 1 if a
+    regression was found comparing with a baseline, else 0
+    """
+
+    parser = argparse.ArgumentParser(prog='python -m ssc.bench', \
+                description='Benchmarks of Simple Sound Codecs')
+    parser.add_argument('mode', nargs='?', default='throughput', \
+                        choices=['throughput', 'latency', 'batch'], \
+                        help='Benchmark to run. Default: %(default)s')
+    parser.add_argument('-w', '--width', type=int, choices=[1, 2, 4], \
+                        default=None, help='Sample width. Default: 2 in '
+                        'latency mode, all widths in throughput mode')
+    parser.add_argument('-n', '--count', type=int, default=1000, \
+                        help='Frames measured by size. Default: %(default)s')
+    parser.add_argument('--frames', type=int, nargs='+', default=FRAMES, \
+                        help='Frame sizes in samples. Default: %(default)s')
+    parser.add_argument('-s', '--seconds', type=float, default=SECONDS, \
+                        help='Length of each corpus in seconds at %d Hz. '
+                        'Default: %%(default)s' % BITRATE)
+    parser.add_argument('-r', '--repeat', type=int, default=REPEAT, \
+                        help='Runs of each operation. Default: %(default)s')
+    parser.add_argument('--corpus', nargs='+', choices=sorted(CORPORA), \
+                        help='Corpora to use. Default: all')
+    parser.add_argument('--seed', type=int, default=SEED, \
+                        help='Seed of the corpora. Default: %(default)s')
+    parser.add_argument('--wav2ssc', metavar='FILE', default=WAV2SSC, \
+                        help='wav2ssc script used to measure the writers. '
+                        'Default: the one of the source tree')
+    parser.add_argument('--no-writers', action='store_true', default=False, \
+                        help='Not measure the wav2ssc writers')
+    parser.add_argument('-o', '--output', metavar='FILE', \
+                        help='Writes the results to a JSON file')
+    parser.add_argument('-c', '--compare', metavar='BASELINE', \
+                        help='Compares the results with a JSON file of a '
+                        'previous run')
+    parser.add_argument('-t', '--threshold', type=float, default=THRESHOLD, \
+                        help='Relative change flagged as regression. '
+                        'Default: %(default)s')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'latency':
+        print_latency(latency(args.frames, args.width or 2, args.count))
+        return 0
+
+    if args.mode == 'batch':
+        results = batch(width=args.width or 2, repeat=args.repeat, \
+                        seed=args.seed)
+        if not results:
+            sys.stderr.write('ssc.batch needs NumPy\n')
+            return 1
+        print_batch(results)
+        return 0
+
+    samples = int(args.seconds * BITRATE)
+    widths = (args.width,) if args.width else WIDTHS
+    results = codecs(samples, widths, args.corpus, args.repeat, args.seed)
+    if not args.no_writers:
+        wav2ssc = load_wav2ssc(args.wav2ssc)
+        if wav2ssc is None:
+            sys.stderr.write('wav2ssc not found. Writers are not measured\n')
+        else:
+            results += writers(samples, wav2ssc, WRITERS, args.corpus, \
+                               args.repeat, args.seed)
+    current = report(results, samples, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=1, sort_keys=True)
+
+    if not args.compare:
+        print_throughput(results)
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    rows = compare(current, baseline, args.threshold)
+    print_compare(rows)
+    regressions = sum(1 for row in rows if row[3])
+    print('%d regressions of %d operations' % (regressions, len(rows)))
+    return 1 if regressions else 0
+
+
+# MAIN !
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Compact bitstream type that stores the bits packed in a bytearray
+
+"""
+from itertools import chain, islice
+
+
+# Table that reverses the bit order of a byte. Used to swap between MSB and
+# LSB bit-endiannes with bytes.translate
+BIT_REVERSE = bytes(int('{0:08b}'.format(byte)[::-1], 2) for byte in range(256))
+
+# Tuples of bools of each byte value, in MSB and LSB order. Used to iterate
+_BITS = {'MSB' : tuple(tuple(bool(byte & (1 << i)) for i in range(7, -1, -1))
+                       for byte in range(256)),
+         'LSB' : tuple(tuple(bool(byte & (1 << i)) for i in range(8))
+                       for byte in range(256)),
+        }
+
+
+class BitStream(object):
+    """
+    Stream of bits packed in a bytearray, 8 bits per byte
+
+    Works like a list of bools (len, iteration, indexing, slicing and
+    concatenation), but uses a bit per element. The packed bytes are the same
+    that generates pack with the same bit order. The data property is a
+    buffer of them without copy, and bytes(stream) copies them. From Python
+    3.12, a BitStream supports directly the buffer protocol too, so
+    memoryview(stream) works like stream.data.
+    """
+
+    __slots__ = ('_data', '_nbits', '_bitorder')
+
+    def __init__(self, data = b'', nbits = None, bitorder = 'MSB'):
+        """
+        Creates a BitStream from packed data
+
+        Parameters
+        ----------
+
+        data : bytes like, optional
+               Packed bits. A bytearray is used directly, without copy, if
+               all his bits are valid. Else it's copied, so the bytearray of
+               the caller is never changed. By default it's empty
+        nbits : int, optional
+                Number of valid bits in data. By default are all bits of data
+        bitorder : {'MSB', 'LSB'} optinal
+                   How is filled each byte. Can be 'MSB' or 'LSB'. By default
+                   it's MSB
+        """
+
+        if bitorder != 'MSB' and bitorder != 'LSB':
+            raise Exception('Invalid bit order %s' % bitorder, bitorder)
+
+        if type(data) is not bytearray:
+            data = bytearray(data)
+
+        if nbits is None:
+            nbits = len(data) * 8
+        elif nbits < 0 or nbits > len(data) * 8:
+            raise Exception('Invalid number of bits %d' % nbits, nbits)
+
+        if nbits < len(data) * 8:
+            data = data[:(nbits + 7) // 8]  # Copy. Don't change the caller's
+        if nbits % 8:           # Unused bits of last byte must be 0
+            if bitorder == 'MSB':
+                data[-1] &= (0xFF << (8 - nbits % 8)) & 0xFF
+            else:
+                data[-1] &= 0xFF >> (8 - nbits % 8)
+
+        self._data = data
+        self._nbits = nbits
+        self._bitorder = bitorder
+
+    @classmethod
+    def frombits(cls, bits, bitorder = 'MSB'):
+        """ Creates a BitStream from a iterable of bools """
+
+        data = bytearray()
+        acc = 1                 # Bit accumulator with a sentinel bit
+        for bit in bits:
+            acc = (acc << 1) | (1 if bit else 0)
+            if acc > 0xFF:
+                data.append(acc & 0xFF)
+                acc = 1
+
+        nbits = len(data) * 8 + acc.bit_length() - 1
+        if acc > 1:
+            data.append((acc << (9 - acc.bit_length())) & 0xFF)
+
+        stream = cls(data, nbits)
+        if bitorder != 'MSB':
+            stream = stream.tobitorder(bitorder)
+        return stream
+
+    @property
+    def bitorder(self):
+        """ Bit order of the packed data, 'MSB' or 'LSB' """
+        return self._bitorder
+
+    @property
+    def data(self):
+        """ Read only memoryview of the packed data """
+        return memoryview(self._data).toreadonly()
+
+    def tobytes(self):
+        """ Returns the packed data as bytes """
+        return bytes(self._data)
+
+    def tobitorder(self, bitorder):
+        """ Returns a BitStream with the same bits packed in other order """
+        if bitorder == self._bitorder:
+            return self
+        return BitStream(self._data.translate(BIT_REVERSE), self._nbits, \
+                         bitorder)
+
+    def __bytes__(self):
+        return bytes(self._data)
+
+    def __buffer__(self, flags):
+        # Only used by Python >= 3.12 (PEP 688). Use the data property before
+        return memoryview(self._data)
+
+    def __len__(self):
+        return self._nbits
+
+    def __iter__(self):
+        table = _BITS[self._bitorder]
+        return islice(chain.from_iterable(map(table.__getitem__, self._data)),
+                      self._nbits)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._nbits)
+            if step != 1:
+                return BitStream.frombits(list(self)[index], self._bitorder)
+            return self.__slice(start, max(start, stop))
+
+        if index < 0:
+            index += self._nbits
+        if index < 0 or index >= self._nbits:
+            raise IndexError('BitStream index out of range')
+
+        byte = self._data[index >> 3]
+        if self._bitorder == 'MSB':
+            return bool(byte & (0x80 >> (index & 7)))
+        return bool(byte & (1 << (index & 7)))
+
+    def __slice(self, start, stop):
+        """ Returns the bits in [start, stop) as a BitStream """
+        if start % 8 == 0:
+            return BitStream(self._data[start >> 3 : (stop + 7) >> 3], \
+                             stop - start, self._bitorder)
+
+        value = self.__toint(self._data[start >> 3 : (stop + 7) >> 3], \
+                             (stop - (start & ~7)))
+        return self.__fromint(value & ((1 << (stop - start)) - 1), \
+                              stop - start)
+
+    def __toint(self, data, nbits):
+        """ Converts nbits of packed data to a int, first bit as MSB """
+        if self._bitorder == 'LSB':
+            data = data.translate(BIT_REVERSE)
+        return int.from_bytes(data, 'big') >> (len(data) * 8 - nbits)
+
+    def __fromint(self, value, nbits):
+        """ Converts a int of nbits to a BitStream of the same order """
+        nbytes = (nbits + 7) // 8
+        data = bytearray((value << (nbytes * 8 - nbits)).to_bytes(nbytes, \
+                                                                  'big'))
+        if self._bitorder == 'LSB':
+            data = data.translate(BIT_REVERSE)
+        return BitStream(data, nbits, self._bitorder)
+
+    def extend(self, bits):
+        """ Appends all the bits of a BitStream or a iterable of bools """
+        if not isinstance(bits, BitStream):
+            bits = BitStream.frombits(bits, self._bitorder)
+        else:
+            bits = bits.tobitorder(self._bitorder)
+
+        used = self._nbits % 8
+        if used == 0:
+            self._data += bits._data
+        elif bits._nbits:
+            # Shifts only the new bytes to fill the last byte
+            data = bits._data
+            if self._bitorder == 'LSB':
+                data = data.translate(BIT_REVERSE)
+            value = (int.from_bytes(data, 'big') << 8) >> used
+            tail = value.to_bytes(len(data) + 1, 'big')
+            if self._bitorder == 'LSB':
+                tail = tail.translate(BIT_REVERSE)
+            self._data[-1] |= tail[0]
+            self._data += tail[1:]
+            del self._data[(self._nbits + bits._nbits + 7) // 8:]
+
+        self._nbits += bits._nbits
+
+    def append(self, bit):
+        """ Appends a single bit """
+        if self._nbits % 8 == 0:
+            self._data.append(0)
+
+        if bit:
+            if self._bitorder == 'MSB':
+                self._data[-1] |= 0x80 >> (self._nbits & 7)
+            else:
+                self._data[-1] |= 1 << (self._nbits & 7)
+        self._nbits += 1
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __add__(self, other):
+        result = BitStream(self._data[:], self._nbits, self._bitorder)
+        result.extend(other)
+        return result
+
+    def __eq__(self, other):
+        if isinstance(other, BitStream):
+            return self._nbits == other._nbits and \
+                   self._data == other.tobitorder(self._bitorder)._data
+        if isinstance(other, (list, tuple)):
+            return len(other) == self._nbits and \
+                   all(bool(x) == y for x, y in zip(other, self))
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'BitStream(%r, %d, %r)' % (bytes(self._data), self._nbits, \
+                                          self._bitorder)
@@ -10,102 +10,313 @@ from __future__ import division
 
 import array
 import sys
-from .aux import max_int, min_int, WIDTH_TYPE
+from .aux import max_int, min_int, pack, WIDTH_TYPE, BIT_REVERSE, _bytes, \
+                 _lazy_import, _runs, _encode_constant
+from .bitstream import BitStream
+from . import progress as _progress
+
+# Try to grab NumPy. It's loaded when it's used the first time
+try:
+    numpy = _lazy_import('numpy')
+    _NUMPY = True
+except ImportError:
+    _NUMPY = False
 
 # PreCalcs Upper and Lower bounds whe lastbit != ThisBit in BTc1.7
-__VUP = 4.0 / 5.33
-__VDW = 1.33 / 5.33
+_VUP = 4.0 / 5.33
+_VDW = 1.33 / 5.33
 
+# Cache of lookup tables used by the packed decoder and the fixed point engine
+_TABLES = {}
 
-def __frac_1_7(width):
+# Fractional bits of the capacitor voltage in the fixed point engine
+Q = 16
+# Biggest Q format that uses precomputed transition tables
+TABLE_Q = 16
+
+
+def _frac_1_7(width):
     """ Calcs BTc 1.7 upper and lower fractions """
-    up_frac = 2 * max_int(width) * __VUP + min_int(width)
-    dw_frac = 2 * max_int(width) * __VDW + min_int(width)
+    up_frac = 2 * max_int(width) * _VUP + min_int(width)
+    dw_frac = 2 * max_int(width) * _VDW + min_int(width)
 
     return up_frac, dw_frac
 
 
-def __encode_btc1_0(fragment, width, soft, state):
+def _check_args(width, soft, codec):
+    """ Validates the common arguments of BTc encoders and decoders """
+
+    if width != 1 and width != 2 and width != 4:
+        raise Exception('Invalid width %d' % width, width)
+
+    if soft < 2:
+        raise Exception('Invalid softness value %d. Must be >= 2' % soft, soft)
+
+    if codec != '1.0' and codec != '1.7':
+        raise Exception('Invalid BTc version %s' % codec, codec)
+
+
+class BtcEncoder(object):
     """
-    Convert samples to 1 bit BTc 1.0 encoding
+    Stateful BTc encoder that converts chunks of Lineal PCM samples to BTc
 
     Binary Time Constant (BTc) it's a variant of Delta Modulation that uses a RC
     circuiit to implement the integrator and DAC. It allow to do a quick and
     cheap sound reproduction and recording withc very low CPU power and RAM
     usage. Ideal for cheap umicros like 8bit PIC micros.
 
-    Parameters
-    ----------
-
-    fragment : iterable
-               Iterable that contains a bytestring representation of the sound
-               data in signed integer samples.
-    width : int, {1, 2 , 4}
-            Size in bytes of each sample.
-    soft : int
-           Softness constant of BTc. 1/ softnees is how manyy dis/charge the 
-           capacitor in each step
-    state : tuple, optional
-            State of previus call if it's used to process chunks of sound data.
-            In the first call state can be None. By default it's None
+    Arguments are validated and constants are calculated only once, so it's
+    suitable to encode small frames of a real-time sound.
+    """
 
-    Returns
-    -------
+    __slots__ = ('width', 'soft', 'codec', '_max', '_min', '_up_frac', \
+                 '_dw_frac', '_lastbtc', '_lastbit', '_acc')
+
+    def __init__(self, width, soft, codec = '1.0', state = None):
+        """
+        Creates a BTc encoder
+
+        Parameters
+        ----------
+
+        width : int, {1, 2 , 4}
+                Size in bytes of each sample.
+        soft : int
+               Softness constant of BTc. 1/ softnees is how manyy dis/charge
+               the capacitor in each step
+        codec : {'1.0', '1.7'}, optional
+                BTc codec version to use. By default it's BTc 1.0
+        state : dicctionary, optional
+                State returned by lin2btc or other encoder to continue
+                encoding a sound. By default it's None
+        """
+
+        _check_args(width, soft, codec)
+
+        self.width = width
+        self.soft = soft
+        self.codec = codec
+        self._max = max_int(width)
+        self._min = min_int(width)
+        self._up_frac, self._dw_frac = _frac_1_7(width)
+        self._acc = 1           # Bit accumulator with a sentinel bit
+
+        if state == None:
+            self._lastbtc = 0
+            self._lastbit = False
+        else:
+            self._lastbtc = state['lastbtc']
+            self._lastbit = state.get('lastbit', False)
+
+    @property
+    def state(self):
+        """ Actual state, like the state returned by lin2btc """
+        if self.codec == '1.7':
+            return {'lastbtc' : self._lastbtc,
+                    'lastbit' : self._lastbit,
+                   }
+        return {'lastbtc' : self._lastbtc}
+
+    def feed(self, fragment):
+        """
+        Encodes a chunk of sound data
+
+        Parameters
+        ----------
+
+        fragment : bytes like
+                   Bytestring representation of the sound data in signed
+                   integer samples.
+
+        Returns
+        -------
+
+        Returns a BitStream with the whole bytes generated. The bits of a
+        incomplete byte are keep until the next call to feed or flush.
+        """
+
+        view = _bytes(fragment, self.width)
+        encode = self._encode_1_7 if self.codec == '1.7' else self._encode_1_0
+        bitstream = bytearray()
+        for start, stop, run in _runs(view, self.width):
+            raw = view[start:stop].cast(WIDTH_TYPE[self.width])
+            if run:
+                bitstream += self._encode_run(raw[0], len(raw))
+            else:
+                bitstream += encode(raw)
+        return BitStream(bitstream)
+
+    def flush(self):
+        """ Returns a BitStream with the bits of a incomplete byte """
+
+        acc = self._acc
+        self._acc = 1
+        if acc == 1:
+            return BitStream()
+        return BitStream(bytearray(((acc << (9 - acc.bit_length())) & 0xFF,)), \
+                         acc.bit_length() - 1)
+
+    def _encode_1_0(self, raw):
+        """ Encodes samples with BTc 1.0. Returns the whole bytes generated """
+
+        bitstream = bytearray()
+        acc = self._acc
+        lastbtc = self._lastbtc
+        soft = self.soft
+        MAX = self._max
+        MIN = self._min
+
+        for sample in raw:
+            # Generate a high (1) outcome
+            dist = (MAX - lastbtc) / soft     # Calc total distance to charge
+            # BTC only charge to 1/soft distance
+            highbtc = lastbtc + dist
 
-    Returns a tuple of (bitstream, newstate) and newstate should be passed to
-    the next call of __encode_btc_1_0.
-    """
+            # Generate a low (0) outcome
+            dist = (lastbtc - MIN) / soft     # Calc total distance to discharge
+            # BTC only discharge to 1/soft distance
+            lowbtc = lastbtc - dist
 
-    raw = array.array(WIDTH_TYPE[width])
-    
-    if sys.version_info[0] >= 3: # Python 3 or 2.x ?
-        raw.frombytes(fragment)
-    else:
-        raw.fromstring(fragment)
-    
-    bitstream = []
-    if state == None:
-        lastbtc = 0
-    else:
-        lastbtc = state['lastbtc']
+            # Calc distance from the high outcome to new sample
+            disthigh = abs(highbtc - sample)
+            # Calc distance from the low outcome to new sample
+            distlow = abs(lowbtc - sample)
 
-    MAX = max_int(width)
-    MIN = min_int(width)
+            # See wath outcome it's closest to the new sample and generate bit
+            if disthigh >= distlow:
+                acc <<= 1
+                lastbtc = lowbtc
+            else:
+                acc = (acc << 1) | 1
+                lastbtc = highbtc
+
+            if acc > 0xFF:          # A byte is full
+                bitstream.append(acc & 0xFF)
+                acc = 1
+
+            lastbtc = min(lastbtc, MAX)
+            lastbtc = max(lastbtc, MIN)
+
+        self._acc = acc
+        self._lastbtc = lastbtc
+        return bitstream
+
+    def _encode_1_7(self, raw):
+        """ Encodes samples with BTc 1.7. Returns the whole bytes generated """
+
+        bitstream = bytearray()
+        acc = self._acc
+        lastbtc = self._lastbtc
+        lastbit = self._lastbit
+        soft = self.soft
+        MAX = self._max
+        MIN = self._min
+        up_frac = self._up_frac
+        dw_frac = self._dw_frac
+
+        for sample in raw:
+            if lastbit:
+                # Generate a high (1) outcome
+                dist = (MAX- lastbtc) / soft    # Calc total distance to charge
+                # BTC only charge to 1/soft distance
+                highbtc = lastbtc + dist
+
+                # Generate a low (0) outcome
+                dist = (lastbtc - dw_frac) / soft
+                # Calc total distance to discharge
+                # BTC only discharge to 1/soft distance
+                lowbtc = lastbtc - dist
 
-    for sample in raw:
-        # Generate a high (1) outcome
-        dist = (MAX - lastbtc) / soft     # Calc total distance to charge
-        # BTC only charge to 1/soft distance
-        highbtc = lastbtc + dist
-
-        # Generate a low (0) outcome
-        dist = (lastbtc - MIN) / soft     # Calc total distance to discharge
-        # BTC only discharge to 1/soft distance
-        lowbtc = lastbtc - dist
-
-        # Calc distance from the high outcome to new sample
-        disthigh = abs(highbtc - sample)
-        # Calc distance from the low outcome to new sample
-        distlow = abs(lowbtc - sample)
-        
-        # See wath outcome it's closest to the new sample and generate bit
-        if disthigh >= distlow:
-            bitstream.append(False)
-            lastbtc = lowbtc
+            else:
+                # Generate a high (1) outcome
+                dist = (up_frac - lastbtc) / soft # Calc total distance to charge
+                # BTC only charge to 1/soft distance
+                highbtc = lastbtc + dist
+
+                # Generate a low (0) outcome
+                dist = (lastbtc - MIN) / soft
+                # Calc total distance to discharge
+                # BTC only discharge to 1/soft distance
+                lowbtc = lastbtc - dist
+
+            # Calc distance from the high outcome to new sample
+            disthigh = abs(highbtc - sample)
+            # Calc distance from the low outcome to new sample
+            distlow = abs(lowbtc - sample)
+
+            # See wath outcome it's closest to the new sample and generate bit
+            if disthigh >= distlow:
+                acc <<= 1
+                lastbit = False
+                lastbtc = lowbtc
+            else:
+                acc = (acc << 1) | 1
+                lastbit = True
+                lastbtc = highbtc
+
+            if acc > 0xFF:          # A byte is full
+                bitstream.append(acc & 0xFF)
+                acc = 1
+
+            lastbtc = min(lastbtc, MAX)
+            lastbtc = max(lastbtc, MIN)
+
+        self._acc = acc
+        self._lastbtc = lastbtc
+        self._lastbit = lastbit
+        return bitstream
+
+    def _encode_run(self, sample, count):
+        """
+        Encodes a run of equal samples detecting the cycle of the state.
+        Returns the whole bytes generated
+        """
+
+        soft = self.soft
+        MAX = self._max
+        MIN = self._min
+        up_frac = self._up_frac
+        dw_frac = self._dw_frac
+
+        def step_1_0(lastbtc):
+            """ Same operations that _encode_1_0 """
+            highbtc = lastbtc + (MAX - lastbtc) / soft
+            lowbtc = lastbtc - (lastbtc - MIN) / soft
+            if abs(highbtc - sample) >= abs(lowbtc - sample):
+                bit = 0
+                lastbtc = lowbtc
+            else:
+                bit = 1
+                lastbtc = highbtc
+            return bit, max(min(lastbtc, MAX), MIN)
+
+        def step_1_7(state):
+            """ Same operations that _encode_1_7 """
+            lastbtc, lastbit = state
+            if lastbit:
+                highbtc = lastbtc + (MAX - lastbtc) / soft
+                lowbtc = lastbtc - (lastbtc - dw_frac) / soft
+            else:
+                highbtc = lastbtc + (up_frac - lastbtc) / soft
+                lowbtc = lastbtc - (lastbtc - MIN) / soft
+            if abs(highbtc - sample) >= abs(lowbtc - sample):
+                return 0, (max(min(lowbtc, MAX), MIN), False)
+            return 1, (max(min(highbtc, MAX), MIN), True)
+
+        if self.codec == '1.7':
+            bitstream, self._acc, (self._lastbtc, self._lastbit) = \
+                _encode_constant(step_1_7, (self._lastbtc, self._lastbit), \
+                                 self._acc, count)
         else:
-            bitstream.append(True)
-            lastbtc = highbtc
-        
-        lastbtc = min(lastbtc, MAX)
-        lastbtc = max(lastbtc, MIN)
-
-    newstate = {'lastbtc' : lastbtc}
-    return bitstream, newstate
+            bitstream, self._acc, self._lastbtc = \
+                _encode_constant(step_1_0, self._lastbtc, self._acc, count)
+        return bitstream
 
 
-def __encode_btc1_7(fragment, width, soft, state):
+def lin2btc(fragment, width, soft, codec = '1.0', state = None, \
+            workers = None, progress = None, q = None):
     """
-    Convert samples to 1 bit BTc 1.7 encoding
+    Convert samples to 1 bit BTc encoding
 
     Binary Time Constant (BTc) it's a variant of Delta Modulation that uses a RC
     circuiit to implement the integrator and DAC. It allow to do a quick and
@@ -121,91 +332,355 @@ def __encode_btc1_7(fragment, width, soft, state):
     width : int, {1, 2 , 4}
             Size in bytes of each sample.
     soft : int
-           Softness constant of BTc. 1/ softnees is how manyy dis/charge the 
+           Softness constant of BTc. 1/ softnees is how manyy dis/charge the
            capacitor in each step
+    codec : {'1.0', '1.7'}, optional
+            BTc codec version to use. By default it's BTc 1.0
     state : tuple, optional
             State of previus call if it's used to process chunks of sound data.
             In the first call state can be None. By default it's None
+    workers : int, optional
+              If it's greater than 1, a long sound is split in chunks that
+              are encoded in parallel by this number of processes. The
+              output is the same. See ssc.parallel. By default it's None
+              (sequential)
+    progress : callable, optional
+               Called with a ssc.progress.Progress after each chunk of
+               ssc.progress.CHUNK samples, or with workers after each
+               parallel chunk. By default it's None
+    q : int, optional
+        If it's given, uses the integer fixed point engine with q fractional
+        bits (see BtcFixedEncoder) instead of floats. By default it's None
 
     Returns
     -------
 
-    Returns a tuple of (bitstream, newstate) and newstate should be passed to
-    the next call of __encode_btc_1_7.
+    Returns a tuple of (bitstream, newstate), were bitstream is a BitStream,
+    and newstate should be passed to the next call of lin2btc.
+
     """
 
-    raw = array.array(WIDTH_TYPE[width])
-    if sys.version_info[0] >= 3: # Python 3 or 2.x ?
-        raw.frombytes(fragment)
-    else:
-        raw.fromstring(fragment)
+    if not memoryview(fragment).nbytes:
+        raise Exception('Missing input data')
 
-    bitstream = []
-    if state == None:
-        lastbtc = 0
-        lastbit = False
+    if workers is not None and workers > 1:
+        from .parallel import encode
+        if q is not None:
+            return encode('btcq', fragment, width, (soft, codec, q), state, \
+                          workers, progress)
+        return encode('btc', fragment, width, (soft, codec), state, workers, \
+                      progress)
+
+    if q is not None:
+        encoder = BtcFixedEncoder(width, soft, codec, q, state)
     else:
-        lastbtc = state['lastbtc']
-        lastbit = state['lastbit']
+        encoder = BtcEncoder(width, soft, codec, state)
+    if progress is not None:
+        return _progress.encode(encoder, fragment, width, progress), \
+               encoder.state
+
+    bitstream = encoder.feed(fragment)
+    bitstream.extend(encoder.flush())
+    return bitstream, encoder.state
+
+
+def _btc_tables(soft, codec, width):
+    """
+    Builds (and caches) the lookup tables used by the packed BTc decoder
+
+    Each BTc decoder step is an affine map over the capacitor voltage:
+    last = k * last + target / soft, with k = 1 - 1/soft and target being Vcc,
+    GND or (only in BTc 1.7) VUp/VDw. So the 8 steps of a byte can be
+    composed to last_i = k**(i+1) * last + c_i, were c_i only depends of the
+    byte value and the previous bit.
+
+    Tables are indexed by (lastbit << 8 | byte) with the byte in MSB order.
+
+    Returns
+    -------
+
+    Returns a tuple of (slopes, offsets, carries, kpow) were slopes[i] and
+    offsets[index][i] gives the output sample i as int(slopes[i] * last +
+    offsets[index][i]), carries[index][i] is c_i and kpow[i] is k**(i+1)
+    """
+
+    key = (codec, soft, width)
+    if key in _TABLES:
+        return _TABLES[key]
 
-    # Calcs upper and lower fractions
     MAX = max_int(width)
-    MIN = min_int(width)
-    up_frac, dw_frac = __frac_1_7(width)
+    k = 1 - 1 / soft
+    kpow = tuple(k ** (i + 1) for i in range(8))
+    slopes = tuple(2 * MAX * kp for kp in kpow)
 
-    for sample in raw:
-        if lastbit:
-            # Generate a high (1) outcome
-            dist = (MAX- lastbtc) / soft    # Calc total distance to charge
-            # BTC only charge to 1/soft distance
-            highbtc = lastbtc + dist
+    # Target voltage indexed by (lastbit << 1 | bit)
+    if codec == '1.7':
+        targets = (0.0, _VUP, _VDW, 1.0)
+    else:
+        targets = (0.0, 1.0, 0.0, 1.0)
 
-            # Generate a low (0) outcome
-            dist = (lastbtc - dw_frac) / soft
-            # Calc total distance to discharge
-            # BTC only discharge to 1/soft distance
-            lowbtc = lastbtc - dist
+    offsets = []
+    carries = []
+    for index in range(512):
+        lastbit = index >> 8
+        c = 0.0
+        cs = []
+        for i in range(7, -1, -1):
+            bit = (index >> i) & 1
+            c = k * c + targets[lastbit << 1 | bit] / soft
+            cs.append(c)
+            lastbit = bit
 
-        else:
-            # Generate a high (1) outcome
-            dist = (up_frac - lastbtc) / soft # Calc total distance to charge
-            # BTC only charge to 1/soft distance
-            highbtc = lastbtc + dist
+        carries.append(tuple(cs))
+        offsets.append(tuple(2 * MAX * c - MAX for c in cs))
 
-            # Generate a low (0) outcome
-            dist = (lastbtc - MIN) / soft
-            # Calc total distance to discharge
-            # BTC only discharge to 1/soft distance
-            lowbtc = lastbtc - dist
+    tables = (slopes, tuple(offsets), tuple(carries), kpow)
+    _TABLES[key] = tables
+    return tables
 
-        # Calc distance from the high outcome to new sample
-        disthigh = abs(highbtc - sample)
-        # Calc distance from the low outcome to new sample
-        distlow = abs(lowbtc - sample)
 
-        # See wath outcome it's closest to the new sample and generate bit
-        if disthigh >= distlow:
-            bitstream.append(False)
-            lastbit = False
-            lastbtc = lowbtc
+class BtcDecoder(object):
+    """
+    Stateful BTc decoder that converts chunks of BTc bitstream to Lineal PCM
+
+    Arguments are validated and lookup tables are calculated only once, so
+    it's suitable to decode small frames of a real-time sound.
+    """
+
+    __slots__ = ('width', 'soft', 'codec', '_max', '_tables', '_ends', \
+                 '_last', '_lastbit')
+
+    def __init__(self, width, soft, codec = '1.0', state = None):
+        """
+        Creates a BTc decoder
+
+        Parameters
+        ----------
+
+        width : int, {1, 2 , 4}
+                Size in bytes of each output sample.
+        soft : int
+               Softness constant of BTc. 1/ softnees is how many dis/charge
+               the capacitor in each step
+        codec : {'1.0', '1.7'}, optional
+                BTc codec version to use. By default it's BTc 1.0
+        state : dicctionary, optional
+                State returned by btc2lin or other decoder to continue
+                decoding a sound. By default it's None
+        """
+
+        _check_args(width, soft, codec)
+
+        self.width = width
+        self.soft = soft
+        self.codec = codec
+        self._max = max_int(width)
+        self._tables = _btc_tables(soft, codec, width)
+        self._ends = [c[7] for c in self._tables[2]]
+
+        if state == None:
+            self._last = 0.5
+            self._lastbit = 0
         else:
-            bitstream.append(True)
-            lastbit = True
-            lastbtc = highbtc
+            self._last = state['last']
+            self._lastbit = state.get('lastbit', 0)
 
-        lastbtc = min(lastbtc, MAX)
-        lastbtc = max(lastbtc, MIN)
+    @property
+    def state(self):
+        """ Actual state, like the state returned by btc2lin """
+        if self.codec == '1.7':
+            return {'last' : self._last, 'lastbit' : self._lastbit}
+        return {'last' : self._last}
 
-    newstate = {'lastbtc' : lastbtc,
-                'lastbit' : lastbit,
-               }
-    return bitstream, newstate
+    def feed(self, btcfragment):
+        """
+        Decodes a chunk of BTc bitstream
 
+        Parameters
+        ----------
 
-def lin2btc(fragment, width, soft, codec = '1.0', state = None):
+        btcfragment : boolean iterable
+                      Iterable that contains a bitstream representation of BTc
+                      data. A BitStream is decoded directly from his packed
+                      data
+
+        Returns
+        -------
+
+        Returns a bytestring with the decoded samples
+        """
+
+        if isinstance(btcfragment, BitStream):
+            return self.feed_packed(btcfragment.data, btcfragment.bitorder, \
+                                    len(btcfragment))
+
+        if self.codec == '1.7':
+            audio = self._decode_1_7(btcfragment)
+        else:
+            audio = self._decode_1_0(btcfragment)
+
+        if sys.version_info[0] >= 3: # Python 3 or 2.x ?
+            return audio.tobytes()
+        else:
+            return audio.tostring()
+
+    def flush(self):
+        """ Decoder not keeps any pending data, so returns a empty fragment """
+        return b''
+
+    def _decode_1_0(self, btcfragment):
+        """ Decodes a bitstream with BTc 1.0 """
+
+        audio = array.array(WIDTH_TYPE[self.width])
+        append = audio.append
+        MAX = self._max
+        soft = self.soft
+        last = self._last
+
+        for bit in btcfragment:
+            if bit >= 1:  # Charge!
+                last = (1 - last) / soft + last
+            else:         # Discharge!
+                last -= last / soft
+
+            append(int((last - 0.5) * 2 * MAX))
+
+        self._last = last
+        return audio
+
+    def _decode_1_7(self, btcfragment):
+        """ Decodes a bitstream with BTc 1.7 """
+
+        audio = array.array(WIDTH_TYPE[self.width])
+        append = audio.append
+        MAX = self._max
+        soft = self.soft
+        last = self._last
+        lastbit = self._lastbit
+
+        for bit in btcfragment:
+            if bit >= 1 and lastbit >= 1:    # Charge to Vcc
+                last = (1 - last) / soft + last
+            elif bit >= 1 and lastbit < 1:    # Pull to 3/4 of Vcc
+                if last <= _VUP:
+                    # Charge to VUp
+                    last = (_VUP - last) / soft + last
+                else:
+                    # Discharge to VUp
+                    last = last - (last - _VUP) / soft
+            elif bit < 1 and lastbit >= 1:   # Pull to 1/4 of Vcc
+                if last <= _VDW:
+                    # Charge to VDw
+                    last = (_VDW - last) / soft + last
+                else:
+                    # Discharge to VDw
+                    last -= (last - _VDW) / soft
+            elif bit < 1 and lastbit < 1:    # Discharge to GND
+                last -= last / soft
+
+            append(int((last - 0.5) * 2 * MAX))
+            lastbit = bit
+
+        self._last = last
+        self._lastbit = lastbit
+        return audio
+
+    def feed_packed(self, bytestring, bitendianness = 'MSB', nbits = None):
+        """
+        Decodes a chunk of packed BTc bitstream, a byte in each step
+
+        Parameters
+        ----------
+
+        bytestring : bytes like
+                     Bytestring with the packed bitstream, like the output of
+                     pack
+        bitendianness : {'MSB', 'LSB'} optinal
+                        How was filled each byte. Can be 'MSB' or 'LSB'. By
+                        default it's MSB
+        nbits : int, optional
+                Number of bits to decode. By default are all bits of
+                bytestring
+
+        Returns
+        -------
+
+        Returns a bytestring with the decoded samples. The output could
+        differ in +-1 from the bit a bit decoder by float rounding.
+        """
+
+        if nbits is None:
+            nbits = len(bytestring) * 8
+
+        data = bytes(bytestring)
+        if bitendianness == 'LSB':
+            data = data.translate(BIT_REVERSE)
+
+        last = self._last
+        slopes, offsets, carries, kpow = self._tables
+        s0, s1, s2, s3, s4, s5, s6, s7 = slopes
+        k8 = kpow[7]
+        ends = self._ends
+
+        audio = array.array(WIDTH_TYPE[self.width])
+        extend = audio.extend
+        full = nbits // 8
+        index = int(self._lastbit >= 1) << 8
+
+        if _NUMPY and full >= 64:
+            # Scan the state at the begin of each byte and expand all the
+            # bytes with a single vector operation
+            codes = numpy.frombuffer(data, dtype=numpy.uint8, count=full)
+            indexes = codes.astype(numpy.intp)
+            indexes[1:] |= (codes[:-1] & 1).astype(numpy.intp) << 8
+            indexes[0] |= index
+            lasts = []
+            append = lasts.append
+            for end in numpy.take(ends, indexes).tolist():
+                append(last)
+                last = k8 * last + end
+
+            samples = numpy.multiply.outer(lasts, slopes)
+            samples += numpy.take(offsets, indexes, axis=0)
+            audio.frombytes(samples.astype( \
+                    numpy.dtype(WIDTH_TYPE[self.width])).tobytes())
+            index = (int(codes[-1]) & 1) << 8
+            full = 0
+
+        for byte in data[:full]:
+            index |= byte
+            o0, o1, o2, o3, o4, o5, o6, o7 = offsets[index]
+            extend((int(s0 * last + o0), int(s1 * last + o1), \
+                    int(s2 * last + o2), int(s3 * last + o3), \
+                    int(s4 * last + o4), int(s5 * last + o5), \
+                    int(s6 * last + o6), int(s7 * last + o7)))
+            last = k8 * last + ends[index]
+            index = (byte & 1) << 8
+
+        rem = nbits % 8
+        if rem:                     # Parcial data in the last byte
+            byte = data[nbits // 8]
+            index |= byte
+            outs = offsets[index]
+            for i in range(rem):
+                audio.append(int(slopes[i] * last + outs[i]))
+            last = kpow[rem - 1] * last + carries[index][rem - 1]
+            index = ((byte >> (8 - rem)) & 1) << 8
+
+        self._last = last
+        self._lastbit = index >> 8
+
+        if sys.version_info[0] >= 3: # Python 3 or 2.x ?
+            return audio.tobytes()
+        else:
+            return audio.tostring()
+
+
+def btc2lin(btcfragment, width, soft, codec = '1.0', state = None, \
+            workers = None, progress = None, q = None):
     """
-    Convert samples to 1 bit BTc encoding
-    
+    Convert 1 bit BTc bitstream samples to Lineal PCM samples
+
     Binary Time Constant (BTc) it's a variant of Delta Modulation that uses a RC
     circuiit to implement the integrator and DAC. It allow to do a quick and
     cheap sound reproduction and recording withc very low CPU power and RAM
@@ -214,220 +689,641 @@ def lin2btc(fragment, width, soft, codec = '1.0', state = None):
     Parameters
     ----------
 
-    fragment : iterable
-               Iterable that contains a bytestring representation of the sound
-               data in signed integer samples.
+    btcfragment : boolean iterable
+                  Iterable that contains a bitstream representation of BTc
+                  data. A BitStream is decoded directly from his packed data
     width : int, {1, 2 , 4}
-            Size in bytes of each sample.
+            Size in bytes of each output sample.
     soft : int
-           Softness constant of BTc. 1/ softnees is how manyy dis/charge the 
+           Softness constant of BTc. 1/ softnees is how many dis/charge the
            capacitor in each step
     codec : {'1.0', '1.7'}, optional
             BTc codec version to use. By default it's BTc 1.0
     state : tuple, optional
             State of previus call if it's used to process chunks of sound data.
             In the first call state can be None. By default it's None
+    workers : int, optional
+              If it's greater than 1, a long bitstream is decoded with a
+              parallel prefix scan by this number of processes. See
+              ssc.parallel. By default it's None (sequential)
+    progress : callable, optional
+               Called with a ssc.progress.Progress after each chunk of
+               ssc.progress.CHUNK bits, or with workers after each parallel
+               block. By default it's None
+    q : int, optional
+        If it's given, uses the integer fixed point engine with q fractional
+        bits (see BtcFixedDecoder) and workers are ignored. By default it's
+        None
 
     Returns
     -------
 
-    Returns a tuple of (bitstream, newstate) and newstate should be passed to
-    the next call of lin2btc.
-    
+    Returns a tuple of (fragment, newstate) and newstate should be passed to
+    the next call of btc2lin. With workers, the output could differ in +-1
+    from the sequential decoder by float rounding.
+
     """
-    
-    if not fragment:
-        raise Exception('Missing input data')
-    
-    if width != 1 and width != 2 and width != 4:
-        raise Exception('Invalid width %d' % width, width)
 
-    if soft < 2:
-        raise Exception('Invalid softness value %d. Must be >= 2' % soft, soft)
-    
-    chooser = {'1.0' : __encode_btc1_0,
-               '1.7' : __encode_btc1_7,
-              }
+    if not btcfragment:
+        raise Exception('Missing input data')
 
-    if codec in chooser:
-        return chooser[codec](fragment, width, soft, state)
+    if q is not None:
+        decoder = BtcFixedDecoder(width, soft, codec, q, state)
+    elif workers is not None and workers > 1:
+        from .parallel import decode
+        return decode(btcfragment, width, soft, codec, state, workers, \
+                      progress)
     else:
-        raise Exception('Invalid BTc version %s' % codec, codec)
+        decoder = BtcDecoder(width, soft, codec, state)
+    if progress is not None:
+        return _progress.decode(decoder, btcfragment, progress), \
+               decoder.state
+    return decoder.feed(btcfragment), decoder.state
 
 
-def __decode_btc1_0(btcfragment, width, soft, state = None):
+def btc2lin_packed(bytestring, width, soft, codec = '1.0', \
+                   bitendianness = 'MSB', nbits = None, state = None, \
+                   q = None):
     """
-    Convert 1 bit BTc 1.0 bitstream samples to Lineal PCM samples
-    
-    Binary Time Constant (BTc) it's a variant of Delta Modulation that uses a RC
-    circuiit to implement the integrator and DAC. It allow to do a quick and
-    cheap sound reproduction and recording withc very low CPU power and RAM
-    usage. Ideal for cheap umicros like 8bit PIC micros.
+    Convert a packed BTc bitstream to Lineal PCM samples
+
+    It's the same that btc2lin(unpack(bytestring)), but works directly over
+    the bytes generated by pack, decoding a whole byte (8 samples) in each
+    step with precalculated lookup tables.
 
     Parameters
     ----------
 
-    btcfragment : boolean iterable
-                  Iterable that contains a bitstream representation of BTc data
+    bytestring : bytes like
+                 Bytestring with the packed bitstream, like the output of pack
     width : int, {1, 2 , 4}
             Size in bytes of each output sample.
     soft : int
-           Softness constant of BTc. 1/ softnees is how many dis/charge the 
+           Softness constant of BTc. 1/ softnees is how many dis/charge the
            capacitor in each step
+    codec : {'1.0', '1.7'}, optional
+            BTc codec version to use. By default it's BTc 1.0
+    bitendianness : {'MSB', 'LSB'} optinal
+                    How was filled each byte. Can be 'MSB' or 'LSB'. By
+                    default it's MSB
+    nbits : int, optional
+            Number of bits to decode. By default are all bits of bytestring
     state : tuple, optional
             State of previus call if it's used to process chunks of sound data.
             In the first call state can be None. By default it's None
+    q : int, optional
+        If it's given, uses the integer fixed point engine with q fractional
+        bits (see BtcFixedDecoder). By default it's None
 
     Returns
     -------
 
     Returns a tuple of (fragment, newstate) and newstate should be passed to
-    the next call of __decode_btc1_0.
+    the next call of btc2lin_packed or btc2lin. The output could differ in
+    +-1 from btc2lin by float rounding, but not with the fixed point
+    engine.
     """
-    
-    audio = array.array(WIDTH_TYPE[width])
-    MAX = max_int(width)
 
-    if state == None:
-        last = 0.5
-    else:
-        last = state['last']
-
-    for bit in btcfragment:
-        if bit >= 1:  # Charge!
-            last = (1 - last) / soft + last
-        else:         # Discharge!
-            last -= last / soft
-
-        audio.append(int((last - 0.5) * 2 * MAX))
-    
-    newstate = {'last' : last}
-    if sys.version_info[0] >= 3: # Python 3 or 2.x ?
-        return audio.tobytes(), newstate
+    if not bytestring:
+        raise Exception('Missing input data')
+
+    if bitendianness != 'MSB' and bitendianness != 'LSB':
+        raise Exception('Invalid bit endiannes %s' % bitendianness, \
+                        bitendianness)
+
+    if nbits is not None and (nbits < 0 or nbits > len(bytestring) * 8):
+        raise Exception('Invalid number of bits %d' % nbits, nbits)
+
+    if q is not None:
+        decoder = BtcFixedDecoder(width, soft, codec, q, state)
     else:
-        return audio.tostring(), newstate
+        decoder = BtcDecoder(width, soft, codec, state)
+    return decoder.feed_packed(bytestring, bitendianness, nbits), \
+           decoder.state
 
 
-def __decode_btc1_7(btcfragment, width, soft, state = None):
+def _fixed_constants(soft, codec, q):
     """
-    Convert 1 bit BTc 1.7 bitstream samples to Lineal PCM samples
-    
-    Binary Time Constant (BTc) it's a variant of Delta Modulation that uses a RC
-    circuiit to implement the integrator and DAC. It allow to do a quick and
-    cheap sound reproduction and recording withc very low CPU power and RAM
-    usage. Ideal for cheap umicros like 8bit PIC micros.
+    Calcs the integer constants of the fixed point BTc engine
 
-    Parameters
-    ----------
+    The capacitor voltage is a unsigned integer in Q0.q format (0 is GND and
+    1 << q is Vcc), and 1/soft is the reciprocal multiplier recip, so each
+    step is last += ((target - last) * recip) >> q.
 
-    btcfragment : boolean iterable
-                  Iterable that contains a bitstream representation of BTc data
-    width : int, {1, 2 , 4}
-            Size in bytes of each output sample.
-    soft : int
-           Softness constant of BTc. 1/ softnees is how many dis/charge the 
-           capacitor in each step
-    state : tuple, optional
-            State of previus call if it's used to process chunks of sound data.
-            In the first call state can be None. By default it's None
+    Returns a tuple of (recip, targets) were targets are the target voltages
+    indexed by (lastbit << 1 | bit)
+    """
 
-    Returns
-    -------
+    if q < 4 or q > 32:
+        raise Exception('Invalid Q format %d. Must be between 4 and 32' % q, q)
 
-    Returns a tuple of (fragment, newstate) and newstate should be passed to
-    the next call of __decode_btc1_7.
-    """
+    one = 1 << q
+    recip = (one + soft // 2) // soft
+    if recip < 1:
+        raise Exception('Softness %d too big for Q%d' % (soft, q), soft)
 
-    audio = array.array(WIDTH_TYPE[width])
-    if state == None:
-        last = 0.5
-        lastbit = 0
+    if codec == '1.7':
+        # _VUP = 4 / 5.33 and _VDW = 1.33 / 5.33 rounded to Q0.q
+        vup = (400 * one + 266) // 533
+        vdw = (133 * one + 266) // 533
+        targets = (0, vup, vdw, one)
     else:
-        last = state['last']
-        lastbit = state['lastbit']
+        targets = (0, one, 0, one)
 
-    MAX = max_int(width)
+    return recip, targets
+
+
+def _fixed_tables(soft, codec, width, q):
+    """
+    Builds (and caches) the transition tables of the fixed point BTc engine
+
+    Each state of the engine is lastbit * (2**q + 1) + last (BTc 1.0 don't
+    need lastbit), so there are a finite number of states and each step can
+    be precalculated.
+
+    Returns a tuple of (limits, downs, ups, outs) were downs[state] and
+    ups[state] are the next state after a 0 or a 1 bit, limits[state] is the
+    biggest sample that is encoded as 0 from state, and outs[state] is the
+    decoded sample
+    """
 
-    for bit in btcfragment:
-        if bit >= 1 and lastbit >= 1:    # Charge to Vcc
-            last = (1 - last) / soft + last
-        elif bit >= 1 and lastbit < 1:    # Pull to 3/4 of Vcc
-            if last <= __VUP:
-                # Charge to VUp
-                last = (__VUP - last) / soft + last
+    key = ('fixed', codec, soft, width, q)
+    if key in _TABLES:
+        return _TABLES[key]
+
+    recip, targets = _fixed_constants(soft, codec, q)
+    one = 1 << q
+    size = one + 1
+    bits = 8 * width
+    MIN = min_int(width)
+    TWO_MAX = 2 * max_int(width)
+
+    limits = []
+    downs = []
+    ups = []
+    for lastbit in (range(2) if codec == '1.7' else range(1)):
+        low_target = targets[lastbit << 1]
+        high_target = targets[lastbit << 1 | 1]
+        for last in range(size):
+            low = last + (((low_target - last) * recip) >> q)
+            high = last + (((high_target - last) * recip) >> q)
+            # Encodes a 0 when 2 * sample <= high + low in Q0.q
+            threshold = high + low
+            if q >= bits:
+                limits.append((threshold >> (q - bits + 1)) + MIN)
             else:
-                # Discharge to VUp
-                last = last - (last - __VUP) / soft
-        elif bit < 1 and lastbit >= 1:   # Pull to 1/4 of Vcc
-            if last <= __VDW:
-                # Charge to VDw
-                last = (__VDW - last) / soft + last
+                limits.append((((threshold >> 1) + 1) << (bits - q)) - 1 + MIN)
+            downs.append(low)
+            ups.append(high)
+
+    if codec == '1.7':
+        ups = [high + size for high in ups]
+    outs = [((last - (one >> 1)) * TWO_MAX) >> q for last in range(size)]
+    if codec == '1.7':
+        outs = outs * 2
+
+    tables = (limits, downs, ups, outs)
+    _TABLES[key] = tables
+    return tables
+
+
+class BtcFixedEncoder(object):
+    """
+    BTc encoder that uses integer fixed point arithmetic, like a firmware
+
+    The capacitor voltage is a unsigned integer in Q0.q format, 1/soft is a
+    reciprocal multiplier and the BTc 1.7 VUp/VDw are integer constants, so
+    it's the same arithmetic that a 8 bit micro could do and there isn't any
+    float operation. The encoder tracks exactly the voltage of the
+    BtcFixedDecoder. With q <= TABLE_Q, each step is a lookup in precomputed
+    transition tables.
+
+    It's a drop-in replacement of BtcEncoder, but his state isn't
+    compatible with the float encoders. It isn't bit exact with the
+    EncodeBTc10_8 of the ANSI C lib (see lin2btc_c8), that uses integer
+    division and generates a 1 when both outcomes are at the same distance.
+    """
+
+    __slots__ = ('width', 'soft', 'codec', 'q', 'recip', 'targets', \
+                 '_tables', '_acc', '_last', '_lastbit')
+
+    def __init__(self, width, soft, codec = '1.0', q = Q, state = None, \
+                 tables = None):
+        """
+        Creates a fixed point BTc encoder
+
+        Parameters
+        ----------
+
+        width : int, {1, 2 , 4}
+                Size in bytes of each sample.
+        soft : int
+               Softness constant of BTc. 1/ softnees is how manyy dis/charge
+               the capacitor in each step
+        codec : {'1.0', '1.7'}, optional
+                BTc codec version to use. By default it's BTc 1.0
+        q : int, optional
+            Fractional bits of the capacitor voltage, from 4 to 32. By
+            default it's Q
+        state : dicctionary, optional
+                State returned by lin2btc with the same q or other fixed
+                point encoder to continue encoding a sound. By default it's
+                None
+        tables : bool, optional
+                 Uses the precomputed transition tables. By default are used
+                 if q <= TABLE_Q
+        """
+
+        _check_args(width, soft, codec)
+
+        self.width = width
+        self.soft = soft
+        self.codec = codec
+        self.q = q
+        self.recip, self.targets = _fixed_constants(soft, codec, q)
+        if tables is None:
+            tables = q <= TABLE_Q
+        self._tables = _fixed_tables(soft, codec, width, q) if tables \
+                       else None
+        self._acc = 1           # Bit accumulator with a sentinel bit
+
+        if state == None:
+            self._last = 1 << (q - 1)
+            self._lastbit = 0
+        else:
+            if state.get('q') != q:
+                raise Exception('State of other Q format', state)
+            self._last = state['lastbtc']
+            self._lastbit = state.get('lastbit', 0)
+
+    @property
+    def state(self):
+        """ Actual state, like the state returned by lin2btc """
+        if self.codec == '1.7':
+            return {'lastbtc' : self._last,
+                    'lastbit' : self._lastbit,
+                    'q' : self.q,
+                   }
+        return {'lastbtc' : self._last, 'q' : self.q}
+
+    def feed(self, fragment):
+        """
+        Encodes a chunk of sound data
+
+        Parameters
+        ----------
+
+        fragment : bytes like
+                   Bytestring representation of the sound data in signed
+                   integer samples.
+
+        Returns
+        -------
+
+        Returns a BitStream with the whole bytes generated. The bits of a
+        incomplete byte are keep until the next call to feed or flush.
+        """
+
+        view = _bytes(fragment, self.width)
+        encode = self._encode if self._tables is None else \
+                 self._encode_tables
+        bitstream = bytearray()
+        for start, stop, run in _runs(view, self.width):
+            raw = view[start:stop].cast(WIDTH_TYPE[self.width])
+            if run:
+                bitstream += self._encode_run(raw[0], len(raw))
+            else:
+                bitstream += encode(raw)
+        return BitStream(bitstream)
+
+    def flush(self):
+        """ Returns a BitStream with the bits of a incomplete byte """
+
+        acc = self._acc
+        self._acc = 1
+        if acc == 1:
+            return BitStream()
+        return BitStream(bytearray(((acc << (9 - acc.bit_length())) & 0xFF,)), \
+                         acc.bit_length() - 1)
+
+    def _encode(self, raw):
+        """ Encodes samples with integer operations """
+
+        bitstream = bytearray()
+        acc = self._acc
+        last = self._last
+        lastbit = self._lastbit
+        recip = self.recip
+        targets = self.targets
+        q = self.q
+        bits = 8 * self.width
+        MIN = min_int(self.width)
+
+        # Samples in Q0.q
+        if q >= bits:
+            values = [(sample - MIN) << (q - bits) for sample in raw]
+        else:
+            values = [(sample - MIN) >> (bits - q) for sample in raw]
+
+        for value in values:
+            index = lastbit << 1
+            high = last + (((targets[index | 1] - last) * recip) >> q)
+            low = last + (((targets[index] - last) * recip) >> q)
+
+            # See wath outcome it's closest to the new sample and generate bit
+            if value + value <= high + low:
+                acc <<= 1
+                lastbit = 0
+                last = low
+            else:
+                acc = (acc << 1) | 1
+                lastbit = 1
+                last = high
+
+            if acc > 0xFF:          # A byte is full
+                bitstream.append(acc & 0xFF)
+                acc = 1
+
+        self._acc = acc
+        self._last = last
+        self._lastbit = lastbit if self.codec == '1.7' else 0
+        return bitstream
+
+    def _encode_tables(self, raw):
+        """ Encodes samples with the transition tables """
+
+        bitstream = bytearray()
+        acc = self._acc
+        size = (1 << self.q) + 1
+        state = self._lastbit * size + self._last
+        limits, downs, ups, outs = self._tables
+
+        for sample in raw:
+            if sample <= limits[state]:
+                acc <<= 1
+                state = downs[state]
             else:
-                # Discharge to VDw
-                last -= (last - __VDW) / soft
-        elif bit < 1 and lastbit < 1:    # Discharge to GND
-            last -= last / soft
+                acc = (acc << 1) | 1
+                state = ups[state]
+
+            if acc > 0xFF:          # A byte is full
+                bitstream.append(acc & 0xFF)
+                acc = 1
+
+        self._acc = acc
+        self._lastbit, self._last = divmod(state, size)
+        return bitstream
+
+    def _encode_run(self, sample, count):
+        """
+        Encodes a run of equal samples detecting the cycle of the state.
+        Returns the whole bytes generated
+        """
+
+        if self._tables is not None:
+            size = (1 << self.q) + 1
+            limits, downs, ups, outs = self._tables
+
+            def step(state):
+                """ Same operations that _encode_tables """
+                if sample <= limits[state]:
+                    return 0, downs[state]
+                return 1, ups[state]
+
+            bitstream, self._acc, state = _encode_constant( \
+                    step, self._lastbit * size + self._last, self._acc, count)
+            self._lastbit, self._last = divmod(state, size)
+            return bitstream
+
+        recip = self.recip
+        targets = self.targets
+        q = self.q
+        bits = 8 * self.width
+        if q >= bits:
+            value = (sample - min_int(self.width)) << (q - bits)
+        else:
+            value = (sample - min_int(self.width)) >> (bits - q)
 
-        audio.append(int((last - 0.5) * 2 * MAX))
-        lastbit = bit
+        def step(state):
+            """ Same operations that _encode """
+            last, lastbit = state
+            index = lastbit << 1
+            high = last + (((targets[index | 1] - last) * recip) >> q)
+            low = last + (((targets[index] - last) * recip) >> q)
+            if value + value <= high + low:
+                return 0, (low, 0)
+            return 1, (high, 1)
 
-    newstate = {'last' : last, 'lastbit' : lastbit}
-    if sys.version_info[0] >= 3: # Python 3 or 2.x ?
-        return audio.tobytes(), newstate
-    else:
-        return audio.tostring(), newstate
+        bitstream, self._acc, (self._last, lastbit) = _encode_constant( \
+                step, (self._last, self._lastbit), self._acc, count)
+        self._lastbit = lastbit if self.codec == '1.7' else 0
+        return bitstream
 
 
-def btc2lin(btcfragment, width, soft, codec = '1.0', state = None):
+class BtcFixedDecoder(object):
     """
-    Convert 1 bit BTc bitstream samples to Lineal PCM samples
-    
-    Binary Time Constant (BTc) it's a variant of Delta Modulation that uses a RC
-    circuiit to implement the integrator and DAC. It allow to do a quick and
-    cheap sound reproduction and recording withc very low CPU power and RAM
-    usage. Ideal for cheap umicros like 8bit PIC micros.
+    BTc decoder that uses integer fixed point arithmetic, like a firmware
+
+    It's the decoder of BtcFixedEncoder, and a drop-in replacement of
+    BtcDecoder. Each step is last += ((target - last) * recip) >> q, or a
+    lookup in precomputed transition tables with q <= TABLE_Q. The output
+    is exact, so feed and feed_packed give the same samples.
+    """
+
+    __slots__ = ('width', 'soft', 'codec', 'q', 'recip', 'targets', \
+                 '_tables', '_last', '_lastbit')
+
+    def __init__(self, width, soft, codec = '1.0', q = Q, state = None, \
+                 tables = None):
+        """
+        Creates a fixed point BTc decoder
+
+        Parameters
+        ----------
+
+        width : int, {1, 2 , 4}
+                Size in bytes of each output sample.
+        soft : int
+               Softness constant of BTc. 1/ softnees is how many dis/charge
+               the capacitor in each step
+        codec : {'1.0', '1.7'}, optional
+                BTc codec version to use. By default it's BTc 1.0
+        q : int, optional
+            Fractional bits of the capacitor voltage, from 4 to 32. By
+            default it's Q
+        state : dicctionary, optional
+                State returned by btc2lin with the same q or other fixed
+                point decoder to continue decoding a sound. By default it's
+                None
+        tables : bool, optional
+                 Uses the precomputed transition tables. By default are used
+                 if q <= TABLE_Q
+        """
+
+        _check_args(width, soft, codec)
+
+        self.width = width
+        self.soft = soft
+        self.codec = codec
+        self.q = q
+        self.recip, self.targets = _fixed_constants(soft, codec, q)
+        if tables is None:
+            tables = q <= TABLE_Q
+        self._tables = _fixed_tables(soft, codec, width, q) if tables \
+                       else None
+
+        if state == None:
+            self._last = 1 << (q - 1)
+            self._lastbit = 0
+        else:
+            if state.get('q') != q:
+                raise Exception('State of other Q format', state)
+            self._last = state['last']
+            self._lastbit = state.get('lastbit', 0)
+
+    @property
+    def state(self):
+        """ Actual state, like the state returned by btc2lin """
+        if self.codec == '1.7':
+            return {'last' : self._last, 'lastbit' : self._lastbit, \
+                    'q' : self.q}
+        return {'last' : self._last, 'q' : self.q}
+
+    def feed(self, btcfragment):
+        """
+        Decodes a chunk of BTc bitstream
+
+        Parameters
+        ----------
+
+        btcfragment : boolean iterable
+                      Iterable that contains a bitstream representation of BTc
+                      data
+
+        Returns
+        -------
+
+        Returns a bytestring with the decoded samples
+        """
+
+        if self._tables is not None:
+            audio = self._decode_tables(btcfragment)
+        else:
+            audio = self._decode(btcfragment)
+
+        if sys.version_info[0] >= 3: # Python 3 or 2.x ?
+            return audio.tobytes()
+        else:
+            return audio.tostring()
+
+    def flush(self):
+        """ Decoder not keeps any pending data, so returns a empty fragment """
+        return b''
+
+    def feed_packed(self, bytestring, bitendianness = 'MSB', nbits = None):
+        """
+        Decodes a chunk of packed BTc bitstream. See BtcDecoder.feed_packed
+        """
+
+        if nbits is None:
+            nbits = len(bytestring) * 8
+        return self.feed(BitStream(bytes(bytestring), nbits, bitendianness))
+
+    def _decode(self, btcfragment):
+        """ Decodes a bitstream with integer operations """
+
+        audio = array.array(WIDTH_TYPE[self.width])
+        append = audio.append
+        TWO_MAX = 2 * max_int(self.width)
+        recip = self.recip
+        targets = self.targets
+        q = self.q
+        half = 1 << (q - 1)
+        last = self._last
+        lastbit = self._lastbit
+
+        for bit in btcfragment:
+            bit = 1 if bit >= 1 else 0
+            last += ((targets[lastbit << 1 | bit] - last) * recip) >> q
+            append(((last - half) * TWO_MAX) >> q)
+            lastbit = bit
+
+        self._last = last
+        self._lastbit = lastbit if self.codec == '1.7' else 0
+        return audio
+
+    def _decode_tables(self, btcfragment):
+        """ Decodes a bitstream with the transition tables """
+
+        audio = array.array(WIDTH_TYPE[self.width])
+        append = audio.append
+        size = (1 << self.q) + 1
+        state = self._lastbit * size + self._last
+        limits, downs, ups, outs = self._tables
+
+        for bit in btcfragment:
+            state = ups[state] if bit >= 1 else downs[state]
+            append(outs[state])
+
+        self._lastbit, self._last = divmod(state, size)
+        return audio
+
+
+def lin2btc_c8(fragment, soft, state = None):
+    """
+    Encodes unsigned 8 bit samples with BTc 1.0, bit for bit like
+    EncodeBTc10_8 of the ANSI C lib
+
+    It uses the same 8 bit integer arithmetic of the C encoder: the samples
+    are scaled to sample / 2 + 64, the capacitor voltage begins at 128 and
+    each step is (256 - lastbtc) / soft or lastbtc / soft with integer
+    division, all truncated to 8 bits. A 1 is generated when the high
+    outcome is at the same distance or nearer to the sample than the low
+    outcome. The bits are in MSB order, like with BTC_BIG_ENDIAN.
+
+    It isn't the same that BtcFixedEncoder, that rounds 1/soft to a Q0.q
+    reciprocal and generates a 0 when both outcomes are at the same
+    distance.
 
     Parameters
     ----------
 
-    btcfragment : boolean iterable
-                  Iterable that contains a bitstream representation of BTc data
-    width : int, {1, 2 , 4}
-            Size in bytes of each output sample.
+    fragment : bytes like
+               Bytestring of unsigned 8 bit samples
     soft : int
-           Softness constant of BTc. 1/ softnees is how many dis/charge the 
-           capacitor in each step
-    codec : {'1.0', '1.7'}, optional
-            BTc codec version to use. By default it's BTc 1.0
-    state : tuple, optional
-            State of previus call if it's used to process chunks of sound data.
-            In the first call state can be None. By default it's None
+           Softness constant of BTc, from 1 to 255
+    state : dicctionary, optional
+            State returned by a previous call to continue encoding a sound.
+            By default it's None
 
     Returns
     -------
 
-    Returns a tuple of (fragment, newstate) and newstate should be passed to
-    the next call of btc2lin.
-    
+    Returns a tuple of (bitstream, state) were bitstream is a BitStream with
+    a bit by sample and state is the state of the encoder
     """
-    
-    if not btcfragment:
-        raise Exception('Missing input data')
 
-    if width != 1 and width != 2 and width != 4:
-        raise Exception('Invalid width %d' % width, width)
+    if soft < 1 or soft > 255:
+        raise Exception('Invalid softness value %d. Must be between 1 and ' \
+                        '255' % soft, soft)
 
-    if soft < 2:
-        raise Exception('Invalid softness value %d. Must be >= 2' % soft, soft)
-    
-    chooser = {'1.0' : __decode_btc1_0,
-               '1.7' : __decode_btc1_7,
-              }
+    lastbtc = 128 if state is None else state['lastbtc']
+    bits = bytearray()
+    append = bits.append
+    for sample in _bytes(fragment, 1):
+        sample = sample // 2 + 64   # Escalates the sample between 64 and 191
 
-    if codec in chooser:
-        return chooser[codec](btcfragment, width, soft, state)
-    else:
-        raise Exception('Invalid BTc version %s' % codec, codec)
+        highbtc = (lastbtc + ((256 - lastbtc) & 0xFF) // soft) & 0xFF
+        lowbtc = (lastbtc - lastbtc // soft) & 0xFF
+
+        if abs(highbtc - sample) > abs(lowbtc - sample):    # Low is closest
+            append(0)
+            lastbtc = lowbtc
+        else:
+            append(1)
+            lastbtc = highbtc
+
+    return BitStream(pack(bits), len(bits)), {'lastbtc' : lastbtc}
 
 
 def calc_rc(bitrate, soft, cval=0.22*(10**-6)):
@@ -439,17 +1335,17 @@ def calc_rc(bitrate, soft, cval=0.22*(10**-6)):
 
     bitrate : int
               Desired bitrate to use
-    soft : int 
+    soft : int
            Desire softness constant to use
     cval : float
            Desire capacitor value in Farads. By default 0.22 uF
 
     Returns a tuple of Resistor value in Ohms and Capacitor value in Farads
-    
+
     """
 
     from math import log
-    
+
     if bitrate < 50:
         raise Exception('Invalid bitrate value %d Hz. Must be >= 50 Hz' % \
                         bitrate, bitrate)
@@ -459,10 +1355,7 @@ def calc_rc(bitrate, soft, cval=0.22*(10**-6)):
 
     if cval <= 0:
         raise Exception('Invalid capacitor value %f. Must be > 0' % cval, cval)
-    
+
     rval = -1.0 / (log(-1.0 / soft + 1) * bitrate * cval)
 
     return rval, cval
-
-
-
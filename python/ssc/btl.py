@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+BotTalk Library (BTL) files
+
+A BotTalk Library is a image of packed sounds for the flash memory of a
+micro. It begins with a header of HEADER_SIZE bytes with a big endian 32 bit
+pointer to the end of each sound, in blocks of BLOCK bytes and relative to
+the end of the header. Each sound is padded to fill whole blocks, and the
+unused pointers are 0.
+
+"""
+import mmap
+import struct
+
+HEADER_SIZE = 1024  # Size in bytes of the header
+BLOCK = 32          # Sounds are aligned to blocks of this size
+MAX_SOUNDS = HEADER_SIZE // 4
+
+
+def header(sizes):
+    """
+    Returns a bytearray with the header of a BotTalk Library
+
+    Parameters
+    ----------
+
+    sizes : iterable of ints
+            Size in bytes of each sound, padded to fill whole blocks
+    """
+
+    sizes = list(sizes)
+    if len(sizes) > MAX_SOUNDS:
+        raise Exception('Too many sounds %d. Max. is %d' % \
+                        (len(sizes), MAX_SOUNDS), len(sizes))
+
+    data = bytearray(HEADER_SIZE)
+    end = 0
+    for i, size in enumerate(sizes):
+        if size <= 0 or size % BLOCK:
+            raise Exception('Invalid sound size %d' % size, size)
+        end += size
+        struct.pack_into('>I', data, i * 4, (end // BLOCK) & 0xFFFFFF)
+    return data
+
+
+def pointers(data):
+    """ Returns a tuple with the end pointers of the used entries of a
+    header. The first 0 pointer ends the list
+    """
+    values = struct.unpack('>%dI' % MAX_SOUNDS, data[:HEADER_SIZE])
+    try:
+        return values[:values.index(0)]
+    except ValueError:
+        return values
+
+
+class Library(object):
+    """
+    Read only BotTalk Library, mapped in memory
+
+    The file is mmaped and only the header is parsed when it's opened, so
+    big images are opened instantly. Each sound is a memoryview of the map,
+    without copy, and it's decoded only when is requested. Works like a
+    sequence of sounds: len(lib), lib[i] and for sound in lib.
+
+    The memoryviews of the sounds must be released before close the
+    library.
+    """
+
+    def __init__(self, filename, check = True):
+        """
+        Opens a BotTalk Library
+
+        Parameters
+        ----------
+
+        filename : str
+                   BotTalk Library file
+        check : bool, optional
+                Validates the header when it's opened (see validate). By
+                default it's True
+        """
+
+        with open(filename, 'rb') as f:
+            f.seek(0, 2)
+            if f.tell() < HEADER_SIZE:
+                raise Exception('Invalid BotTalk Library. Size %d' % \
+                                f.tell(), f.tell())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._view = memoryview(self._map)
+        ends = pointers(self._view)
+        starts = (0,) + ends[:-1]
+        # (offset, blocks) of each sound
+        self.index = [(HEADER_SIZE + start * BLOCK, end - start) \
+                      for start, end in zip(starts, ends)]
+        if check:
+            try:
+                self.validate()
+            except Exception:
+                self.close()
+                raise
+
+    def validate(self):
+        """
+        Checks that the pointers are 24 bit values that grow, that the
+        unused pointers are 0 and that all sounds are in the file.
+        Raises a Exception if the library isn't valid
+        """
+
+        values = struct.unpack('>%dI' % MAX_SOUNDS, self._view[:HEADER_SIZE])
+        for i, value in enumerate(values[len(self.index):]):
+            if value:
+                raise Exception('Invalid pointer %d after the last sound' % \
+                                (i + len(self.index)), i + len(self.index))
+
+        for i, (offset, blocks) in enumerate(self.index):
+            if blocks <= 0:
+                raise Exception('Invalid pointer %d of sound %d' % \
+                                (values[i], i), i)
+            if values[i] > 0xFFFFFF:
+                raise Exception('Invalid pointer %d. Must be 24 bit' % \
+                                values[i], i)
+
+        if self.index:
+            offset, blocks = self.index[-1]
+            end = offset + blocks * BLOCK
+            if end > len(self._map):
+                raise Exception('Truncated BotTalk Library. Needs %d bytes' % \
+                                end, end)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        """ Returns a memoryview of the packed data of a sound, with his
+        padding
+        """
+        offset, blocks = self.index[index]
+        return self._view[offset:offset + blocks * BLOCK]
+
+    def __iter__(self):
+        for i in range(len(self.index)):
+            yield self[i]
+
+    def decode(self, index, decoder):
+        """
+        Decodes a sound
+
+        Parameters
+        ----------
+
+        index : int
+                Index of the sound
+        decoder : BtcDecoder or DmDecoder
+                  Decoder with the codec and parameters of the library
+
+        Returns
+        -------
+
+        Returns a bytestring with the samples. The padding is decoded too.
+        """
+
+        sound = self[index]
+        try:
+            return decoder.feed_packed(sound) + decoder.flush()
+        finally:
+            sound.release()
+
+    def close(self):
+        """ Closes the library """
+        if self._map is not None:
+            self._view.release()
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
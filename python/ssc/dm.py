@@ -6,10 +6,190 @@ from __future__ import division
 
 import array
 import sys
-from .aux import max_int, min_int, WIDTH_TYPE
+from .aux import max_int, min_int, WIDTH_TYPE, BIT_REVERSE, _bytes, \
+                 _lazy_import, _runs, _encode_constant
+from .bitstream import BitStream
+from . import progress as _progress
 
+# Try to grab NumPy. It's loaded when it's used the first time
+try:
+    numpy = _lazy_import('numpy')
+    _NUMPY = True
+except ImportError:
+    _NUMPY = False
 
-def lin2dm(fragment, width, delta = None, a_cte = 1.0, state = None):
+# Cache of lookup tables used by the packed decoder
+_TABLES = {}
+
+
+class DmEncoder(object):
+    """
+    Stateful Delta Modulation encoder that converts chunks of Lineal PCM
+
+    Arguments are validated and constants are calculated only once, so it's
+    suitable to encode small frames of a real-time sound.
+    """
+
+    __slots__ = ('width', 'delta', 'a_cte', '_max', '_min', '_integrator', \
+                 '_acc')
+
+    def __init__(self, width, delta = None, a_cte = 1.0, state = None):
+        """
+        Creates a DM encoder
+
+        Parameters
+        ----------
+
+        width : int, {1, 2, 4}
+                Size in bytes of each sample.
+        delta : int
+                Delta constant of DM modulation. By default it's 1/21 of Max
+                sample value
+        a_cte : float
+                Sets Integrator decay value. By default it's 1.0 (no decay)
+        state : dicctionary, optional
+                State returned by lin2dm or other encoder to continue encoding
+                a sound. By default it's None
+        """
+
+        if width != 1 and width != 2 and width != 4:
+            raise Exception('Invalid width %d' % width, width)
+
+        MAX = max_int(width)
+
+        if a_cte > 1.0 or a_cte <= 0:
+            raise Exception('Invalid a value %d. Must be 1 >= a > 0' % a_cte, \
+                            a_cte)
+
+        if delta is None:
+            delta = MAX // 21
+        elif delta <= 0 or delta > MAX//2:
+            raise Exception('Invalid delta value %d. Must be > 0 and <= %d' %
+                            (delta, MAX//2), delta)
+
+        self.width = width
+        self.delta = delta
+        self.a_cte = a_cte
+        self._max = MAX
+        self._min = min_int(width)
+        self._acc = 1           # Bit accumulator with a sentinel bit
+
+        if state == None:
+            self._integrator = MAX//2
+        else:
+            self._integrator = state['integrator']
+
+    @property
+    def state(self):
+        """ Actual state, like the state returned by lin2dm """
+        return {'integrator' : self._integrator}
+
+    def feed(self, fragment):
+        """
+        Encodes a chunk of sound data
+
+        Parameters
+        ----------
+
+        fragment : bytes like
+                   Bytestring representation of the sound data in signed
+                   integer samples.
+
+        Returns
+        -------
+
+        Returns a BitStream with the whole bytes generated. The bits of a
+        incomplete byte are keep until the next call to feed or flush.
+        """
+
+        view = _bytes(fragment, self.width)
+        stream = bytearray()
+        for start, stop, run in _runs(view, self.width):
+            raw = view[start:stop].cast(WIDTH_TYPE[self.width])
+            if run:
+                stream += self._encode_run(raw[0], len(raw))
+            else:
+                stream += self._encode(raw)
+        return BitStream(stream)
+
+    def _encode(self, raw):
+        """ Encodes samples. Returns the whole bytes generated """
+
+        stream = bytearray()
+        acc = self._acc
+        integrator = self._integrator
+        delta = self.delta
+        a_cte = self.a_cte
+        MAX = self._max
+        MIN = self._min
+
+        for sample in raw:
+            highval = integrator + delta
+            lowval = integrator - delta
+
+            disthigh = abs(highval - sample)
+            distlow = abs(lowval - sample)
+
+            # Choose integrator with less diference to sample value
+            if disthigh >= distlow:
+                acc <<= 1
+                integrator = lowval
+            else:
+                acc = (acc << 1) | 1
+                integrator = highval
+
+            if acc > 0xFF:          # A byte is full
+                stream.append(acc & 0xFF)
+                acc = 1
+
+            integrator = max(integrator, MIN)
+            integrator = min(integrator, MAX)
+            integrator = int(integrator * a_cte)
+
+        self._acc = acc
+        self._integrator = integrator
+        return stream
+
+    def _encode_run(self, sample, count):
+        """
+        Encodes a run of equal samples detecting the cycle of the integrator.
+        Returns the whole bytes generated
+        """
+
+        delta = self.delta
+        a_cte = self.a_cte
+        MAX = self._max
+        MIN = self._min
+
+        def step(integrator):
+            """ Same operations that _encode """
+            highval = integrator + delta
+            lowval = integrator - delta
+            if abs(highval - sample) >= abs(lowval - sample):
+                bit = 0
+                integrator = lowval
+            else:
+                bit = 1
+                integrator = highval
+            return bit, int(min(max(integrator, MIN), MAX) * a_cte)
+
+        stream, self._acc, self._integrator = \
+            _encode_constant(step, self._integrator, self._acc, count)
+        return stream
+
+    def flush(self):
+        """ Returns a BitStream with the bits of a incomplete byte """
+
+        acc = self._acc
+        self._acc = 1
+        if acc == 1:
+            return BitStream()
+        return BitStream(bytearray(((acc << (9 - acc.bit_length())) & 0xFF,)), \
+                         acc.bit_length() - 1)
+
+
+def lin2dm(fragment, width, delta = None, a_cte = 1.0, state = None, \
+           workers = None, progress = None):
     """
     Convert samples from Lineal PCM to 1 bit Delta Modulation encoding
 
@@ -29,77 +209,299 @@ def lin2dm(fragment, width, delta = None, a_cte = 1.0, state = None):
     state : dicctionary, optional
             State of previus call if it's used to process chunks of sound data.
             In the first call state can be None. By default it's None
-    
+    workers : int, optional
+              If it's greater than 1, a long sound is split in chunks that
+              are encoded in parallel by this number of processes. The
+              output is the same. See ssc.parallel. By default it's None
+              (sequential)
+    progress : callable, optional
+               Called with a ssc.progress.Progress after each chunk of
+               ssc.progress.CHUNK samples, or with workers after each
+               parallel chunk. By default it's None
+
     Returns
     -------
-    Returns a tuple of (bitstream, newstate) and newstate should be passed to
-    the next call of lin2dm.
+    Returns a tuple of (bitstream, newstate), were bitstream is a BitStream,
+    and newstate should be passed to the next call of lin2dm.
     """
-   
-    if not fragment:
+
+    if not memoryview(fragment).nbytes:
         raise Exception('Missing input data')
-    
-    if width != 1 and width != 2 and width != 4:
-        raise Exception('Invalid width %d' % width, width)
-
-    MAX = max_int(width)
-    MIN = min_int(width)
-    
-    if a_cte > 1.0 or a_cte <= 0:
-        raise Exception('Invalid a value %d. Must be 1 >= a > 0' % a_cte, a_cte)
-
-    if delta and (delta <= 0 or delta > MAX//2):
-        raise Exception('Invalid delta value %d. Must be > 0 and <= %d' %
-                        (delta, MAX//2), delta)
-    elif delta is None:
-        delta = MAX // 21
-
-
-    raw = array.array(WIDTH_TYPE[width])
-    if sys.version_info[0] >= 3: # Python 3 or 2.x ?
-        raw.frombytes(fragment)
-    else:
-        raw.fromstring(fragment)
-    
-    if state == None:
-        integrator = MAX//2
-    else:
-        integrator = state['integrator']
-    
-    stream = []
-    for sample in raw:
-        highval = integrator + delta
-        lowval = integrator - delta
-
-        disthigh = abs(highval - sample)
-        distlow = abs(lowval - sample)
-        
-        # Choose integrator with less diference to sample value
-        if disthigh >= distlow:
-            stream.append(False)
-            integrator = lowval
+
+    if workers is not None and workers > 1:
+        from .parallel import encode
+        return encode('dm', fragment, width, (delta, a_cte), state, workers, \
+                      progress)
+
+    encoder = DmEncoder(width, delta, a_cte, state)
+    if progress is not None:
+        return _progress.encode(encoder, fragment, width, progress), \
+               encoder.state
+
+    bitstream = encoder.feed(fragment)
+    bitstream.extend(encoder.flush())
+    return bitstream, encoder.state
+
+
+def _dm_tables(delta):
+    """
+    Builds (and caches) the lookup tables used by the packed DM decoder
+
+    Without clamping and decay, the integrator after the bit i of a byte is
+    integrator + offset_i, were offset_i only depends of the byte value.
+
+    Returns
+    -------
+
+    Returns a tuple of (offsets, lows, highs) indexed by the byte value in MSB
+    order, were offsets[byte] are the 8 integrator offsets and lows/highs are
+    the minimun and maximun offset of the byte
+    """
+
+    if delta in _TABLES:
+        return _TABLES[delta]
+
+    offsets = []
+    for byte in range(256):
+        offset = 0
+        outs = []
+        for i in range(7, -1, -1):
+            if (byte >> i) & 1:
+                offset += delta
+            else:
+                offset -= delta
+            outs.append(offset)
+        offsets.append(tuple(outs))
+
+    lows = tuple(min(outs) for outs in offsets)
+    highs = tuple(max(outs) for outs in offsets)
+    tables = (tuple(offsets), lows, highs)
+    _TABLES[delta] = tables
+    return tables
+
+
+class DmDecoder(object):
+    """
+    Stateful Delta Modulation decoder that converts chunks of DM bitstream
+
+    Arguments are validated and lookup tables are calculated only once, so
+    it's suitable to decode small frames of a real-time sound.
+    """
+
+    __slots__ = ('width', 'delta', 'a_cte', '_max', '_min', '_tables', \
+                 '_integrator')
+
+    def __init__(self, width, delta = None, a_cte = 1.0, state = None):
+        """
+        Creates a DM decoder
+
+        Parameters
+        ----------
+
+        width : int, {1, 2, 4}
+                Size in bytes of each sample.
+        delta : int
+                Delta constant of DM modulation. By default it's 1/21 of Max
+                sample value
+        a_cte : float
+                Sets Integrator decay value. By default it's 1.0 (no decay)
+        state : dicctionary, optional
+                State returned by dm2lin or other decoder to continue decoding
+                a sound. By default it's None
+        """
+
+        if width != 1 and width != 2 and width != 4:
+            raise Exception('Invalid width %d' % width, width)
+
+        MAX = max_int(width)
+
+        if a_cte > 1.0 or a_cte <= 0:
+            raise Exception('Invalid a value %d. Must be 1 >= a > 0' % a_cte, \
+                            a_cte)
+
+        if delta is None:
+            delta = MAX // 21
+        elif delta <= 0 or delta > MAX//2:
+            raise Exception('Invalid delta value %d. Must be > 0 and <= %d' %
+                            (delta, MAX//2), delta)
+
+        self.width = width
+        self.delta = delta
+        self.a_cte = a_cte
+        self._max = MAX
+        self._min = min_int(width)
+        self._tables = _dm_tables(delta)
+
+        if state == None:
+            self._integrator = MAX//2
+        else:
+            self._integrator = state['integrator']
+
+    @property
+    def state(self):
+        """ Actual state, like the state returned by dm2lin """
+        return {'integrator' : self._integrator}
+
+    def feed(self, dmfragment):
+        """
+        Decodes a chunk of DM bitstream
+
+        Parameters
+        ----------
+
+        dmfragment : boolean iterable
+                     Iterable that contains a bitstream representation of DM
+                     data. A BitStream is decoded directly from his packed data
+
+        Returns
+        -------
+
+        Returns a bytestring with the decoded samples
+        """
+
+        if isinstance(dmfragment, BitStream):
+            return self.feed_packed(dmfragment.data, dmfragment.bitorder, \
+                                    len(dmfragment))
+
+        audio = array.array(WIDTH_TYPE[self.width])
+        append = audio.append
+        integrator = self._integrator
+        delta = self.delta
+        a_cte = self.a_cte
+        MAX = self._max
+        MIN = self._min
+
+        for bit in dmfragment:
+            if bit:
+                integrator = integrator + delta
+            else:
+                integrator = integrator - delta
+
+            # Clamp to signed 16 bit
+            integrator = max(integrator, MIN)
+            integrator = min(integrator, MAX)
+
+            integrator = int(integrator * a_cte)
+
+            append(integrator)
+
+        self._integrator = integrator
+        if sys.version_info[0] >= 3: # Python 3 or 2.x ?
+            return audio.tobytes()
         else:
-            stream.append(True)
-            integrator = highval
+            return audio.tostring()
+
+    def flush(self):
+        """ Decoder not keeps any pending data, so returns a empty fragment """
+        return b''
+
+    def feed_packed(self, bytestring, bitendianness = 'MSB', nbits = None):
+        """
+        Decodes a chunk of packed DM bitstream
+
+        When there isn't integrator decay, each byte that not clamps the
+        integrator is decoded in a single step.
+
+        Parameters
+        ----------
+
+        bytestring : bytes like
+                     Bytestring with the packed bitstream, like the output of
+                     pack
+        bitendianness : {'MSB', 'LSB'} optinal
+                        How was filled each byte. Can be 'MSB' or 'LSB'. By
+                        default it's MSB
+        nbits : int, optional
+                Number of bits to decode. By default are all bits of
+                bytestring
+
+        Returns
+        -------
+
+        Returns a bytestring with the decoded samples
+        """
+
+        if nbits is None:
+            nbits = len(bytestring) * 8
+
+        data = bytes(bytestring)
+        if bitendianness == 'LSB':
+            data = data.translate(BIT_REVERSE)
+
+        integrator = self._integrator
+        delta = self.delta
+        a_cte = self.a_cte
+        MAX = self._max
+        MIN = self._min
+
+        audio = array.array(WIDTH_TYPE[self.width])
+        extend = audio.extend
+        pos = 0                     # Number of decoded bits
+
+        if a_cte == 1.0 and _NUMPY and nbits >= 512:
+            # If the integrator never clamps, it's only a cumulative sum
+            bits = numpy.unpackbits(numpy.frombuffer(data, \
+                                    dtype=numpy.uint8), count=nbits)
+            steps = bits.astype(numpy.int64) * (2 * delta) - delta
+            integrators = numpy.cumsum(steps) + integrator
+            if integrators.min() >= MIN and integrators.max() <= MAX:
+                audio.frombytes(integrators.astype( \
+                        numpy.dtype(WIDTH_TYPE[self.width])).tobytes())
+                integrator = int(integrators[-1])
+                pos = nbits
+
+        offsets, lows, highs = self._tables
+        if a_cte == 1.0:
+            full = nbits // 8
+        else:
+            full = 0                # With decay, tables can't be used
+
+        while pos < nbits:
+            byte = data[pos >> 3]
+            if pos >> 3 < full and integrator + lows[byte] >= MIN \
+                    and integrator + highs[byte] <= MAX:
+                o0, o1, o2, o3, o4, o5, o6, o7 = offsets[byte]
+                extend((integrator + o0, integrator + o1, integrator + o2, \
+                        integrator + o3, integrator + o4, integrator + o5, \
+                        integrator + o6, integrator + o7))
+                integrator += o7
+                pos += 8
+                continue
+
+            # Clamps or decays, so is decoded bit a bit like dm2lin
+            for shift in range(7, 7 - min(8, nbits - pos), -1):
+                if (byte >> shift) & 1:
+                    integrator = integrator + delta
+                else:
+                    integrator = integrator - delta
+
+                # Clamp to signed 16 bit
+                integrator = max(integrator, MIN)
+                integrator = min(integrator, MAX)
 
-        integrator = max(integrator, MIN)
-        integrator = min(integrator, MAX)
-        integrator = int(integrator * a_cte)
-   
-    newstate = {'integrator' : integrator}
-    return stream, newstate
+                integrator = int(integrator * a_cte)
 
+                audio.append(integrator)
+            pos += 8
 
-def dm2lin(dmfragment, width, delta = None, a_cte = 1.0, state = None):
+        self._integrator = integrator
+        if sys.version_info[0] >= 3: # Python 3 or 2.x ?
+            return audio.tobytes()
+        else:
+            return audio.tostring()
+
+
+def dm2lin(dmfragment, width, delta = None, a_cte = 1.0, state = None, \
+           progress = None):
     """
     Convert samples from 1 bit Delta Modulation encoding to Lineal PCM
 
     Parameters
     ----------
 
-    fragment : iterable
-               Iterable that contains a bytestring representation of the sound
-               data in signed integer samples.
+    dmfragment : boolean iterable
+                 Iterable that contains a bitstream representation of DM data.
+                 A BitStream is decoded directly from his packed data
     width : int, {1, 2, 4}
             Size in bytes of each sample.
     delta : int
@@ -110,56 +512,76 @@ def dm2lin(dmfragment, width, delta = None, a_cte = 1.0, state = None):
     state : dicctionary, optional
             State of previus call if it's used to process chunks of sound data.
             In the first call state can be None. By default it's None
+    progress : callable, optional
+               Called with a ssc.progress.Progress after each chunk of
+               ssc.progress.CHUNK bits. By default it's None
 
     Returns
     -------
     Returns a tuple of (fragment, newstate) and newstate should be passed to
     the next call of dm2lin.
     """
-    
+
     if not dmfragment:
         raise Exception('Missing input data')
-    
-    if width != 1 and width != 2 and width != 4:
-        raise Exception('Invalid width %d' % width, width)
-
-    MAX = max_int(width)
-    MIN = min_int(width)
-    
-    if a_cte > 1.0:
-        raise Exception('Invalid a value %d. Must be <= 1' % a_cte, a_cte)
-
-    if delta and delta <= 0:
-        raise Exception('Invalid delta value %d. Must be > 0' % delta, delta)
-    elif delta is None:
-        delta = MAX // 21
-    
-    if state == None:
-        integrator = MAX//2
-    else:
-        integrator = state['integrator']
-
-    audio = array.array(WIDTH_TYPE[width])
-
-    for bit in dmfragment:
-        if bit:
-            integrator = integrator + delta
-        else:
-            integrator = integrator - delta
 
-        # Clamp to signed 16 bit
-        integrator = max(integrator, MIN)
-        integrator = min(integrator, MAX)
+    decoder = DmDecoder(width, delta, a_cte, state)
+    if progress is not None:
+        return _progress.decode(decoder, dmfragment, progress), \
+               decoder.state
+    return decoder.feed(dmfragment), decoder.state
+
+
+def dm2lin_packed(bytestring, width, delta = None, a_cte = 1.0, \
+                  bitendianness = 'MSB', nbits = None, state = None):
+    """
+    Convert a packed Delta Modulation bitstream to Lineal PCM
+
+    It's the same that dm2lin(unpack(bytestring)), but works directly over
+    the bytes generated by pack. When there isn't integrator decay, each byte
+    that not clamps the integrator is decoded in a single step with
+    precalculated lookup tables.
+
+    Parameters
+    ----------
+
+    bytestring : bytes like
+                 Bytestring with the packed bitstream, like the output of pack
+    width : int, {1, 2, 4}
+            Size in bytes of each sample.
+    delta : int
+            Delta constant of DM modulation. By default it's 1/21 of Max sample
+            value
+    a_cte : float
+            Sets Integrator decay value. By default it's 1.0 (no decay)
+    bitendianness : {'MSB', 'LSB'} optinal
+                    How was filled each byte. Can be 'MSB' or 'LSB'. By
+                    default it's MSB
+    nbits : int, optional
+            Number of bits to decode. By default are all bits of bytestring
+    state : dicctionary, optional
+            State of previus call if it's used to process chunks of sound data.
+            In the first call state can be None. By default it's None
+
+    Returns
+    -------
+    Returns a tuple of (fragment, newstate) and newstate should be passed to
+    the next call of dm2lin_packed or dm2lin.
+    """
+
+    if not bytestring:
+        raise Exception('Missing input data')
 
-        integrator = int(integrator * a_cte)
+    if bitendianness != 'MSB' and bitendianness != 'LSB':
+        raise Exception('Invalid bit endiannes %s' % bitendianness, \
+                        bitendianness)
 
-        audio.append(integrator)
+    if nbits is not None and (nbits < 0 or nbits > len(bytestring) * 8):
+        raise Exception('Invalid number of bits %d' % nbits, nbits)
 
-    newstate = {'integrator' : integrator}
-    if sys.version_info[0] >= 3: # Python 3 or 2.x ?
-        return audio.tobytes(), newstate
-    else:
-        return audio.tostring(), newstate
+    decoder = DmDecoder(width, delta, a_cte, state)
+    return decoder.feed_packed(bytestring, bitendianness, nbits), \
+           decoder.state
 
 
 def calc_a_value(bitrate, tau = 0.001):
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming Intel HEX writer
+
+Writes data records (type 00), extended linear address records (type 04)
+and the end of file record (type 01) directly to a text file, as the data
+is produced, without keep a image of the whole memory. The output is the
+same that the intelhex package generates (IntelHex.write_hex_file) for the
+same data.
+
+Uses NumPy if it's available to calculate the checksums.
+
+"""
+from __future__ import division
+
+from .aux import _bytes, _lazy_import
+
+# Try to grab NumPy. It's loaded when it's used the first time
+try:
+    numpy = _lazy_import('numpy')
+    _NUMPY = True
+except ImportError:
+    _NUMPY = False
+
+
+RECORD = 16         # Data bytes by record, like intelhex
+PAGE = 0x10000      # Size of the address space of the data records
+EOF_RECORD = ':00000001FF'
+
+
+def _line(fields, eol):
+    """ Returns a record line of a bytes like with the record fields. The
+    checksum is added at the end
+    """
+    fields = bytearray(fields)
+    fields.append(-sum(fields) & 0xFF)
+    return ':' + fields.hex().upper() + eol
+
+
+class HexWriter(object):
+    """
+    Writes Intel HEX records to a text file
+
+    Data written at contiguous addresses is split in records of the same
+    size, like if it was written in a single call, so the data can be
+    written in chunks of any size. Only the last bytes of a incomplete
+    record are keep until the next write or close.
+    """
+
+    __slots__ = ('f', 'record', 'eol', '_extended', '_page', '_address', \
+                 '_pending')
+
+    def __init__(self, f, end = None, record = RECORD, eol = '\n'):
+        """
+        Creates a Intel HEX writer
+
+        Parameters
+        ----------
+
+        f : file
+            Text file were write the records
+        end : int, optional
+              Address after the last byte that will be written. If it's
+              greater than 64KiB, extended linear address records are
+              written, else the file only has data records. By default it's
+              None, that always writes the extended address records
+        record : int, optional
+                 Maximum number of data bytes of each record, from 1 to 255.
+                 By default it's RECORD (16)
+        eol : str, optional
+              End of line of the records. By default it's '\\n'
+        """
+
+        if record < 1 or record > 255:
+            raise Exception('Invalid record length %d' % record, record)
+
+        self.f = f
+        self.record = record
+        self.eol = eol
+        self._extended = end is None or end > PAGE
+        self._page = None           # Page of the last extended address
+        self._address = 0           # Address of the pending bytes
+        self._pending = bytearray()
+
+    def write(self, data, address = None):
+        """
+        Writes data at a address
+
+        Parameters
+        ----------
+
+        data : bytes like
+               Bytes to write
+        address : int, optional
+                  Address of the first byte. By default it's the address
+                  after the last byte written
+        """
+
+        data = _bytes(data)
+        if address is not None and \
+                address != self._address + len(self._pending):
+            self.flush()
+            self._address = address
+
+        if self._pending:
+            data = self._pending + data
+        address = self._address
+        start = 0
+        while len(data) - start >= self.record:
+            # Whole records until the data or the 64KiB page ends. Records
+            # never cross a page, so the last one of a page can be short
+            room = PAGE - (address & 0xFFFF)
+            if room < self.record:
+                size = room
+            else:
+                size = min(len(data) - start, room)
+                size -= size % self.record
+            self._records(address, data[start:start + size])
+            start += size
+            address += size
+
+        self._pending = bytearray(data[start:])
+        self._address = address
+
+    def flush(self):
+        """ Writes the pending bytes in a short record """
+        pending = self._pending
+        while pending:
+            size = min(len(pending), PAGE - (self._address & 0xFFFF))
+            self._records(self._address, pending[:size])
+            self._address += size
+            pending = pending[size:]
+        self._pending = bytearray()
+
+    def close(self):
+        """ Writes the pending bytes and the end of file record """
+        self.flush()
+        self.f.write(EOF_RECORD + self.eol)
+
+    def _records(self, address, data):
+        """ Writes data records of data, that can't cross a 64KiB page. All
+        records have self.record bytes, except the last
+        """
+
+        if self._extended and address >> 16 != self._page:
+            self._page = address >> 16
+            self.f.write(_line((2, 0, 0, 4, self._page >> 8, \
+                                self._page & 0xFF), self.eol))
+
+        size = self.record
+        full = len(data) // size
+        if full:
+            self.f.write(self._block(address & 0xFFFF, data[:full * size]))
+        rest = data[full * size:]
+        if rest:
+            low = (address + full * size) & 0xFFFF
+            self.f.write(_line(bytes((len(rest), low >> 8, low & 0xFF, 0)) + \
+                               rest, self.eol))
+
+    def _block(self, low, data):
+        """ Returns the lines of many full data records """
+
+        data = bytes(data)
+        size = self.record
+        count = len(data) // size
+        width = size + 5
+        lows = range(low, low + count * size, size)
+
+        # Fields of all records: length, address, type, data and checksum
+        fields = bytearray(count * width)
+        fields[0::width] = bytes((size,)) * count
+        fields[1::width] = bytes(x >> 8 for x in lows)
+        fields[2::width] = bytes(x & 0xFF for x in lows)
+        for i in range(size):
+            fields[4 + i::width] = data[i::size]
+
+        if _NUMPY:
+            rows = numpy.frombuffer(fields, dtype=numpy.uint8) \
+                        .reshape(count, width)
+            sums = rows[:, :-1].sum(axis=1, dtype=numpy.intp)
+            fields[width - 1::width] = ((-sums) & 0xFF).astype(numpy.uint8) \
+                                        .tobytes()
+        else:
+            view = memoryview(fields)
+            fields[width - 1::width] = bytes(-sum(view[i:i + width - 1]) & 0xFF \
+                                             for i in range(0, len(fields), \
+                                                            width))
+
+        lines = fields.hex(':', width).upper()
+        return ':' + lines.replace(':', self.eol + ':') + self.eol
+
+
+def write(f, data, address = 0, record = RECORD, eol = '\n'):
+    """
+    Writes a whole Intel HEX file with data at a address
+
+    Returns the number of data bytes written
+    """
+
+    data = _bytes(data)
+    writer = HexWriter(f, address + len(data), record, eol)
+    writer.write(data, address)
+    writer.close()
+    return len(data)
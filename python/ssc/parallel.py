@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel encoding and decoding of a long sound
+
+Each BTc/DM sample depends of the previous state, but two encoders that
+begin from different states generate the same bits once their states are
+equal, and at normal softness this happens after a few hundred samples. So a
+long sound is split in chunks that are encoded in a process pool from a
+guessed state (the state after encoding some previous samples). After, each
+chunk is encoded again from the real end state of the previous chunk until
+his state is equal to the state of the speculative encoding at a checkpoint.
+From there, the speculative bits are the same that a sequential encoder would
+generate. If the states never are equal, the whole chunk is encoded again, so
+the output is always bit identical to lin2btc and lin2dm.
+
+BTc decoding don't need to guess anything, because each step is a affine map
+over the capacitor voltage. See decode.
+
+"""
+from __future__ import division
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .aux import _bytes
+from .bitstream import BitStream
+from .btc import BtcEncoder, BtcDecoder, BtcFixedEncoder, _btc_tables
+from .dm import DmEncoder
+from . import progress as _progress
+
+CHECK = 256         # Samples between checkpoints. Must be a multiple of 8
+WARMUP = 1024       # Samples encoded before a chunk to guess his state
+MIN_CHUNK = 16384   # Minimal number of samples of each chunk
+
+# Encoder class of each kind of codec
+ENCODERS = {'btc' : BtcEncoder,
+            'btcq' : BtcFixedEncoder,
+            'dm'  : DmEncoder,
+           }
+
+
+def _speculate(kind, width, args, state, warmup, fragment):
+    """
+    Encodes a chunk from a guessed state
+
+    The guessed state it's the state after encoding the warmup samples from
+    state. Returns a tuple of (data, checkpoints) were data are the packed
+    bits of the chunk and checkpoints[i] is the state after encoding
+    (i + 1) * CHECK samples (the last one is the end state).
+    """
+
+    encoder = ENCODERS[kind](width, *args, state=state)
+    if warmup:
+        encoder.feed(warmup)
+        encoder.flush()
+
+    data = bytearray()
+    checkpoints = []
+    step = CHECK * width
+    for i in range(0, len(fragment), step):
+        data += encoder.feed(fragment[i:i + step]).data
+        checkpoints.append(encoder.state)
+    data += encoder.flush().data
+
+    return data, checkpoints
+
+
+def _settle(kind, width, args, state, fragment, data, checkpoints):
+    """
+    Encodes again a chunk from the real state until it's equal to a
+    checkpoint of the speculative encoding. Returns a tuple of (data,
+    newstate) with the right packed bits of the chunk and his end state.
+    """
+
+    encoder = ENCODERS[kind](width, *args, state=state)
+    output = bytearray()
+    step = CHECK * width
+    for i, checkpoint in enumerate(checkpoints):
+        output += encoder.feed(fragment[i * step:(i + 1) * step]).data
+        if encoder.state == checkpoint:
+            # Converged. The rest of speculative bits are right
+            output += data[len(output):]
+            return output, checkpoints[-1]
+
+    output += encoder.flush().data
+    return output, encoder.state
+
+
+def encode(kind, fragment, width, args, state = None, workers = None, \
+           progress = None):
+    """
+    Encodes a sound splitting it in chunks encoded in parallel
+
+    Parameters
+    ----------
+
+    kind : {'btc', 'btcq', 'dm'}
+           Codec to use. 'btcq' is the fixed point BTc engine
+    fragment : bytes like
+               Bytestring representation of the sound data in signed integer
+               samples.
+    width : int, {1, 2, 4}
+            Size in bytes of each sample.
+    args : tuple
+           Arguments of the encoder after width. (soft, codec) for BTc,
+           (soft, codec, q) for fixed point BTc and (delta, a_cte) for DM
+    state : dicctionary, optional
+            State of previus call. By default it's None
+    workers : int, optional
+              Number of worker processes. By default it's the number of CPUs
+    progress : callable, optional
+               Called with a ssc.progress.Progress after each chunk is
+               settled. By default it's None
+
+    Returns
+    -------
+
+    Returns a tuple of (bitstream, newstate) like lin2btc and lin2dm
+    """
+
+    # Validates the arguments before launching any process
+    encoder = ENCODERS[kind](width, *args, state=state)
+
+    raw = _bytes(fragment, width)
+    if len(raw) % width:
+        raise Exception('Invalid fragment length %d' % len(raw), len(raw))
+    samples = len(raw) // width
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    size = max(MIN_CHUNK, -(-samples // max(workers, 1)))
+    size = -(-size // CHECK) * CHECK
+
+    if workers <= 1 or samples <= size:
+        if progress is not None:
+            return _progress.encode(encoder, raw, width, progress), \
+                   encoder.state
+        bitstream = encoder.feed(raw)
+        bitstream.extend(encoder.flush())
+        return bitstream, encoder.state
+
+    if progress is not None:
+        progress = _progress.Progress(progress, 'encode', samples)
+
+    chunks = []
+    for start in range(0, samples, size):
+        warmup = raw[max(0, start - WARMUP) * width:start * width].tobytes()
+        chunk = raw[start * width:(start + size) * width].tobytes()
+        chunks.append((warmup, chunk))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # The first chunk is encoded from the real state, without warmup
+        futures = [executor.submit(_speculate, kind, width, args, state, \
+                                   warmup if i else b'', chunk) \
+                   for i, (warmup, chunk) in enumerate(chunks)]
+
+        output = bytearray()
+        for i, future in enumerate(futures):
+            data, checkpoints = future.result()
+            if i == 0:
+                state = checkpoints[-1]
+            else:
+                data, state = _settle(kind, width, args, state, \
+                                      chunks[i][1], data, checkpoints)
+            output += data
+            if progress is not None:
+                progress.update(len(chunks[i][1]) // width)
+
+    return BitStream(output, samples), state
+
+
+def _summarize(data, width, soft, codec, lastbit):
+    """
+    Composes the affine maps of all the bits of a block of packed BTc data
+
+    Returns the offset c of the block map last_out = k**nbits * last_in + c.
+    The slope only depends of the number of bits, so it's calculated by the
+    caller.
+    """
+
+    slopes, offsets, carries, kpow = _btc_tables(soft, codec, width)
+    k8 = kpow[7]
+    ends = [c[7] for c in carries]
+
+    index = int(lastbit) << 8
+    c = 0.0
+    for byte in data:
+        c = k8 * c + ends[index | byte]
+        index = (byte & 1) << 8
+    return c
+
+
+def _expand(data, width, soft, codec, state, nbits):
+    """ Decodes a block of packed BTc data from his start state """
+
+    decoder = BtcDecoder(width, soft, codec, state)
+    return decoder.feed_packed(data, 'MSB', nbits), decoder.state
+
+
+def decode(btcfragment, width, soft, codec = '1.0', state = None, \
+           workers = None, progress = None):
+    """
+    Decodes a long BTc bitstream with a parallel prefix scan
+
+    Each BTc decoder step is a affine map over the capacitor voltage, and
+    the composition of affine maps is associative. So the bitstream is split
+    in blocks of whole bytes and :
+    1. The workers compose the maps of each block (the previous bit of each
+       block is known from the data).
+    2. The start voltage of each block is calculated composing the block
+       maps in order.
+    3. The workers decode each block from his start voltage.
+
+    Parameters
+    ----------
+
+    btcfragment : boolean iterable
+                  Iterable that contains a bitstream representation of BTc
+                  data, like a BitStream
+    width : int, {1, 2 , 4}
+            Size in bytes of each output sample.
+    soft : int
+           Softness constant of BTc
+    codec : {'1.0', '1.7'}, optional
+            BTc codec version to use. By default it's BTc 1.0
+    state : dicctionary, optional
+            State of previus call. By default it's None
+    workers : int, optional
+              Number of worker processes. By default it's the number of CPUs
+    progress : callable, optional
+               Called with a ssc.progress.Progress after each block is
+               decoded. By default it's None
+
+    Returns
+    -------
+
+    Returns a tuple of (fragment, newstate) like btc2lin. The output could
+    differ in +-1 from the sequential decoder by float rounding.
+    """
+
+    # Validates the arguments before launching any process
+    decoder = BtcDecoder(width, soft, codec, state)
+
+    if not isinstance(btcfragment, BitStream):
+        btcfragment = BitStream.frombits(bit >= 1 for bit in btcfragment)
+    data = btcfragment.tobitorder('MSB').tobytes()
+    nbits = len(btcfragment)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    size = max(MIN_CHUNK // 8, -(-len(data) // max(workers, 1)))
+
+    if workers <= 1 or len(data) <= size:
+        if progress is not None:
+            return _progress.decode(decoder, btcfragment, progress), \
+                   decoder.state
+        return decoder.feed_packed(data, 'MSB', nbits), decoder.state
+
+    if progress is not None:
+        progress = _progress.Progress(progress, 'decode', nbits)
+
+    starts = list(range(0, len(data), size))
+    blocks = [data[start:start + size] for start in starts]
+    # Previous bit of each block
+    lastbits = [decoder.state.get('lastbit', 0)] + \
+               [data[start - 1] & 1 for start in starts[1:]]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_summarize, blocks[i], width, soft, codec, \
+                                   lastbits[i]) \
+                   for i in range(len(blocks) - 1)]
+
+        # Scans the block maps to get the start voltage of each block
+        k = 1 - 1 / soft
+        last = decoder.state['last']
+        lasts = [last]
+        for block, future in zip(blocks, futures):
+            last = k ** (len(block) * 8) * last + future.result()
+            lasts.append(last)
+
+        futures = []
+        for i, block in enumerate(blocks):
+            start = {'last' : lasts[i], 'lastbit' : lastbits[i]}
+            futures.append(executor.submit(_expand, block, width, soft, \
+                                codec, start, \
+                                min(nbits - starts[i] * 8, len(block) * 8)))
+
+        fragments = []
+        for future in futures:
+            fragment, state = future.result()
+            fragments.append(fragment)
+            if progress is not None:
+                progress.update(len(fragment) // width)
+
+    return b''.join(fragments), state
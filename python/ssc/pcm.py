@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Conditioning of Lineal PCM sound data before encoding it
+
+Replaces the audioop functions used to prepare a sound (lin2lin, bias,
+tomono, max, mul and ratecv), that were removed in Python 3.13. Width
+conversion, unsigned to signed bias, downmix and peak scan are done in a
+single pass over the input data, so the sound is only copied once. The
+results are the same that the audioop functions.
+
+Uses NumPy if it's available.
+
+"""
+from __future__ import division
+
+import array
+from math import floor
+
+from .aux import max_int, WIDTH_TYPE, _bytes, _samples, _lazy_import
+
+# Try to grab NumPy. It's loaded when it's used the first time
+try:
+    numpy = _lazy_import('numpy')
+    _NUMPY = True
+except ImportError:
+    _NUMPY = False
+
+
+def _check_width(width, widths = (1, 2, 4)):
+    """ Validates a sample width """
+    if width not in widths:
+        raise Exception('Invalid width %d' % width, width)
+
+
+def _gcd(a, b):
+    """ Greatest common divisor """
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def _read(fragment, width):
+    """ Returns the samples of a fragment as a list like of ints """
+    if width == 3:
+        data = _bytes(fragment, 3)
+        return [int.from_bytes(data[i:i + 3], 'little', signed=True) \
+                for i in range(0, len(data) - len(data) % 3, 3)]
+    return _samples(fragment, width)
+
+
+def _write(samples, width):
+    """ Converts a iterable of ints to a bytestring of samples """
+    return array.array(WIDTH_TYPE[width], samples).tobytes()
+
+
+def _nread(fragment, width):
+    """ Returns a NumPy array of the samples of a fragment, without copy if
+    it's possible
+    """
+    data = numpy.frombuffer(_bytes(fragment, width), dtype=numpy.uint8)
+    if width == 3:
+        # Reads each sample as the upper bytes of a overlapped int32, and
+        # shifts it back to extend the sign
+        padded = numpy.empty(len(data) + 1, dtype=numpy.uint8)
+        padded[1:] = data
+        words = numpy.ndarray((len(data) // 3,), dtype='<i4', buffer=padded, \
+                              strides=(3,))
+        return words >> 8
+    return data[:len(data) - len(data) % width].view(numpy.dtype(WIDTH_TYPE[width]))
+
+
+def _nwrite(samples, width):
+    """ Converts a NumPy array of ints to a bytestring of samples """
+    return samples.astype(numpy.dtype(WIDTH_TYPE[width]), copy=False).tobytes()
+
+
+def _npeak(samples):
+    """ Returns the maximum absolute value of a NumPy array of samples """
+    if not len(samples):
+        return 0
+    return max(int(samples.max()), -int(samples.min()))
+
+
+def _dyadic(weights):
+    """
+    Returns a tuple of (factors, bits) if all weights are integer factors
+    divided by 2 ** bits, like 0.75 and 0.25, or None. Then the weighted sum
+    can be done with integers and a shift, with the same result
+    """
+    for bits in range(17):
+        factors = [w * (1 << bits) for w in weights]
+        if all(f == int(f) for f in factors):
+            return [int(f) for f in factors], bits
+    return None
+
+
+def condition(fragment, width, channels = 1, weights = None, outwidth = 2, \
+              unsigned = False):
+    """
+    Converts frames of any width and number of channels to mono samples
+
+    It's the same that audioop.bias, audioop.lin2lin, audioop.tomono and
+    audioop.max, but in a single pass
+
+    Parameters
+    ----------
+
+    fragment : bytes like
+               Bytestring with the frames
+    width : int, {1, 2, 3, 4}
+            Size in bytes of each input sample
+    channels : int, optional
+               Number of channels of each frame. By default it's 1
+    weights : tuple of floats, optional
+              Weight of each channel in the mono sample. By default all
+              channels have the same weight. (0.75, 0.25) is like
+              audioop.tomono(fragment, outwidth, 0.75, 0.25)
+    outwidth : int, {1, 2, 4}, optional
+               Size in bytes of each output sample. By default it's 2
+    unsigned : bool, optional
+               True if the input samples are unsigned, like the 8 bit WAV
+               files. By default it's False
+
+    Returns
+    -------
+
+    Returns a tuple of (fragment, peak) were fragment is a bytestring with
+    the mono samples and peak the maximum absolute value of it
+    """
+
+    _check_width(width, (1, 2, 3, 4))
+    _check_width(outwidth)
+    if channels < 1:
+        raise Exception('Invalid number of channels %d' % channels, channels)
+    if weights is None:
+        weights = (1 / channels,) * channels
+    elif len(weights) != channels:
+        raise Exception('Invalid number of weights %d' % len(weights), weights)
+
+    shift = 8 * (outwidth - width)      # Width conversion
+    offset = 1 << (8 * width - 1) if unsigned else 0
+    MAX = max_int(outwidth)
+    MIN = -MAX - 1
+
+    if _NUMPY:
+        samples = _nread(fragment, width)
+        if offset:  # Flips the sign bit
+            samples = samples ^ samples.dtype.type(-offset)
+        if shift:
+            # Works with the smallest int that can keep input and output
+            if max(width, outwidth) <= 2:
+                samples = samples.astype(numpy.int16)
+            else:
+                samples = samples.astype(numpy.int32, copy=False)
+            if shift > 0:
+                samples = samples << shift
+            else:
+                samples = samples >> -shift
+        if channels > 1:
+            frames = samples[:len(samples) - len(samples) % channels] \
+                        .reshape(-1, channels)
+            dyadic = _dyadic(weights)
+            if dyadic is not None:
+                factors, bits = dyadic
+                if outwidth <= 2 and bits <= 8:
+                    work = numpy.int32
+                else:
+                    work = numpy.int64
+                # Widens the samples before the products. With NumPy 1.x a
+                # scalar of work type don't widens a int16 array
+                mixed = frames[:, 0].astype(work) * factors[0]
+                for i in range(1, channels):
+                    mixed += frames[:, i].astype(work) * factors[i]
+                mixed >>= bits
+            else:
+                mixed = frames[:, 0] * float(weights[0])
+                for i in range(1, channels):
+                    mixed += frames[:, i] * float(weights[i])
+                numpy.floor(mixed, out=mixed)
+            samples = numpy.clip(mixed, MIN, MAX, out=mixed)
+        samples = samples.astype(numpy.dtype(WIDTH_TYPE[outwidth]), copy=False)
+        return samples.tobytes(), _npeak(samples)
+
+    samples = _read(fragment, width)
+    if offset or shift:
+        if shift >= 0:
+            samples = [(x ^ -offset) << shift for x in samples]
+        else:
+            samples = [(x ^ -offset) >> -shift for x in samples]
+    if channels > 1:
+        length = len(samples) - len(samples) % channels
+        if channels == 2:
+            lw, rw = weights
+            mixed = [floor(l * lw + r * rw) for l, r in \
+                     zip(samples[0:length:2], samples[1:length:2])]
+        else:
+            mixed = [floor(sum(x * w for x, w in \
+                     zip(samples[i:i + channels], weights))) \
+                     for i in range(0, length, channels)]
+        samples = [MIN if x < MIN else MAX if x > MAX else x for x in mixed]
+    peak = max(max(samples), -min(samples)) if len(samples) else 0
+    return _write(samples, outwidth), peak
+
+
+def peak(fragment, width):
+    """ Returns the maximum absolute value of the samples, like audioop.max """
+    _check_width(width, (1, 2, 3, 4))
+    if _NUMPY:
+        return _npeak(_nread(fragment, width))
+    samples = _read(fragment, width)
+    return max(max(samples), -min(samples)) if len(samples) else 0
+
+
+def gain(fragment, width, factor):
+    """
+    Multiplies all the samples by a factor, like audioop.mul
+
+    Values are rounded to minus infinity and clipped to the range of width
+
+    Returns a bytestring with the samples
+    """
+
+    _check_width(width)
+    MAX = max_int(width)
+    MIN = -MAX - 1
+
+    if _NUMPY:
+        samples = _nread(fragment, width) * float(factor)
+        numpy.floor(samples, out=samples)
+        return _nwrite(numpy.clip(samples, MIN, MAX, out=samples), width)
+
+    samples = (floor(x * factor) for x in _read(fragment, width))
+    return _write((MIN if x < MIN else MAX if x > MAX else x \
+                   for x in samples), width)
+
+
+def ratecv(fragment, width, inrate, outrate, state = None):
+    """
+    Converts the sample rate of mono samples, like audioop.ratecv with the
+    default weights (linear interpolation)
+
+    Parameters
+    ----------
+
+    fragment : bytes like
+               Bytestring with the samples
+    width : int, {1, 2, 4}
+            Size in bytes of each sample
+    inrate : int
+             Sample rate of the input
+    outrate : int
+              Desired sample rate
+    state : tuple, optional
+            State of previus call if it's used to process chunks of sound
+            data. It's the same state that uses audioop.ratecv. In the first
+            call state can be None. By default it's None
+
+    Returns
+    -------
+
+    Returns a tuple of (fragment, newstate) and newstate should be passed to
+    the next call of ratecv
+    """
+
+    _check_width(width)
+    if inrate <= 0 or outrate <= 0:
+        raise Exception('Invalid sample rates %d %d' % (inrate, outrate), \
+                        inrate, outrate)
+
+    d = _gcd(inrate, outrate)
+    inrate //= d
+    outrate //= d
+    shift = 32 - 8 * width      # Samples are calculated as 32 bit ints
+
+    if state is None:
+        d = -outrate
+        prev = cur = 0
+    else:
+        d, ((prev, cur),) = state
+
+    samples = _read(fragment, width)
+    n = len(samples)
+    # Number of outputs: k = 0.. while d + n * outrate - k * inrate >= 0
+    total = max(0, (d + n * outrate) // inrate + 1)
+
+    if _NUMPY and total:
+        values = numpy.empty(n + 2, dtype=numpy.float64)
+        values[0] = prev
+        values[1] = cur
+        values[2:] = _nread(fragment, width)
+        values[2:] *= 1 << shift
+        # Input consumed before output k = j * outrate + r, and his phase.
+        # Phase only depends of r, and the input advances inrate by period
+        period = min(total, outrate)
+        r = numpy.arange(period, dtype=numpy.int64)
+        m = -((d - r * inrate) // outrate)
+        phase = (d + m * outrate - r * inrate).astype(numpy.float64)
+        reps = -(-total // period)
+        m = (m + inrate * numpy.arange(reps)[:, None]).ravel()[:total]
+        phase = numpy.tile(phase, reps)[:total]
+        out = values[m] * phase
+        out += values[m + 1] * (outrate - phase)
+        out /= outrate
+        numpy.trunc(out, out=out)
+        out /= 1 << shift
+        output = _nwrite(numpy.floor(out, out=out), width)
+    else:
+        out = []
+        append = out.append
+        for sample in samples:
+            prev = cur
+            cur = sample << shift
+            d += outrate
+            while d >= 0:
+                append(int((prev * d + cur * (outrate - d)) / outrate) >> shift)
+                d -= inrate
+        output = _write(out, width)
+        return output, (d, ((prev, cur),))
+
+    if n == 1:
+        prev = cur
+    elif n > 1:
+        prev = samples[n - 2] << shift
+    if n:
+        cur = samples[n - 1] << shift
+    d = d + n * outrate - total * inrate
+    return output, (d, ((prev, cur),))
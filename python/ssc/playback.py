@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Low latency playback of sounds that are decoded while they are played
+
+A worker thread decodes the sound a frame at a time into a ring of frame
+buffers, and the caller thread writes each frame to a audio sink as a
+memoryview of the ring, without copy. The ring has the frames needed to
+keep the latency target (and at least two, like a double buffer), so the
+audio begins when the first frame is decoded and not when the whole sound
+is decoded.
+
+Sinks are objects with open(rate, width), write(fragment) and close()
+methods. There are sinks for pyaudio, files and a null sink for tests.
+
+"""
+from __future__ import division
+
+import threading
+import time
+from math import ceil
+
+from .aux import pack
+from .bitstream import BitStream
+
+FRAME = 1024        # Samples by frame
+LATENCY = 0.1       # Default latency target in seconds
+
+
+class NullSink(object):
+    """
+    Sink that discards the audio. Keeps the number of frames and bytes
+    written, and the time of the first write (like time.perf_counter)
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.first = None
+
+    def open(self, rate, width):
+        self.frames = 0
+        self.bytes = 0
+        self.first = None
+
+    def write(self, fragment):
+        if self.first is None:
+            self.first = time.perf_counter()
+        self.frames += 1
+        self.bytes += len(fragment)
+
+    def close(self):
+        pass
+
+
+class FileSink(NullSink):
+    """ Sink that writes the samples to a binary file object """
+
+    def __init__(self, f):
+        NullSink.__init__(self)
+        self.f = f
+
+    def write(self, fragment):
+        NullSink.write(self, fragment)
+        self.f.write(fragment)
+
+
+class PyAudioSink(object):
+    """
+    Sink that plays the audio with pyaudio
+
+    If a PyAudio object isn't given, it's created when the sink is opened
+    and terminated when is closed, so pyaudio is only loaded when some
+    sound is played.
+    """
+
+    def __init__(self, audio = None, frame = FRAME):
+        self.audio = audio
+        self.frame = frame
+        self._own = audio is None
+        self._stream = None
+
+    def open(self, rate, width):
+        if self.audio is None:
+            import pyaudio
+            self.audio = pyaudio.PyAudio()
+        self._stream = self.audio.open( \
+                            format=self.audio.get_format_from_width(width), \
+                            channels=1, rate=rate, output=True, \
+                            frames_per_buffer=self.frame)
+
+    def write(self, fragment):
+        self._stream.write(fragment)
+
+    def close(self):
+        # Stops when the buffers are played
+        self._stream.stop_stream()
+        self._stream.close()
+        self._stream = None
+        if self._own:
+            self.audio.terminate()
+            self.audio = None
+
+
+def decode_frames(bitstream, decoder, frame = FRAME):
+    """
+    Decodes a bitstream a frame at a time
+
+    Parameters
+    ----------
+
+    bitstream : BitStream or iterable of bits
+                Encoded sound, a sample by bit
+    decoder : BtcDecoder or DmDecoder
+              Decoder of the codec of the sound
+    frame : int, optional
+            Samples by frame. Must be a multiple of 8. By default it's FRAME
+
+    Returns
+    -------
+
+    Returns a generator of bytestrings with the samples of each frame
+    """
+
+    if frame <= 0 or frame % 8:
+        raise Exception('Invalid frame size %d' % frame, frame)
+
+    if isinstance(bitstream, BitStream):
+        data = bitstream.data
+        order = bitstream.bitorder
+    else:
+        bitstream = list(bitstream)
+        data = pack(bitstream)
+        order = 'MSB'
+    nbits = len(bitstream)
+
+    step = frame // 8
+    for i in range(0, len(data), step):
+        yield decoder.feed_packed(data[i:i + step], order, \
+                                  min(frame, nbits - i * 8))
+    tail = decoder.flush()
+    if tail:
+        yield tail
+
+
+class Player(object):
+    """
+    Plays a sound while it's decoded
+
+    Parameters
+    ----------
+
+    sink : object
+           Audio sink with open(rate, width), write(fragment) and close()
+    rate : int
+           Sample rate
+    width : int, optional
+            Size in bytes of each sample. By default it's 2
+    frame : int, optional
+            Samples by frame. By default it's FRAME
+    latency : float, optional
+              Seconds of audio that can be decoded in advance. By default
+              it's LATENCY
+    """
+
+    def __init__(self, sink, rate, width = 2, frame = FRAME, \
+                 latency = LATENCY):
+        if rate <= 0 or frame <= 0 or latency < 0:
+            raise Exception('Invalid playback parameters')
+
+        self.sink = sink
+        self.rate = rate
+        self.width = width
+        self.frame = frame
+        self.slots = max(2, int(ceil(latency * rate / frame)))
+        self.first = None       # Seconds until the first frame was played
+
+    def play(self, chunks):
+        """
+        Plays the samples of a iterable of bytestrings, like decode_frames.
+        Returns when all samples are written to the sink
+        """
+
+        size = self.frame * self.width
+        ring = bytearray(size * self.slots)
+        view = memoryview(ring)
+        lengths = [0] * self.slots
+        free = threading.Semaphore(self.slots)
+        ready = threading.Semaphore(0)
+        stop = threading.Event()    # The sink failed. Producer must end
+        errors = []
+
+        def produce():
+            """ Fills the ring with the chunks, a frame by slot """
+            slot = fill = 0
+            try:
+                free.acquire()
+                if stop.is_set():
+                    return
+                for chunk in chunks:
+                    chunk = memoryview(chunk).cast('B')
+                    while len(chunk):
+                        count = min(size - fill, len(chunk))
+                        start = slot * size + fill
+                        view[start:start + count] = chunk[:count]
+                        chunk = chunk[count:]
+                        fill += count
+                        if fill == size:
+                            lengths[slot] = size
+                            ready.release()
+                            slot = (slot + 1) % self.slots
+                            fill = 0
+                            free.acquire()
+                            if stop.is_set():
+                                return
+            except Exception as e:
+                errors.append(e)
+            lengths[slot] = fill
+            ready.release()
+            if fill:    # Empty slot marks the end
+                slot = (slot + 1) % self.slots
+                free.acquire()
+                if stop.is_set():
+                    return
+                lengths[slot] = 0
+                ready.release()
+
+        start = time.perf_counter()
+        self.first = None
+        self.sink.open(self.rate, self.width)
+        worker = threading.Thread(target=produce)
+        worker.daemon = True
+        worker.start()
+        try:
+            slot = 0
+            while True:
+                ready.acquire()
+                length = lengths[slot]
+                if not length:
+                    break
+                self.sink.write(view[slot * size:slot * size + length])
+                if self.first is None:
+                    self.first = time.perf_counter() - start
+                free.release()
+                slot = (slot + 1) % self.slots
+        except BaseException:
+            # Wakes up the producer, that could be waiting a free slot
+            stop.set()
+            free.release()
+            raise
+        finally:
+            self.sink.close()
+            worker.join()
+            view.release()
+        if errors:
+            raise errors[0]
+
+    def play_bitstream(self, bitstream, decoder):
+        """ Decodes a bitstream while it's played. See decode_frames """
+        self.play(decode_frames(bitstream, decoder, self.frame))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Progress reports of long encodes and decodes
+
+lin2btc, lin2dm, btc2lin, dm2lin and the resampling encoders of
+ssc.resample accept a progress callback. Then the sound is processed in
+chunks of CHUNK samples with the same encoder or decoder, so the output is
+the same, and the callback is called after each chunk with a Progress
+object that says how many samples are done and the throughput.
+
+    def report(progress):
+        print('%s %5.1f%% %.0f samples/s' % (progress.stage, \
+              100 * progress.fraction, progress.rate))
+
+    bitstream, state = ssc.lin2btc(fragment, 2, 21, progress=report)
+
+"""
+from __future__ import division
+
+import time
+
+from .aux import _bytes
+from .bitstream import BitStream
+
+CHUNK = 65536       # Samples processed between reports. Multiple of 8
+
+
+class Progress(object):
+    """
+    Progress of a stage of work, passed to the progress callbacks
+
+    Attributes
+    ----------
+
+    stage : str
+            Name of the work, like 'encode' or 'decode'
+    done : int
+           Samples processed
+    total : int
+            Samples to process
+    elapsed : float
+              Seconds since the work began
+    """
+
+    __slots__ = ('stage', 'done', 'total', 'elapsed', '_callback', '_start')
+
+    def __init__(self, callback, stage, total):
+        self.stage = stage
+        self.done = 0
+        self.total = total
+        self.elapsed = 0.0
+        self._callback = callback
+        self._start = time.perf_counter()
+
+    @property
+    def rate(self):
+        """ Samples processed by second """
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def fraction(self):
+        """ Fraction of the work done, from 0 to 1 """
+        return self.done / self.total if self.total else 1.0
+
+    def update(self, count):
+        """ Adds count processed samples and calls the callback """
+        self.done += count
+        self.elapsed = time.perf_counter() - self._start
+        self._callback(self)
+
+
+def encode(encoder, fragment, width, callback, stage = 'encode', \
+           chunk = CHUNK):
+    """
+    Encodes a sound in chunks, reporting the progress after each one
+
+    Parameters
+    ----------
+
+    encoder : BtcEncoder or DmEncoder
+              Encoder of the sound. His width must be width
+    fragment : bytes like
+               Bytestring with the samples
+    width : int, {1, 2, 4}
+            Size in bytes of each sample
+    callback : callable
+               Called with a Progress after each chunk
+    stage : str, optional
+            Name of the stage in the Progress. By default it's 'encode'
+    chunk : int, optional
+            Samples encoded between reports. By default it's CHUNK
+
+    Returns
+    -------
+
+    Returns a BitStream. The encoder is flushed at the end.
+    """
+
+    view = _bytes(fragment, width)
+    progress = Progress(callback, stage, len(view) // width)
+    step = chunk * width
+    bitstream = BitStream()
+    for i in range(0, len(view), step):
+        samples = view[i:i + step]
+        bitstream.extend(encoder.feed(samples))
+        progress.update(len(samples) // width)
+    bitstream.extend(encoder.flush())
+    return bitstream
+
+
+def decode(decoder, bitstream, callback, stage = 'decode', chunk = CHUNK):
+    """
+    Decodes a bitstream in chunks, reporting the progress after each one
+
+    Parameters
+    ----------
+
+    decoder : BtcDecoder or DmDecoder
+              Decoder of the bitstream
+    bitstream : BitStream or iterable of bools
+                Bitstream to decode
+    callback : callable
+               Called with a Progress after each chunk
+    stage : str, optional
+            Name of the stage in the Progress. By default it's 'decode'
+    chunk : int, optional
+            Bits decoded between reports. Must be a multiple of 8. By default
+            it's CHUNK
+
+    Returns
+    -------
+
+    Returns a bytestring with the samples
+    """
+
+    if chunk <= 0 or chunk % 8:
+        raise Exception('Invalid chunk size %d' % chunk, chunk)
+
+    if not isinstance(bitstream, (BitStream, list, tuple)):
+        bitstream = list(bitstream)
+    progress = Progress(callback, stage, len(bitstream))
+    output = []
+    for i in range(0, len(bitstream), chunk):
+        bits = bitstream[i:i + chunk]
+        output.append(decoder.feed(bits))
+        progress.update(len(bits))
+    return b''.join(output)
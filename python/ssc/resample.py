@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""
+Polyphase FIR resampler of Lineal PCM sound data
+
+Changes the sample rate by a rational factor up / down with a Kaiser
+windowed sinc low pass filter, that is split in up phases (filter banks).
+Each output sample is the dot product of a window of input samples with the
+bank of his phase, so the upsampled signal never is generated. Banks are
+calculated only once for each ratio and kept in a cache.
+
+The coefficients are integers scaled by 2 ** PRECISION, so the sums are
+exact with any engine and in any order: pure Python uses ints, and NumPy
+uses float64 for samples of 1 and 2 bytes, were the sums never pass
+2 ** 53, and int64 for samples of 4 bytes. The output don't depends of the
+size of the chunks fed to a Resampler, and NumPy and pure Python give the
+same samples.
+
+Uses NumPy if it's available.
+
+"""
+from __future__ import division
+
+from math import ceil, pi, sin, sqrt
+
+from .aux import max_int, _bytes, _lazy_import
+from .bitstream import BitStream
+from .btc import BtcEncoder
+from .dm import DmEncoder
+from .pcm import _check_width, _gcd, _read, _write, _nread, _nwrite
+from .progress import Progress
+
+# Try to grab NumPy. It's loaded when it's used the first time
+try:
+    numpy = _lazy_import('numpy')
+    _NUMPY = True
+except ImportError:
+    _NUMPY = False
+
+
+ZEROS = 12          # Zero crossings of the sinc at each side of a window
+ROLLOFF = 0.94      # Cutoff frequency, relative to the output Nyquist freq.
+BETA = 8.0          # Kaiser window shape. Greater is less ripple and wider
+PRECISION = 20      # Fractional bits of the coefficients
+BLOCK = 8192        # Output samples computed at same time by NumPy
+FRAMES = 65536      # Input samples resampled and encoded at same time
+
+_BANKS = {}         # Cache of filter banks by (up, down, zeros)
+
+
+def _i0(x):
+    """ Modified Bessel function of first kind and order 0 """
+    total = term = 1.0
+    k = 1
+    while term > total * 1e-17:
+        term *= (x / (2 * k)) ** 2
+        total += term
+        k += 1
+    return total
+
+
+def _bank(up, down, zeros):
+    """
+    Returns a tuple of (half, bank) were bank is a list of up phases, and
+    each phase is a list of 2 * half integer coefficients. The coefficient j
+    of phase r weights the input sample i - half + 1 + j, for a output at
+    time i + r / up. The coefficients of a phase sum exactly 2 ** PRECISION
+    """
+
+    key = (up, down, zeros)
+    if key in _BANKS:
+        return _BANKS[key]
+
+    cutoff = ROLLOFF * min(1, up / down)
+    half = int(ceil(zeros / cutoff))
+    scale = 1 << PRECISION
+    norm = _i0(BETA)
+
+    bank = []
+    for r in range(up):
+        taps = []
+        for j in range(2 * half):
+            t = j - half + 1 - r / up
+            x = t / half
+            if x <= -1 or x >= 1:
+                taps.append(0.0)
+                continue
+            t *= pi * cutoff
+            sinc = sin(t) / t if t else 1.0
+            taps.append(sinc * _i0(BETA * sqrt(1 - x * x)) / norm)
+        total = sum(taps)
+        phase = [int(round(tap * scale / total)) for tap in taps]
+        # Puts the rounding error in the greatest coefficient
+        center = phase.index(max(phase))
+        phase[center] += scale - sum(phase)
+        bank.append(phase)
+
+    _BANKS[key] = half, bank
+    return half, bank
+
+
+def _nbank(up, down, zeros, dtype):
+    """ Returns a tuple of (half, bank) were bank is a NumPy array """
+    key = ('numpy', up, down, zeros, dtype)
+    if key not in _BANKS:
+        half, bank = _bank(up, down, zeros)
+        _BANKS[key] = half, numpy.array(bank, dtype=dtype)
+    return _BANKS[key]
+
+
+def _ndtype(width):
+    """
+    Returns the NumPy type of the sums of a width. The products of 4 bytes
+    samples and the coefficients, and his sums, could pass the 2 ** 53 of
+    the float64 mantissa
+    """
+    return numpy.int64 if width == 4 else numpy.float64
+
+
+class Resampler(object):
+    """
+    Stateful polyphase resampler that converts chunks of mono Lineal PCM
+    samples from a sample rate to other
+
+    Each output needs half a window of next input samples, so the output of
+    feed is delayed by a few samples. flush returns the last samples, as if
+    the sound was followed by silence. The output of a whole sound is
+    ceil(n * outrate / inrate) samples, aligned with the input, and it's the
+    same with any size of chunks.
+    """
+
+    __slots__ = ('width', 'inrate', 'outrate', 'zeros', '_up', '_down', \
+                 '_half', '_bank', '_max', '_min', '_count', '_outputs', \
+                 '_start', '_buffer', '_dtype')
+
+    def __init__(self, width, inrate, outrate, zeros = ZEROS, state = None):
+        """
+        Creates a resampler
+
+        Parameters
+        ----------
+
+        width : int, {1, 2 , 4}
+                Size in bytes of each sample.
+        inrate : int
+                 Sample rate of the input
+        outrate : int
+                  Desired sample rate
+        zeros : int, optional
+                Zero crossings of the filter at each side. More is sharper
+                and slower. By default it's ZEROS
+        state : dicctionary, optional
+                State returned by other resampler to continue resampling a
+                sound. By default it's None
+        """
+
+        _check_width(width)
+        if inrate <= 0 or outrate <= 0:
+            raise Exception('Invalid sample rates %d %d' % (inrate, outrate), \
+                            inrate, outrate)
+        if zeros < 1:
+            raise Exception('Invalid number of zero crossings %d' % zeros, \
+                            zeros)
+
+        self.width = width
+        self.inrate = inrate
+        self.outrate = outrate
+        self.zeros = zeros
+        d = _gcd(inrate, outrate)
+        self._up = outrate // d
+        self._down = inrate // d
+        if _NUMPY:
+            self._dtype = _ndtype(width)
+            self._half, self._bank = _nbank(self._up, self._down, zeros, \
+                                            self._dtype)
+        else:
+            self._half, self._bank = _bank(self._up, self._down, zeros)
+        self._max = max_int(width)
+        self._min = -self._max - 1
+
+        if state is None:
+            self._count = 0         # Input samples fed
+            self._outputs = 0       # Output samples generated
+            history = [0] * self._half
+        else:
+            self._count = state['count']
+            self._outputs = state['outputs']
+            history = state['history']
+        # Input samples from the index _start that are needed by the outputs
+        self._start = self._count - len(history)
+        if _NUMPY:
+            self._buffer = numpy.array(history, dtype=self._dtype)
+        else:
+            self._buffer = list(history)
+
+    @property
+    def state(self):
+        """ Actual state. It can be passed to other Resampler """
+        return {'count' : self._count,
+                'outputs' : self._outputs,
+                'history' : [int(x) for x in self._buffer],
+               }
+
+    def feed(self, fragment):
+        """
+        Resamples a chunk of sound data
+
+        Parameters
+        ----------
+
+        fragment : bytes like
+                   Bytestring representation of the sound data in signed
+                   integer samples.
+
+        Returns
+        -------
+
+        Returns a bytestring with the output samples that can be calculated
+        with the input fed until now.
+        """
+
+        if _NUMPY:
+            samples = _nread(fragment, self.width)
+            self._buffer = numpy.concatenate((self._buffer, samples))
+        else:
+            samples = _read(fragment, self.width)
+            self._buffer.extend(samples)
+        self._count += len(samples)
+        return self._resample(self._count - 1 - self._half)
+
+    def flush(self):
+        """
+        Returns a bytestring with the last output samples, as if the input
+        was followed by silence. After it, the resampler can be used with a
+        new sound
+        """
+
+        if _NUMPY:
+            self._buffer = numpy.concatenate((self._buffer, \
+                                numpy.zeros(self._half, dtype=self._dtype)))
+        else:
+            self._buffer.extend([0] * self._half)
+        output = self._resample(self._count - 1)
+        self._count = self._outputs = 0
+        self._start = -self._half
+        if _NUMPY:
+            self._buffer = numpy.zeros(self._half, dtype=self._dtype)
+        else:
+            self._buffer = [0] * self._half
+        return output
+
+    def _resample(self, last):
+        """ Generates all outputs that are at time <= last input sample, and
+        drops the input samples that are not needed anymore
+        """
+
+        up = self._up
+        down = self._down
+        half = self._half
+        first = self._outputs
+        # Output k is at time k * down / up
+        end = max(first, ((last + 1) * up + down - 1) // down)
+        self._outputs = end
+
+        if _NUMPY:
+            output = self._nresample(first, end)
+        else:
+            output = []
+            append = output.append
+            bank = self._bank
+            buf = self._buffer
+            offset = 1 - half - self._start
+            rnd = 1 << (PRECISION - 1)
+            for k in range(first, end):
+                i, r = divmod(k * down, up)
+                i += offset
+                acc = sum(c * x for c, x in zip(bank[r], buf[i:i + 2 * half]))
+                append((acc + rnd) >> PRECISION)
+            output = _write(self.__clip(output), self.width)
+
+        # Keeps from the first input sample of the next output
+        keep = (end * down) // up + 1 - half - self._start
+        if keep > 0:
+            self._buffer = self._buffer[keep:]
+            self._start += keep
+        return output
+
+    def __clip(self, samples):
+        """ Clips a list of ints to the range of width """
+        MAX = self._max
+        MIN = self._min
+        return [MIN if x < MIN else MAX if x > MAX else x for x in samples]
+
+    def _nresample(self, first, end):
+        """ NumPy version of _resample. Returns a bytestring """
+        up = self._up
+        down = self._down
+        half = self._half
+        offset = 1 - half - self._start
+        windows = numpy.lib.stride_tricks.sliding_window_view(self._buffer, \
+                                                              2 * half)
+        output = numpy.empty(end - first, dtype=self._dtype)
+        if len(output) >= 8 * up:
+            # Outputs k and k + up have the same phase, and his windows are
+            # down samples apart. So each phase is a matrix product
+            for c in range(up):
+                i, r = divmod((first + c) * down, up)
+                i += offset
+                rows = len(range(c, len(output), up))
+                output[c::up] = windows[i:i + (rows - 1) * down + 1:down] @ \
+                                self._bank[r]
+        else:
+            for block in range(first, end, BLOCK):
+                k = numpy.arange(block, min(end, block + BLOCK), \
+                                 dtype=numpy.int64)
+                i, r = numpy.divmod(k * down, up)
+                i += offset
+                output[block - first:block - first + len(k)] = \
+                        numpy.einsum('ij,ij->i', windows[i], self._bank[r])
+        output += 1 << (PRECISION - 1)
+        if self._dtype == numpy.int64:
+            output >>= PRECISION
+        else:
+            output /= 1 << PRECISION
+            numpy.floor(output, out=output)
+        numpy.clip(output, self._min, self._max, out=output)
+        return _nwrite(output, self.width)
+
+
+def resample(fragment, width, inrate, outrate, zeros = ZEROS):
+    """
+    Converts the sample rate of a whole mono sound
+
+    Parameters
+    ----------
+
+    fragment : bytes like
+               Bytestring with the samples
+    width : int, {1, 2, 4}
+            Size in bytes of each sample
+    inrate : int
+             Sample rate of the input
+    outrate : int
+              Desired sample rate
+    zeros : int, optional
+            Zero crossings of the filter at each side. By default it's ZEROS
+
+    Returns
+    -------
+
+    Returns a bytestring with ceil(n * outrate / inrate) samples
+    """
+
+    resampler = Resampler(width, inrate, outrate, zeros)
+    return resampler.feed(fragment) + resampler.flush()
+
+
+def encode(fragment, width, inrate, outrate, encoder, zeros = ZEROS, \
+           frames = FRAMES, progress = None):
+    """
+    Resamples a sound and encodes it, in chunks of frames input samples, so
+    the whole resampled sound is never kept in memory
+
+    Parameters
+    ----------
+
+    fragment : bytes like
+               Bytestring with the samples
+    width : int, {1, 2, 4}
+            Size in bytes of each sample
+    inrate : int
+             Sample rate of the input
+    outrate : int
+              Sample rate of the encoded sound
+    encoder : BtcEncoder or DmEncoder
+              Encoder of the resampled samples. His width must be width
+    zeros : int, optional
+            Zero crossings of the filter at each side. By default it's ZEROS
+    frames : int, optional
+             Input samples processed at same time. By default it's FRAMES
+    progress : callable, optional
+               Called with a ssc.progress.Progress of the input samples
+               after each chunk of frames. By default it's None
+
+    Returns
+    -------
+
+    Returns a BitStream. The encoder is flushed at the end.
+    """
+
+    resampler = Resampler(width, inrate, outrate, zeros)
+    view = _bytes(fragment, width)
+    step = frames * width
+    if progress is not None:
+        progress = Progress(progress, 'encode', len(view) // width)
+    bitstream = BitStream()
+    for i in range(0, len(view), step):
+        samples = view[i:i + step]
+        bitstream.extend(encoder.feed(resampler.feed(samples)))
+        if progress is not None:
+            progress.update(len(samples) // width)
+    bitstream.extend(encoder.feed(resampler.flush()))
+    bitstream.extend(encoder.flush())
+    return bitstream
+
+
+def lin2btc(fragment, width, inrate, outrate, soft, codec = '1.0', \
+            state = None, zeros = ZEROS, progress = None):
+    """
+    Resamples a sound and converts it to BTc. Returns the same that
+    ssc.lin2btc(resample(fragment, width, inrate, outrate), width, soft, codec,
+    state), but the resampled sound is never kept in memory. progress is
+    like in encode.
+
+    Returns a tuple of (bitstream, newstate)
+    """
+
+    if not memoryview(fragment).nbytes:
+        raise Exception('Missing input data')
+
+    encoder = BtcEncoder(width, soft, codec, state)
+    return encode(fragment, width, inrate, outrate, encoder, zeros, \
+                  progress=progress), encoder.state
+
+
+def lin2dm(fragment, width, inrate, outrate, delta = None, a_cte = 1.0, \
+           state = None, zeros = ZEROS, progress = None):
+    """
+    Resamples a sound and converts it to Delta Modulation. Returns the same
+    that ssc.lin2dm(resample(fragment, width, inrate, outrate), width, delta,
+    a_cte, state), but the resampled sound is never kept in memory. progress
+    is like in encode.
+
+    Returns a tuple of (bitstream, newstate)
+    """
+
+    if not memoryview(fragment).nbytes:
+        raise Exception('Missing input data')
+
+    encoder = DmEncoder(width, delta, a_cte, state)
+    return encode(fragment, width, inrate, outrate, encoder, zeros, \
+                  progress=progress), encoder.state
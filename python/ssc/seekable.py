@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Seekable bitstream containers
+
+A seekable container keeps a packed BTc or DM bitstream split in blocks of
+a fixed number of bits, and a keyframe with the decoder state at the begin
+of each block. So a range of samples is decoded from the keyframe of his
+first block, without decode the bitstream from the begin, and seeking costs
+O(block) whatever is the length of the sound.
+
+The file begins with a header of HEADER_SIZE bytes (all values are big
+endian) :
+
+    magic       4s  b'SSCK'
+    version     B   VERSION
+    codec       B   Index in CODECS
+    width       B   Size in bytes of each decoded sample
+    q           B   Fractional bits of the fixed point BTc engine, or 0
+    param       I   BTc softness or DM delta
+    a_cte       d   DM integrator decay
+    rate        I   Sample rate, or 0 if it's unknown
+    block       I   Bits by block. Multiple of 8
+    nbits       Q   Bits (samples) of the sound
+    blocks      I   Number of blocks
+
+Follows a index with a KEYFRAME entry for each block (the byte offset of
+the block relative to the begin of the data, the state value, like the BTc
+capacitor voltage or the DM integrator, and the previous bit), and the
+packed data in MSB order.
+
+"""
+from __future__ import division
+
+import mmap
+import struct
+
+from .btc import BtcDecoder, BtcFixedDecoder
+from .dm import DmDecoder
+
+MAGIC = b'SSCK'
+VERSION = 1
+HEADER = struct.Struct('>4sBBBBIdIIQI')
+HEADER_SIZE = 64    # Size in bytes of the header, with reserved space
+KEYFRAME = struct.Struct('>QdB3x')
+BLOCK = 4096        # Default bits by block
+CODECS = ('btc1.0', 'btc1.7', 'dm')
+
+
+def _params(decoder):
+    """ Returns a tuple of (codec, q, param, a_cte) of a decoder """
+
+    if isinstance(decoder, BtcFixedDecoder):
+        return CODECS.index('btc' + decoder.codec), decoder.q, decoder.soft, \
+               1.0
+    if isinstance(decoder, BtcDecoder):
+        return CODECS.index('btc' + decoder.codec), 0, decoder.soft, 1.0
+    if isinstance(decoder, DmDecoder):
+        return CODECS.index('dm'), 0, decoder.delta, decoder.a_cte
+    raise Exception('Invalid decoder %r' % decoder, decoder)
+
+
+def _keyframe(state):
+    """ Returns a tuple of (value, lastbit) with a decoder state """
+
+    if 'integrator' in state:
+        return state['integrator'], 0
+    return state['last'], int(state.get('lastbit', 0))
+
+
+def write(f, bitstream, decoder, rate = 0, block = BLOCK):
+    """
+    Writes a seekable container
+
+    The bitstream is decoded once to get the keyframes.
+
+    Parameters
+    ----------
+
+    f : file object
+        Binary file were to write
+    bitstream : BitStream
+                Encoded sound
+    decoder : BtcDecoder, BtcFixedDecoder or DmDecoder
+              Decoder with the codec, parameters and start state of the
+              bitstream. It's used to calculate the keyframes
+    rate : int, optional
+           Sample rate of the sound. By default it's 0 (unknown)
+    block : int, optional
+            Bits by block. Must be a multiple of 8. By default it's BLOCK
+
+    Returns
+    -------
+
+    Returns the number of bytes written
+    """
+
+    if block <= 0 or block % 8:
+        raise Exception('Invalid block size %d' % block, block)
+
+    codec, q, param, a_cte = _params(decoder)
+    data = bitstream.tobitorder('MSB').data
+    nbits = len(bitstream)
+    step = block // 8
+    blocks = -(-nbits // block)
+
+    index = bytearray()
+    view = memoryview(data)
+    try:
+        for i in range(blocks):
+            value, lastbit = _keyframe(decoder.state)
+            index += KEYFRAME.pack(i * step, value, lastbit)
+            decoder.feed_packed(view[i * step:(i + 1) * step], 'MSB', \
+                                min(block, nbits - i * block))
+    finally:
+        view.release()
+
+    header = bytearray(HEADER_SIZE)
+    HEADER.pack_into(header, 0, MAGIC, VERSION, codec, decoder.width, q, \
+                     param, a_cte, rate, block, nbits, blocks)
+    f.write(header)
+    f.write(index)
+    f.write(data[:-(-nbits // 8)])
+    return HEADER_SIZE + len(index) + -(-nbits // 8)
+
+
+class Container(object):
+    """
+    Read only seekable container, mapped in memory
+
+    Only the header is parsed when it's opened, and decode_range only reads
+    the keyframes and the data of the blocks that it needs. Works like a
+    sequence of samples in that len(container) is the number of samples.
+
+    Parameters
+    ----------
+
+    filename : str
+               Seekable container file
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            f.seek(0, 2)
+            if f.tell() < HEADER_SIZE:
+                raise Exception('Invalid seekable container. Size %d' % \
+                                f.tell(), f.tell())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, codec, self.width, self.q, self.param, \
+                self.a_cte, self.rate, self.block, self.nbits, \
+                self.blocks = HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC:
+                raise Exception('Invalid seekable container magic %r' % \
+                                magic, magic)
+            if version != VERSION:
+                raise Exception('Unsupported version %d' % version, version)
+            if codec >= len(CODECS):
+                raise Exception('Invalid codec %d' % codec, codec)
+            if self.block <= 0 or self.block % 8 or \
+               self.blocks != -(-self.nbits // self.block):
+                raise Exception('Invalid block size %d' % self.block, \
+                                self.block)
+            self.codec = CODECS[codec]
+            self._data = HEADER_SIZE + self.blocks * KEYFRAME.size
+            end = self._data + -(-self.nbits // 8)
+            if end > len(self._map):
+                raise Exception('Truncated seekable container. Needs %d ' \
+                                'bytes' % end, end)
+        except Exception:
+            self.close()
+            raise
+
+    def __len__(self):
+        return self.nbits
+
+    def keyframe(self, index):
+        """ Returns a tuple of (offset, value, lastbit) of a block """
+        if index < 0 or index >= self.blocks:
+            raise IndexError('Invalid block %d' % index)
+        return KEYFRAME.unpack_from(self._map, \
+                                    HEADER_SIZE + index * KEYFRAME.size)
+
+    def decoder(self, index = 0):
+        """ Returns a decoder with the state at the begin of a block """
+
+        offset, value, lastbit = self.keyframe(index)
+        if self.codec == 'dm':
+            return DmDecoder(self.width, self.param, self.a_cte, \
+                             {'integrator' : int(value)})
+        codec = self.codec[3:]
+        if self.q:
+            return BtcFixedDecoder(self.width, self.param, codec, self.q, \
+                                   {'last' : int(value), \
+                                    'lastbit' : lastbit, 'q' : self.q})
+        return BtcDecoder(self.width, self.param, codec, \
+                          {'last' : value, 'lastbit' : lastbit})
+
+    def decode_range(self, start, n):
+        """
+        Decodes a range of samples
+
+        Parameters
+        ----------
+
+        start : int
+                First sample
+        n : int
+            Number of samples. The range is cut at the end of the sound
+
+        Returns
+        -------
+
+        Returns a bytestring with the samples. Only the blocks that contain
+        the range are decoded, from the keyframe of the first one.
+        """
+
+        if start < 0 or start > self.nbits or n < 0:
+            raise Exception('Invalid range %d, %d' % (start, n), start, n)
+
+        end = min(start + n, self.nbits)
+        if end <= start:
+            return b''
+
+        first = start // self.block
+        decoder = self.decoder(first)
+        offset = self._data + self.keyframe(first)[0]
+        skip = start - first * self.block
+        nbits = end - first * self.block
+
+        view = memoryview(self._map)[offset:offset + -(-nbits // 8)]
+        try:
+            audio = decoder.feed_packed(view, 'MSB', nbits)
+        finally:
+            view.release()
+        return audio[skip * self.width:]
+
+    def close(self):
+        """ Closes the container """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
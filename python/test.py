@@ -3,12 +3,46 @@
 
 import unittest
 import array
+import os
 import sys
 from math import sin, pi
 
 import ssc
+import ssc.aux
+import ssc.bench
+import ssc.btl
+import ssc.ihex
+import ssc.pcm
+import ssc.playback
+import ssc.progress
+import ssc.resample
+import ssc.seekable
 from ssc.aux import max_int, min_int, WIDTH_TYPE
 
+try:
+    import ssc.batch
+    _BATCH = True
+except ImportError:
+    _BATCH = False
+
+try:
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import audioop
+    _AUDIOOP = True
+except ImportError:
+    _AUDIOOP = False
+
+try:
+    from intelhex import IntelHex
+    _INTELHEX = True
+except ImportError:
+    _INTELHEX = False
+
+WAV2SSC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', \
+                       'tools', 'bin', 'wav2ssc.py')
+
 MAX_8 = max_int(1)
 MAX_16 = max_int(2)
 MAX_32 = max_int(4)
@@ -31,6 +65,27 @@ TEST_T = 0.5
             raw32.append(int(MAX_32 * f))
 '''
 
+
+def pack_msb(bitstream):
+    '''Packs a list of bits in MSB order'''
+    output = bytearray()
+    for i in range(0, len(bitstream), 8):
+        byte = 0
+        for bit in bitstream[i:i+8]:
+            byte = (byte << 1) | int(bool(bit))
+        output.append(byte << (8 - len(bitstream[i:i+8])))
+    return bytes(output)
+
+
+def sine16(samples, amplitude = 0.9):
+    '''Generates a signed 16 bit 440 Hz sinusoidal sound'''
+    freq = 440.0 * 2 * pi / TEST_FS
+    raw16 = array.array(WIDTH_TYPE[2])
+    for i in range(samples):
+        raw16.append(int(MAX_16 * amplitude * sin(freq * i)))
+    return raw16.tobytes()
+
+
 class Lin2dmBadInput(unittest.TestCase):
     '''Test bad input in lin2dm'''
 
@@ -39,7 +94,7 @@ class Lin2dmBadInput(unittest.TestCase):
         raw8 = array.array(WIDTH_TYPE[1])
         raw16 = array.array(WIDTH_TYPE[2])
         raw32 = array.array(WIDTH_TYPE[4])
-        samples = int(TEST_T // TEST_FS)
+        samples = int(TEST_T * TEST_FS)
 
         # test_t seconds of pure silence
         for i in range(samples):
@@ -99,7 +154,7 @@ class Dm2linBadInput(unittest.TestCase):
         self.test_data = []
         
         # Generates test_t seconds of 01 sequence aka silence
-        samples = int(TEST_T // TEST_FS)
+        samples = int(TEST_T * TEST_FS)
         for i in range(samples):
             self.test_data.append(i%2)
 
@@ -144,7 +199,7 @@ class lin2btcBadInput(unittest.TestCase):
     def setUp(self):
         '''Fills test data'''
         raw8 = array.array(WIDTH_TYPE[1])
-        samples = int(TEST_T // TEST_FS)
+        samples = int(TEST_T * TEST_FS)
 
         # test_t seconds of pure silence
         for i in range(samples):
@@ -198,7 +253,7 @@ class Btc2linBadInput(unittest.TestCase):
         self.test_data = []
         
         # Generates test_t seconds of 01 sequence aka silence
-        samples = int(TEST_T // TEST_FS)
+        samples = int(TEST_T * TEST_FS)
         for i in range(samples):
             self.test_data.append(i%2)
 
@@ -261,6 +316,1587 @@ class Calc_rcBadInput(unittest.TestCase):
         self.assertRaises(Exception, ssc.btc.calc_rc, TEST_FS, 21, None)
 
 
+class PackedDecoders(unittest.TestCase):
+    '''Test btc2lin_packed and dm2lin_packed against bit a bit decoders'''
+
+    def setUp(self):
+        '''Fills test data'''
+        self.test_data16 = sine16(4001)
+
+    def assertClose(self, fragment, other, width):
+        '''Checks that two fragments only differs in rounding'''
+        first = array.array(WIDTH_TYPE[width], fragment)
+        second = array.array(WIDTH_TYPE[width], other)
+        self.assertEqual(len(first), len(second))
+        for x, y in zip(first, second):
+            self.assertTrue(abs(x - y) <= 1)
+
+    def test_btc_packed(self):
+        '''btc2lin_packed should decode like btc2lin'''
+        for codec in ('1.0', '1.7'):
+            bits, _ = ssc.lin2btc(self.test_data16, 2, 21, codec)
+            reference, state = ssc.btc2lin(bits, 2, 21, codec)
+            packed = pack_msb(bits)
+            fragment, _ = ssc.btc2lin_packed(packed, 2, 21, codec, \
+                                             nbits=len(bits))
+            self.assertClose(fragment, reference, 2)
+
+            # In chunks and with LSB order
+            head, newstate = ssc.btc2lin_packed(packed[:100], 2, 21, codec, \
+                                                nbits=795)
+            lsb = pack_msb(bits[795:]).translate(ssc.aux.BIT_REVERSE)
+            tail, newstate = ssc.btc2lin_packed(lsb, 2, 21, codec, 'LSB', \
+                                        nbits=len(bits) - 795, state=newstate)
+            self.assertClose(head + tail, reference, 2)
+            self.assertAlmostEqual(newstate['last'], state['last'])
+
+    def test_dm_packed(self):
+        '''dm2lin_packed should decode exactly like dm2lin'''
+        for a_cte in (1.0, 0.99):
+            bits, _ = ssc.lin2dm(self.test_data16, 2, MAX_16 // 21)
+            reference, state = ssc.dm2lin(bits, 2, MAX_16 // 21, a_cte)
+            packed = pack_msb(bits)
+            fragment, newstate = ssc.dm2lin_packed(packed, 2, MAX_16 // 21, \
+                                                a_cte, nbits=len(bits))
+            self.assertEqual(fragment, reference)
+            self.assertEqual(newstate, state)
+
+            head, newstate = ssc.dm2lin_packed(packed[:100], 2, MAX_16 // 21, \
+                                               a_cte, nbits=795)
+            tail, newstate = ssc.dm2lin_packed(pack_msb(bits[795:]), 2, \
+                                MAX_16 // 21, a_cte, nbits=len(bits) - 795, \
+                                state=newstate)
+            self.assertEqual(head + tail, reference)
+
+
+class BitStreamType(unittest.TestCase):
+    '''Test BitStream container'''
+
+    def setUp(self):
+        '''Fills test data'''
+        self.bits = [bool((i * 7) % 3) for i in range(45)]
+        self.stream = ssc.BitStream.frombits(self.bits)
+
+    def test_sequence(self):
+        '''BitStream should behave like a list of bools'''
+        self.assertEqual(len(self.stream), 45)
+        self.assertEqual(list(self.stream), self.bits)
+        self.assertEqual(self.stream[3], self.bits[3])
+        self.assertEqual(self.stream[-1], self.bits[-1])
+        self.assertRaises(IndexError, self.stream.__getitem__, 45)
+        for start, stop in ((0, 16), (3, 30), (9, 45), (20, 20)):
+            self.assertEqual(list(self.stream[start:stop]), \
+                             self.bits[start:stop])
+        self.assertEqual(list(self.stream[::3]), self.bits[::3])
+        self.assertFalse(ssc.BitStream())
+
+    def test_concatenation(self):
+        '''BitStream should concatenate at any bit position'''
+        for cut in (0, 5, 8, 13, 45):
+            first = self.stream[:cut]
+            second = self.stream[cut:]
+            self.assertEqual(first + second, self.stream)
+            first += second.tobitorder('LSB')
+            self.assertEqual(list(first), self.bits)
+        stream = ssc.BitStream()
+        for bit in self.bits:
+            stream.append(bit)
+        self.assertEqual(stream, self.bits)
+
+    def test_packed_data(self):
+        '''BitStream packed data should be the pack output'''
+        self.assertEqual(bytes(self.stream.data), pack_msb(self.bits))
+        self.assertEqual(ssc.pack(self.stream), pack_msb(self.bits))
+        lsb = self.stream.tobitorder('LSB')
+        self.assertEqual(lsb.bitorder, 'LSB')
+        self.assertEqual(list(lsb), self.bits)
+        self.assertEqual(lsb.tobytes(), \
+                         pack_msb(self.bits).translate(ssc.aux.BIT_REVERSE))
+        self.assertEqual(ssc.pack(lsb), pack_msb(self.bits))
+
+    def test_codecs(self):
+        '''Encoders should return a BitStream accepted by the decoders'''
+        data = sine16(1001)
+        bits, _ = ssc.lin2dm(data, 2, MAX_16 // 21)
+        self.assertTrue(isinstance(bits, ssc.BitStream))
+        self.assertEqual(len(bits), 1001)
+        self.assertEqual(ssc.dm2lin(bits, 2, MAX_16 // 21), \
+                         ssc.dm2lin(list(bits), 2, MAX_16 // 21))
+        for codec in ('1.0', '1.7'):
+            bits, _ = ssc.lin2btc(data, 2, 21, codec)
+            self.assertTrue(isinstance(bits, ssc.BitStream))
+            self.assertEqual(len(bits), 1001)
+            fragment, _ = ssc.btc2lin(bits, 2, 21, codec)
+            packed, _ = ssc.btc2lin_packed(pack_msb(list(bits)), 2, 21, \
+                                           codec, nbits=1001)
+            self.assertEqual(fragment, packed)
+            reference, _ = ssc.btc2lin(list(bits), 2, 21, codec)
+            reference = array.array(WIDTH_TYPE[2], reference)
+            fragment = array.array(WIDTH_TYPE[2], fragment)
+            self.assertEqual(len(fragment), len(reference))
+            for x, y in zip(fragment, reference):
+                self.assertAlmostEqual(x, y, delta=1)
+
+    def test_buffer(self):
+        '''Packed data should be available as a buffer'''
+        packed = pack_msb(self.bits)
+        self.assertEqual(bytes(self.stream), packed)
+        view = memoryview(self.stream.data)
+        self.assertEqual(view.tobytes(), packed)
+        self.assertTrue(view.readonly)
+        self.assertEqual(bytes(self.stream.tobitorder('LSB')), \
+                         packed.translate(ssc.aux.BIT_REVERSE))
+        if sys.version_info >= (3, 12):
+            self.assertEqual(memoryview(self.stream).tobytes(), packed)
+
+    def test_caller_data(self):
+        '''Should not change the bytearray of the caller'''
+        for bitorder in ('MSB', 'LSB'):
+            data = bytearray(b'\xff\xff')
+            stream = ssc.BitStream(data, 3, bitorder)
+            self.assertEqual(data, bytearray(b'\xff\xff'))
+            self.assertEqual(list(stream), [True] * 3)
+            self.assertEqual(len(stream.tobytes()), 1)
+            stream.extend([False] * 9)
+            self.assertEqual(data, bytearray(b'\xff\xff'))
+
+        # Whole bytes are used without copy
+        data = bytearray(b'\xa5\x0f')
+        stream = ssc.BitStream(data)
+        self.assertIs(stream._data, data)
+
+    def test_extend_unaligned(self):
+        '''Extending from the middle of a byte should keep all bits'''
+        for bitorder in ('MSB', 'LSB'):
+            for head in (1, 3, 7, 9):
+                for tail in (0, 1, 5, 8, 13, 200):
+                    stream = ssc.BitStream.frombits(self.bits[:head], bitorder)
+                    stream.extend(ssc.BitStream.frombits( \
+                                  self.bits[head:head + tail], bitorder))
+                    stream += self.bits[head + tail:head + tail + 11]
+                    expected = self.bits[:head + tail + 11]
+                    self.assertEqual(len(stream), len(expected))
+                    self.assertEqual(list(stream), expected)
+                    self.assertEqual(stream, ssc.BitStream.frombits( \
+                                     expected, bitorder))
+
+
+class PackUnpack(unittest.TestCase):
+    '''Test pack, pack_into and unpack'''
+
+    def setUp(self):
+        '''Fills test data'''
+        self.bits = [bool((i * 5) % 7 > 2) for i in range(1003)]
+        self.packed = pack_msb(self.bits)
+        self.numpy = ssc.aux._NUMPY
+
+    def tearDown(self):
+        ssc.aux._NUMPY = self.numpy
+
+    def engines(self):
+        '''Runs with NumPy (if it's available) and with the pure fallback'''
+        ssc.aux._NUMPY = False
+        yield
+        if self.numpy:
+            ssc.aux._NUMPY = True
+            yield
+
+    def test_pack(self):
+        '''pack should pack any bitstream in MSB and LSB order'''
+        lsb = self.packed.translate(ssc.aux.BIT_REVERSE)
+        for _ in self.engines():
+            self.assertEqual(ssc.pack(self.bits), self.packed)
+            self.assertEqual(ssc.pack(self.bits, 'LSB'), lsb)
+            self.assertEqual(ssc.pack(bytes(self.bits)), self.packed)
+            self.assertEqual(ssc.pack(memoryview(bytearray(self.bits)), \
+                                      'LSB'), lsb)
+            self.assertEqual(ssc.pack(iter([1, 0, 4])), b'\xa0')
+            self.assertEqual(ssc.pack([]), b'')
+            self.assertRaises(Exception, ssc.pack, self.bits, 'PDP')
+
+    def test_pack_into(self):
+        '''pack_into should write in a preallocated buffer'''
+        for _ in self.engines():
+            buff = bytearray(len(self.packed) + 4)
+            self.assertEqual(ssc.pack_into(self.bits, buff, 4), \
+                             len(self.packed))
+            self.assertEqual(bytes(buff[4:]), self.packed)
+            self.assertRaises(Exception, ssc.pack_into, self.bits, buff, 5)
+
+    def test_unpack(self):
+        '''unpack should be the inverse of pack'''
+        for _ in self.engines():
+            self.assertEqual(ssc.unpack(self.packed, nbits=1003), self.bits)
+            self.assertEqual(ssc.unpack(ssc.pack(self.bits, 'LSB'), 'LSB', \
+                                        1003), self.bits)
+            self.assertEqual(len(ssc.unpack(self.packed)), \
+                             len(self.packed) * 8)
+            self.assertEqual(ssc.unpack(b'\x81'), \
+                             [True] + [False] * 6 + [True])
+
+
+class StreamingCodecs(unittest.TestCase):
+    '''Test stateful encoder and decoder objects'''
+
+    def setUp(self):
+        '''Fills test data'''
+        self.test_data16 = sine16(2003)
+
+    def feed_frames(self, codec, data, frame):
+        '''Feeds data in frames and flush the codec'''
+        output = None
+        for i in range(0, len(data), frame):
+            chunk = codec.feed(data[i:i + frame])
+            if output is None:
+                output = chunk
+            else:
+                output += chunk
+        return output + codec.flush()
+
+    def test_encoders(self):
+        '''Encoders should generate the same bitstream that lin2btc/lin2dm'''
+        for codec in ('1.0', '1.7'):
+            reference, state = ssc.lin2btc(self.test_data16, 2, 21, codec)
+            encoder = ssc.BtcEncoder(2, 21, codec)
+            self.assertEqual(self.feed_frames(encoder, self.test_data16, 128), \
+                             reference)
+            self.assertEqual(encoder.state, state)
+
+        reference, state = ssc.lin2dm(self.test_data16, 2, MAX_16 // 21)
+        encoder = ssc.DmEncoder(2, MAX_16 // 21)
+        self.assertEqual(self.feed_frames(encoder, self.test_data16, 130), \
+                         reference)
+        self.assertEqual(encoder.state, state)
+
+    def test_feed_whole_bytes(self):
+        '''Encoders should return whole bytes until flush'''
+        encoder = ssc.BtcEncoder(2, 21)
+        self.assertEqual(len(encoder.feed(self.test_data16[:2 * 13])), 8)
+        self.assertEqual(len(encoder.feed(self.test_data16[26:40])), 8)
+        self.assertEqual(len(encoder.flush()), 4)
+        self.assertEqual(len(encoder.flush()), 0)
+
+    def test_decoders(self):
+        '''Decoders should decode like btc2lin/dm2lin'''
+        for codec in ('1.0', '1.7'):
+            bits, _ = ssc.lin2btc(self.test_data16, 2, 21, codec)
+            reference, state = ssc.btc2lin(list(bits), 2, 21, codec)
+            decoder = ssc.BtcDecoder(2, 21, codec)
+            fragment = b''.join(decoder.feed(bits[i:i + 64]) \
+                                for i in range(0, len(bits), 64))
+            self.assertEqual(len(fragment), len(reference))
+            self.assertAlmostEqual(decoder.state['last'], state['last'])
+
+        bits, _ = ssc.lin2dm(self.test_data16, 2, MAX_16 // 21)
+        reference, state = ssc.dm2lin(list(bits), 2, MAX_16 // 21)
+        decoder = ssc.DmDecoder(2, MAX_16 // 21)
+        fragment = b''.join(decoder.feed(list(bits[i:i + 100])) \
+                            for i in range(0, len(bits), 100))
+        self.assertEqual(fragment + decoder.flush(), reference)
+        self.assertEqual(decoder.state, state)
+
+    def test_buffer_inputs(self):
+        '''Encoders should accept any buffer of samples'''
+        import mmap
+        reference, _ = ssc.lin2btc(self.test_data16, 2, 21)
+        mapped = mmap.mmap(-1, len(self.test_data16))
+        mapped.write(self.test_data16)
+        for fragment in (bytearray(self.test_data16), \
+                         memoryview(self.test_data16), mapped, \
+                         array.array('h', self.test_data16)):
+            self.assertEqual(ssc.lin2btc(fragment, 2, 21)[0], reference)
+        self.assertRaises(Exception, ssc.lin2btc, \
+                          array.array('h', self.test_data16), 4, 21)
+
+        # 4 byte samples are read as 32 bit integers
+        raw32 = array.array(WIDTH_TYPE[4], \
+                    [x << 16 for x in array.array('h', self.test_data16)])
+        self.assertEqual(raw32.itemsize, 4)
+        bits, _ = ssc.lin2dm(raw32, 4)
+        self.assertEqual(len(bits), len(raw32))
+        self.assertEqual(len(ssc.dm2lin(bits, 4)[0]), 4 * len(raw32))
+
+    @unittest.skipUnless(ssc.aux._NUMPY, 'needs NumPy')
+    def test_numpy_inputs(self):
+        '''Encoders should accept NumPy arrays of signed integers'''
+        import numpy
+        reference, _ = ssc.lin2dm(self.test_data16, 2)
+        samples = numpy.frombuffer(self.test_data16, dtype=numpy.int16)
+        self.assertEqual(ssc.lin2dm(samples, 2)[0], reference)
+        self.assertEqual(ssc.lin2dm(samples.astype('>i2'), 2)[0], reference)
+        doubled = numpy.repeat(samples, 2)
+        self.assertEqual(ssc.lin2dm(doubled[::2], 2)[0], reference)
+        self.assertRaises(Exception, ssc.lin2dm, samples.astype(float), 2)
+
+    def test_bad_arguments(self):
+        '''Codec objects should validate arguments on creation'''
+        self.assertRaises(Exception, ssc.BtcEncoder, 3, 21)
+        self.assertRaises(Exception, ssc.BtcEncoder, 2, 1)
+        self.assertRaises(Exception, ssc.BtcDecoder, 2, 21, '2.0')
+        self.assertRaises(Exception, ssc.DmEncoder, 2, MAX_16)
+        self.assertRaises(Exception, ssc.DmDecoder, 2, None, 1.5)
+
+
+@unittest.skipUnless(_BATCH, 'ssc.batch needs NumPy')
+class BatchCodecs(unittest.TestCase):
+
+    def setUp(self):
+        # Sounds of different length
+        self.fragments = [sine16(n, 0.3 + n / 2000.0) \
+                          for n in (300, 1, 1000, 7, 64)]
+
+    def test_btc_same_as_serial(self):
+        '''lin2btc_many/btc2lin_many should give the same that lin2btc/btc2lin'''
+        for codec in ('1.0', '1.7'):
+            bitstreams, states = ssc.batch.lin2btc_many(self.fragments, 2, \
+                                                        21, codec)
+            fragments, dstates = ssc.batch.btc2lin_many(bitstreams, 2, 21, \
+                                                        codec)
+            for i, fragment in enumerate(self.fragments):
+                bits, state = ssc.lin2btc(fragment, 2, 21, codec)
+                self.assertEqual(bitstreams[i], bits)
+                self.assertAlmostEqual(states[i]['lastbtc'], state['lastbtc'])
+                output, state = ssc.btc2lin(bits, 2, 21, codec)
+                self.assertEqual(fragments[i], output)
+                self.assertAlmostEqual(dstates[i]['last'], state['last'])
+
+    def test_dm_same_as_serial(self):
+        '''lin2dm_many/dm2lin_many should give the same that lin2dm/dm2lin'''
+        for a_cte in (1.0, 0.99):
+            bitstreams, states = ssc.batch.lin2dm_many(self.fragments, 2, \
+                                                       MAX_16 // 21, a_cte)
+            fragments, dstates = ssc.batch.dm2lin_many(bitstreams, 2, \
+                                                       MAX_16 // 21, a_cte)
+            for i, fragment in enumerate(self.fragments):
+                bits, state = ssc.lin2dm(fragment, 2, MAX_16 // 21, a_cte)
+                self.assertEqual(bitstreams[i], bits)
+                self.assertEqual(states[i], state)
+                output, state = ssc.dm2lin(bits, 2, MAX_16 // 21, a_cte)
+                self.assertEqual(fragments[i], output)
+                self.assertEqual(dstates[i], state)
+
+    def test_states(self):
+        '''Batch encoders should continue from the states of previus call'''
+        half = [f[:len(f) // 4 * 2] for f in self.fragments]
+        rest = [f[len(f) // 4 * 2:] for f in self.fragments]
+        first, states = ssc.batch.lin2btc_many(half, 2, 21, '1.7')
+        second, _ = ssc.batch.lin2btc_many(rest, 2, 21, '1.7', states)
+        whole, _ = ssc.batch.lin2btc_many(self.fragments, 2, 21, '1.7')
+        for i in range(len(whole)):
+            self.assertEqual(first[i] + second[i], whole[i])
+
+    def test_invalid_dm(self):
+        '''DM batch codecs should validate like lin2dm and dm2lin'''
+        bits = [[0, 1] * 10]
+        for delta in (0, -1, MAX_16):
+            self.assertRaises(Exception, ssc.batch.lin2dm_many, \
+                              self.fragments, 2, delta)
+            self.assertRaises(Exception, ssc.batch.dm2lin_many, bits, 2, delta)
+        for a_cte in (0, -0.5, 1.5):
+            self.assertRaises(Exception, ssc.batch.dm2lin_many, bits, 2, \
+                              a_cte=a_cte)
+
+
+class ConstantRuns(unittest.TestCase):
+
+    def setUp(self):
+        speech = ssc.bench.corpus('speech', 6000, 2)
+        dc = array.array(WIDTH_TYPE[2], [1000] * 20001).tobytes()
+        # Bytes 01 01 01 ... are runs of 0x0101 samples
+        self.fragment = speech[:2223 * 2] + b'\0' * 30000 + b'\1' * 5002 + \
+                        speech[2223 * 2:] + dc + sine16(3000) + b'\0' * 126
+        self.encoders = ( \
+            lambda: ssc.BtcEncoder(2, 21, '1.0'),
+            lambda: ssc.BtcEncoder(2, 21, '1.7', {'lastbtc' : 300.0, \
+                                                  'lastbit' : True}),
+            lambda: ssc.BtcFixedEncoder(2, 21, '1.7', 12),
+            lambda: ssc.BtcFixedEncoder(2, 21, '1.0', 20),
+            lambda: ssc.DmEncoder(2),
+            lambda: ssc.DmEncoder(2, None, 0.99),
+        )
+
+    def tearDown(self):
+        ssc.aux.RUN = 64
+
+    def encode(self, new_encoder, chunk):
+        encoder = new_encoder()
+        bitstream = ssc.BitStream()
+        for i in range(0, len(self.fragment), chunk * 2):
+            bitstream.extend(encoder.feed(self.fragment[i:i + chunk * 2]))
+        bitstream.extend(encoder.flush())
+        return bitstream, encoder.state
+
+    def test_bit_identical(self):
+        '''Cycle detection should give the same bits and state'''
+        for new_encoder in self.encoders:
+            ssc.aux.RUN = None
+            reference = self.encode(new_encoder, 100000)
+            ssc.aux.RUN = 64
+            for chunk in (100000, 7001):
+                self.assertEqual(self.encode(new_encoder, chunk), reference)
+
+    def test_runs(self):
+        '''Should find the runs of equal samples'''
+        data = b'\1\2' * 10 + b'\0' * 201 + b'\3' * 130 + b'\1\2\3'
+        self.assertEqual(ssc.aux._runs(memoryview(data), 2), \
+                         [(0, 20, False), (20, 220, True), \
+                          (220, 222, False), (222, 350, True), \
+                          (350, 354, False)])
+        self.assertEqual(ssc.aux._runs(memoryview(data[:20]), 2), \
+                         [(0, 20, False)])
+        ssc.aux.RUN = None
+        self.assertEqual(ssc.aux._runs(memoryview(data), 2), \
+                         [(0, 354, False)])
+
+class ParallelCodecs(unittest.TestCase):
+
+    def setUp(self):
+        self.fragment = sine16(40000)
+
+    def test_btc_bit_identical(self):
+        '''lin2btc with workers should give the same that sequential'''
+        for codec in ('1.0', '1.7'):
+            state = {'lastbtc' : 1000.0, 'lastbit' : True}
+            bits, newstate = ssc.lin2btc(self.fragment, 2, 21, codec, state)
+            pbits, pnewstate = ssc.lin2btc(self.fragment, 2, 21, codec, \
+                                           state, workers=3)
+            self.assertEqual(pbits, bits)
+            self.assertEqual(pnewstate, newstate)
+
+    def test_dm_bit_identical(self):
+        '''lin2dm with workers should give the same that sequential'''
+        for a_cte in (1.0, 0.99):
+            bits, state = ssc.lin2dm(self.fragment, 2, None, a_cte)
+            pbits, pstate = ssc.lin2dm(self.fragment, 2, None, a_cte, \
+                                       workers=3)
+            self.assertEqual(pbits, bits)
+            self.assertEqual(pstate, state)
+
+    def test_btc_decoder(self):
+        '''btc2lin with workers should match the sequential decoder'''
+        for codec in ('1.0', '1.7'):
+            bits, _ = ssc.lin2btc(self.fragment + sine16(5), 2, 21, codec)
+            state = {'last' : 0.7, 'lastbit' : 1}
+            reference, rstate = ssc.btc2lin(list(bits), 2, 21, codec, state)
+            fragment, pstate = ssc.btc2lin(bits, 2, 21, codec, state, \
+                                           workers=3)
+            reference = array.array(WIDTH_TYPE[2], reference)
+            fragment = array.array(WIDTH_TYPE[2], fragment)
+            self.assertEqual(len(fragment), len(reference))
+            for x, y in zip(fragment, reference):
+                self.assertAlmostEqual(x, y, delta=1)
+            self.assertAlmostEqual(pstate['last'], rstate['last'])
+
+    def test_bad_arguments(self):
+        '''Parallel codecs should validate arguments'''
+        self.assertRaises(Exception, ssc.lin2btc, self.fragment, 2, 1, \
+                          workers=2)
+        self.assertRaises(Exception, ssc.lin2dm, self.fragment, 2, MAX_16, \
+                          workers=2)
+        self.assertRaises(Exception, ssc.btc2lin, [1, 0], 2, 21, '2.0', \
+                          workers=2)
+
+
+class FixedPointBtc(unittest.TestCase):
+
+    def setUp(self):
+        self.fragment = sine16(5000) + ssc.bench.corpus('speech', 3000, 2)
+
+    def test_tables(self):
+        '''Transition tables should give the same that integer operations'''
+        for codec in ('1.0', '1.7'):
+            for width, q in ((1, 8), (2, 12), (2, 16)):
+                fragment = ssc.bench.corpus('speech', 3000, width)
+                encoders = [ssc.BtcFixedEncoder(width, 21, codec, q, \
+                                                tables=tables) \
+                            for tables in (False, True)]
+                bits = []
+                for encoder in encoders:
+                    bitstream = encoder.feed(fragment)
+                    bitstream.extend(encoder.flush())
+                    bits.append(bitstream)
+                self.assertEqual(bits[0], bits[1])
+                self.assertEqual(encoders[0].state, encoders[1].state)
+
+                decoders = [ssc.BtcFixedDecoder(width, 21, codec, q, \
+                                                tables=tables) \
+                            for tables in (False, True)]
+                outputs = [decoder.feed(bits[0]) for decoder in decoders]
+                self.assertEqual(outputs[0], outputs[1])
+                self.assertEqual(decoders[0].state, decoders[1].state)
+
+    def test_encoder_tracks_decoder(self):
+        '''Encoder voltage should be exactly the decoder voltage'''
+        for codec in ('1.0', '1.7'):
+            for q in (8, 16, 24):
+                bits, state = ssc.lin2btc(self.fragment, 2, 21, codec, q=q)
+                fragment, dstate = ssc.btc2lin(bits, 2, 21, codec, q=q)
+                self.assertEqual(len(fragment), len(self.fragment))
+                self.assertEqual(state['lastbtc'], dstate['last'])
+                self.assertEqual(state.get('lastbit'), dstate.get('lastbit'))
+                self.assertTrue(isinstance(state['lastbtc'], int))
+
+    def test_quality(self):
+        '''Fixed point engine should be as good as the float engine'''
+        def error(codec, q):
+            bits, _ = ssc.lin2btc(self.fragment, 2, 21, codec, q=q)
+            fragment, _ = ssc.btc2lin(list(bits), 2, 21, codec, q=q)
+            return sum((x - y) ** 2 for x, y in \
+                       zip(array.array(WIDTH_TYPE[2], self.fragment), \
+                           array.array(WIDTH_TYPE[2], fragment)))
+        for codec in ('1.0', '1.7'):
+            reference = error(codec, None)
+            self.assertLess(error(codec, 16), reference * 1.05)
+
+    def test_chunks(self):
+        '''Encoding and decoding in chunks should give the same'''
+        for codec in ('1.0', '1.7'):
+            bits, state = ssc.lin2btc(self.fragment, 2, 21, codec, q=12)
+            head, hstate = ssc.lin2btc(self.fragment[:3000], 2, 21, codec, \
+                                       q=12)
+            tail, tstate = ssc.lin2btc(self.fragment[3000:], 2, 21, codec, \
+                                       hstate, q=12)
+            self.assertEqual(head + tail, bits)
+            self.assertEqual(tstate, state)
+
+            fragment, dstate = ssc.btc2lin(bits, 2, 21, codec, q=12)
+            packed, pstate = ssc.btc2lin_packed(ssc.pack(bits, 'LSB'), 2, \
+                                                21, codec, 'LSB', len(bits), \
+                                                state=None, q=12)
+            self.assertEqual(packed, fragment)
+            self.assertEqual(pstate, dstate)
+
+    def test_parallel(self):
+        '''lin2btc with workers should give the same that sequential'''
+        fragment = sine16(40000)
+        for codec in ('1.0', '1.7'):
+            bits, state = ssc.lin2btc(fragment, 2, 21, codec, q=16)
+            pbits, pstate = ssc.lin2btc(fragment, 2, 21, codec, workers=3, \
+                                        q=16)
+            self.assertEqual(pbits, bits)
+            self.assertEqual(pstate, state)
+
+    def test_bad_arguments(self):
+        '''Fixed point engine should validate arguments'''
+        self.assertRaises(Exception, ssc.BtcFixedEncoder, 2, 21, '1.0', 3)
+        self.assertRaises(Exception, ssc.BtcFixedDecoder, 2, 21, '1.0', 33)
+        self.assertRaises(Exception, ssc.BtcFixedEncoder, 2, 64, '1.0', 4)
+        self.assertRaises(Exception, ssc.BtcFixedEncoder, 2, 21, '2.0')
+        _, state = ssc.lin2btc(self.fragment, 2, 21, q=16)
+        self.assertRaises(Exception, ssc.lin2btc, self.fragment, 2, 21, \
+                          '1.0', state, q=12)
+        self.assertRaises(Exception, ssc.btc2lin, [1, 0], 2, 21, '1.0', \
+                          {'last' : 0.5}, q=12)
+
+    def test_ansi_c(self):
+        '''lin2btc_c8 should give the same bits that EncodeBTc10_8'''
+        # Outputs of the C encoder compiled with BTC_BIG_ENDIAN
+        sine = bytes(int(128 + 127 * sin(2 * pi * i / 37)) for i in range(100))
+        vectors = ((21, sine, 'fff800007fffe00003ffff0000'),
+                   (4, bytes(range(0, 256, 4)), '09252aaaab5b6ddd'),
+                   (1, bytes([0, 255] * 8 + [255] * 11), 'ffffffe0'),
+                  )
+        for soft, samples, output in vectors:
+            bitstream, state = ssc.lin2btc_c8(samples, soft)
+            self.assertEqual(len(bitstream), len(samples))
+            self.assertEqual(bitstream.tobytes().hex(), output)
+
+            # Continues with the state
+            first, state = ssc.lin2btc_c8(samples[:13], soft)
+            rest, _ = ssc.lin2btc_c8(samples[13:], soft, state)
+            first.extend(rest)
+            self.assertEqual(first, bitstream)
+
+        self.assertRaises(Exception, ssc.lin2btc_c8, sine, 0)
+        self.assertRaises(Exception, ssc.lin2btc_c8, sine, 256)
+
+class PcmConditioning(unittest.TestCase):
+
+    def setUp(self):
+        self.numpy = ssc.pcm._NUMPY
+
+    def tearDown(self):
+        ssc.pcm._NUMPY = self.numpy
+
+    def engines(self):
+        '''Runs a test with the pure Python and the NumPy engines'''
+        ssc.pcm._NUMPY = False
+        yield 'python'
+        if self.numpy:
+            ssc.pcm._NUMPY = True
+            yield 'numpy'
+
+    def test_condition(self):
+        '''condition should convert width, bias, downmix and get the peak'''
+        for engine in self.engines():
+            unsigned8 = bytes([0, 128, 255, 64])
+            output, peak = ssc.pcm.condition(unsigned8, 1, unsigned=True)
+            self.assertEqual(array.array('h', output).tolist(), \
+                             [-32768, 0, 32512, -16384])
+            self.assertEqual(peak, 32768)
+
+            stereo = array.array('h', [1, -1, 3, -3, 32767, -32768]).tobytes()
+            output, peak = ssc.pcm.condition(stereo, 2, 2, (0.75, 0.25))
+            self.assertEqual(array.array('h', output).tolist(), [0, 1, 16383])
+            self.assertEqual(peak, 16383)
+
+            output, _ = ssc.pcm.condition(stereo, 2, outwidth=1)
+            self.assertEqual(array.array('b', output).tolist(), \
+                             [0, -1, 0, -1, 127, -128])
+
+    def test_full_scale_downmix(self):
+        '''Downmix of full scale channels should clip, without wrap'''
+        stereo = array.array('h', [32767, 32767, -32768, -32768, 32767, \
+                                   -32768] * 100).tobytes()
+        for engine in self.engines():
+            for weights, expected in (((1, 1), [32767, -32768, -1]), \
+                                      ((0.5, 0.5), [32767, -32768, -1]), \
+                                      ((0.75, 0.75), [32767, -32768, -1])):
+                output, peak = ssc.pcm.condition(stereo, 2, 2, weights)
+                self.assertEqual(array.array('h', output).tolist(), \
+                                 expected * 100)
+                self.assertEqual(peak, 32768)
+
+            quad = array.array('h', [32767] * 4 + [-32768] * 4).tobytes()
+            output, _ = ssc.pcm.condition(quad, 2, 4, (1, 1, 1, 1), 4)
+            self.assertEqual(array.array(WIDTH_TYPE[4], output).tolist(), \
+                             [max_int(4), -max_int(4) - 1])
+
+    def test_gain(self):
+        '''gain should round to minus infinity and clip'''
+        for engine in self.engines():
+            data = array.array('h', [3, -3, 20000, -20000]).tobytes()
+            self.assertEqual(array.array('h', ssc.pcm.gain(data, 2, 0.5)) \
+                             .tolist(), [1, -2, 10000, -10000])
+            self.assertEqual(array.array('h', ssc.pcm.gain(data, 2, 2)) \
+                             .tolist(), [6, -6, 32767, -32768])
+
+    @unittest.skipUnless(_AUDIOOP, 'needs audioop to compare')
+    def test_same_as_audioop(self):
+        '''ssc.pcm should give the same results that audioop'''
+        stereo = sine16(3000)
+        for engine in self.engines():
+            output, peak = ssc.pcm.condition(stereo, 2, 2, (0.75, 0.25))
+            mono = audioop.tomono(stereo, 2, 0.75, 0.25)
+            self.assertEqual(output, mono)
+            self.assertEqual(peak, audioop.max(mono, 2))
+            self.assertEqual(ssc.pcm.gain(mono, 2, 1.3), \
+                             audioop.mul(mono, 2, 1.3))
+
+            for inrate, outrate in ((44100, 22000), (8000, 22000)):
+                state = rstate = None
+                for i in range(0, len(mono), 700):
+                    output, state = ssc.pcm.ratecv(mono[i:i + 700], 2, \
+                                                   inrate, outrate, state)
+                    reference, rstate = audioop.ratecv(mono[i:i + 700], 2, \
+                                            1, inrate, outrate, rstate)
+                    self.assertEqual(output, reference)
+                    self.assertEqual(state, rstate)
+
+
+def tone16(freq, rate, samples, amplitude = 0.5):
+    '''Generates a signed 16 bit sinusoidal sound of any frecuency'''
+    step = freq * 2 * pi / rate
+    return array.array(WIDTH_TYPE[2], [int(MAX_16 * amplitude * sin(step * i)) \
+                                       for i in range(samples)]).tobytes()
+
+
+def rms16(fragment):
+    '''Root mean square of signed 16 bit samples'''
+    samples = array.array(WIDTH_TYPE[2], fragment)
+    return (sum(x * x for x in samples) / len(samples)) ** 0.5
+
+
+class Resampling(unittest.TestCase):
+
+    def setUp(self):
+        self.numpy = ssc.resample._NUMPY
+
+    def tearDown(self):
+        ssc.resample._NUMPY = self.numpy
+
+    def engines(self):
+        '''Runs a test with the pure Python and the NumPy engines'''
+        ssc.resample._NUMPY = False
+        yield 'python'
+        if self.numpy:
+            ssc.resample._NUMPY = True
+            yield 'numpy'
+
+    def test_length_and_chunks(self):
+        '''Output should have the expected length with any chunk size'''
+        sound = sine16(3001)
+        outputs = {}
+        for engine in self.engines():
+            outputs[engine] = []
+            for inrate, outrate in ((44100, 22000), (8000, 22000), \
+                                    (22000, 22000)):
+                whole = ssc.resample.resample(sound, 2, inrate, outrate)
+                self.assertEqual(len(whole) // 2, \
+                                 -(-3001 * outrate // inrate))
+                resampler = ssc.resample.Resampler(2, inrate, outrate)
+                chunks = b''
+                for i in range(0, len(sound), 334):
+                    chunks += resampler.feed(sound[i:i + 334])
+                    # Continues in a new resampler
+                    resampler = ssc.resample.Resampler(2, inrate, outrate, \
+                                                    state=resampler.state)
+                chunks += resampler.flush()
+                self.assertEqual(chunks, whole)
+                outputs[engine].append(whole)
+        # Both engines give the same samples
+        if 'numpy' in outputs:
+            self.assertEqual(outputs['python'], outputs['numpy'])
+
+    def test_exact_sums(self):
+        '''Both engines should give the same samples of full scale sounds'''
+        import random
+        rnd = random.Random(5)
+        for width in (2, 4):
+            top = max_int(width)
+            # Random full scale values maximize the sums of the products
+            samples = [rnd.choice((top, -top - 1, top // 3)) \
+                       for i in range(3000)]
+            sound = b''.join(x.to_bytes(width, 'little', signed=True) \
+                             for x in samples)
+            for inrate, outrate in ((44100, 22000), (8000, 22000), \
+                                    (44100, 16000)):
+                outputs = [ssc.resample.resample(sound, width, inrate, \
+                                                 outrate) \
+                           for engine in self.engines()]
+                self.assertEqual(len(outputs[0]), \
+                                 -(-3000 * outrate // inrate) * width)
+                for output in outputs[1:]:
+                    self.assertEqual(output, outputs[0])
+
+    def test_filter(self):
+        '''Should keep the passband and remove the aliases'''
+        for engine in self.engines():
+            low = tone16(1000, 44100, 4410)
+            output = ssc.resample.resample(low, 2, 44100, 22000)
+            self.assertAlmostEqual(rms16(output[400:-400]) / rms16(low), 1, \
+                                   delta=0.01)
+
+            high = tone16(15000, 44100, 4410)
+            output = ssc.resample.resample(high, 2, 44100, 22000)
+            self.assertLess(rms16(output[400:-400]) / rms16(high), 0.01)
+
+    def test_fused_encoder(self):
+        '''lin2btc and lin2dm should be the same that resample and encode'''
+        sound = sine16(5000)
+        resampled = ssc.resample.resample(sound, 2, 44100, 22000)
+        for engine in self.engines():
+            bitstream, state = ssc.resample.lin2btc(sound, 2, 44100, 22000, \
+                                                    21, '1.7')
+            self.assertEqual((bitstream, state), \
+                             ssc.lin2btc(resampled, 2, 21, '1.7'))
+            encoder = ssc.DmEncoder(2)
+            self.assertEqual(ssc.resample.encode(sound, 2, 44100, 22000, \
+                                                 encoder, frames=777), \
+                             ssc.lin2dm(resampled, 2)[0])
+
+
+class IntelHexWriter(unittest.TestCase):
+
+    def hexfile(self, segments, record = 16, chunk = None):
+        '''Writes segments of (address, data) with a HexWriter'''
+        import io
+        f = io.StringIO()
+        end = max(address + len(data) for address, data in segments)
+        writer = ssc.ihex.HexWriter(f, end, record)
+        for address, data in segments:
+            step = chunk or len(data)
+            writer.write(data[:step], address)
+            for i in range(step, len(data), step):
+                writer.write(data[i:i + step])
+        writer.close()
+        return f.getvalue()
+
+    def test_records(self):
+        '''Should write data, extended address and end of file records'''
+        self.assertEqual(self.hexfile([(0x10, b'\x01\x02\x03')]), \
+                         ':03001000010203E7\n:00000001FF\n')
+        lines = self.hexfile([(0xFFFE, bytes(range(4)))]).split()
+        self.assertEqual(lines, [':020000040000FA', ':02FFFE00000100', \
+                                 ':020000040001F9', ':020000000203F9', \
+                                 ':00000001FF'])
+        self.assertRaises(Exception, ssc.ihex.HexWriter, None, None, 256)
+
+    @unittest.skipUnless(_INTELHEX, 'needs intelhex to compare')
+    def test_same_as_intelhex(self):
+        '''Output should be the same that the intelhex package'''
+        import io
+        data = bytes(range(256)) * 700
+        for segments in ([(0, data)], [(5, data[:999]), (1004, data[:77]), \
+                         (0x2FFF0, data)]):
+            ih = IntelHex()
+            for address, fragment in segments:
+                ih.frombytes(fragment, offset=address)
+            for record, chunk in ((16, None), (32, 7), (255, 1000)):
+                reference = io.StringIO()
+                ih.write_hex_file(reference, byte_count=record)
+                self.assertEqual(self.hexfile(segments, record, chunk), \
+                                 reference.getvalue())
+
+
+class Playback(unittest.TestCase):
+
+    def test_decode_frames(self):
+        '''Should decode by frames the same that the whole sound'''
+        bits, _ = ssc.lin2btc(sine16(5000), 2, 21)
+        reference, _ = ssc.btc2lin(bits, 2, 21)
+        for stream in (bits, bits.tobitorder('LSB'), list(bits)):
+            frames = list(ssc.playback.decode_frames( \
+                        stream, ssc.BtcDecoder(2, 21), 256))
+            self.assertEqual(b''.join(frames), reference)
+            self.assertEqual(len(frames[0]), 256 * 2)
+        self.assertRaises(Exception, lambda: list( \
+            ssc.playback.decode_frames(bits, ssc.BtcDecoder(2, 21), 100)))
+
+    def test_player(self):
+        '''Should write all frames to the sink, in order'''
+        import io
+        bits, _ = ssc.lin2dm(sine16(10000), 2, MAX_16 // 21)
+        reference, _ = ssc.dm2lin(bits, 2, MAX_16 // 21)
+        for frame, latency in ((1024, 0), (256, 0.1), (8, 1)):
+            f = io.BytesIO()
+            sink = ssc.playback.FileSink(f)
+            player = ssc.playback.Player(sink, 8000, 2, frame, latency)
+            self.assertGreaterEqual(player.slots, 2)
+            player.play_bitstream(bits, ssc.DmDecoder(2, MAX_16 // 21))
+            self.assertEqual(f.getvalue(), reference)
+            self.assertEqual(sink.frames, -(-len(reference) // (frame * 2)))
+            self.assertIsNotNone(player.first)
+
+        # Chunks of any size are split in frames
+        sink = ssc.playback.NullSink()
+        player = ssc.playback.Player(sink, 8000, 1, 100)
+        player.play([b'a' * 7, b'', b'b' * 250, b'c'])
+        self.assertEqual((sink.frames, sink.bytes), (3, 258))
+        player.play([])
+        self.assertEqual((sink.frames, sink.bytes), (0, 0))
+
+    def test_player_errors(self):
+        '''Should raise the errors of the decoder after close the sink'''
+        def chunks():
+            yield b'\0' * 4096
+            raise ValueError('bad sound')
+        sink = ssc.playback.NullSink()
+        player = ssc.playback.Player(sink, 8000, 2, 1024)
+        self.assertRaises(ValueError, player.play, chunks())
+        self.assertEqual(sink.bytes, 4096)
+
+    def test_player_sink_errors(self):
+        '''Should stop the decoder and raise the errors of the sink'''
+        import itertools
+        import threading
+
+        class FailingSink(ssc.playback.NullSink):
+            def write(self, fragment):
+                if self.frames == 2:
+                    raise IOError('device lost')
+                ssc.playback.NullSink.write(self, fragment)
+
+        sink = FailingSink()
+        player = ssc.playback.Player(sink, 8000, 2, 64, 0)
+        errors = []
+        def play():
+            try:    # Endless sound, so the ring is always full
+                player.play(itertools.repeat(b'\0' * 100))
+            except IOError as e:
+                errors.append(e)
+        thread = threading.Thread(target=play)
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(sink.frames, 2)
+
+
+class BotTalkLibrary(unittest.TestCase):
+
+    def setUp(self):
+        '''Writes a library with three sounds'''
+        import tempfile
+        self.sounds = []
+        for length in (1000, 64, 3003):
+            bits, _ = ssc.lin2btc(sine16(length), 2, 21)
+            data = ssc.pack(bits)
+            self.sounds.append(data + b'\0' * (-len(data) % 32))
+        fd, self.filename = tempfile.mkstemp(suffix='.btl')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(ssc.btl.header(len(data) for data in self.sounds))
+            f.write(b''.join(self.sounds))
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_read(self):
+        '''Should give each sound without copy'''
+        with ssc.btl.Library(self.filename) as lib:
+            self.assertEqual(len(lib), 3)
+            self.assertEqual(lib.index, [(1024, 4), (1152, 1), (1184, 12)])
+            self.assertEqual([bytes(sound) for sound in lib], self.sounds)
+            sound = lib[-1]
+            self.assertIsInstance(sound, memoryview)
+            self.assertEqual(sound, self.sounds[-1])
+            sound.release()
+            self.assertRaises(IndexError, lambda: lib[3])
+
+            reference, _ = ssc.btc2lin_packed(self.sounds[0], 2, 21)
+            self.assertEqual(lib.decode(0, ssc.BtcDecoder(2, 21)), reference)
+
+    def test_validation(self):
+        '''Should reject truncated libraries and bad headers'''
+        with open(self.filename, 'r+b') as f:
+            f.truncate(1024 + 32 * 16)
+        self.assertRaises(Exception, ssc.btl.Library, self.filename)
+        with ssc.btl.Library(self.filename, check=False) as lib:
+            self.assertEqual(len(lib), 3)
+
+        with open(self.filename, 'r+b') as f:
+            f.write(ssc.btl.header([64, 32]) + b'\0' * 96)
+            f.seek(4 * 5)
+            f.write(b'\0\0\0\x07')   # Pointer after the last sound
+        self.assertRaises(Exception, ssc.btl.Library, self.filename)
+
+        self.assertRaises(Exception, ssc.btl.header, [31])
+        self.assertRaises(Exception, ssc.btl.header, [32] * 257)
+
+
+class SeekableContainer(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.fragment = sine16(6000) + ssc.bench.corpus('speech', 4003, 2)
+        fd, self.filename = tempfile.mkstemp(suffix='.ssk')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def write(self, bits, decoder, block = 512):
+        with open(self.filename, 'wb') as f:
+            return ssc.seekable.write(f, bits, decoder, 22050, block)
+
+    def test_decode_range(self):
+        '''Ranges should be the same samples that a sequential decode'''
+        codecs = ( \
+            (ssc.lin2btc(self.fragment, 2, 21, '1.0')[0], \
+             lambda: ssc.BtcDecoder(2, 21, '1.0')),
+            (ssc.lin2btc(self.fragment, 2, 21, '1.7')[0], \
+             lambda: ssc.BtcDecoder(2, 21, '1.7')),
+            (ssc.lin2btc(self.fragment, 2, 21, '1.7', q=12)[0], \
+             lambda: ssc.BtcFixedDecoder(2, 21, '1.7', 12)),
+            (ssc.lin2dm(self.fragment, 2, None, 0.99)[0], \
+             lambda: ssc.DmDecoder(2, None, 0.99)),
+        )
+        ranges = ((0, 1), (0, 10003), (511, 2), (512, 512), (1000, 3000), \
+                  (9990, 100), (10003, 5), (4242, 0))
+        for bits, new_decoder in codecs:
+            reference = new_decoder().feed(bits)
+            size = self.write(bits, new_decoder())
+            self.assertEqual(size, os.path.getsize(self.filename))
+            with ssc.seekable.Container(self.filename) as container:
+                self.assertEqual(len(container), 10003)
+                self.assertEqual(container.blocks, 20)
+                self.assertEqual(container.rate, 22050)
+                for start, n in ranges:
+                    end = min(start + n, 10003)
+                    self.assertEqual(container.decode_range(start, n), \
+                                     reference[start * 2:end * 2])
+
+    def test_only_needed_blocks(self):
+        '''Should only read the keyframe and data of the needed blocks'''
+        bits, _ = ssc.lin2btc(self.fragment, 2, 21, '1.7')
+        self.write(bits, ssc.BtcDecoder(2, 21, '1.7'))
+        with ssc.seekable.Container(self.filename) as container:
+            reference = container.decode_range(5000, 1000)
+            data = container._data
+
+        # Garbage in all other blocks and keyframes
+        with open(self.filename, 'r+b') as f:
+            f.seek(ssc.seekable.HEADER_SIZE)
+            f.write(b'\xff' * ssc.seekable.KEYFRAME.size * 9)
+            f.seek(data)
+            f.write(b'\x55' * 64 * 9)
+            f.seek(data + 64 * 12)
+            f.write(b'\x55' * (len(bits) // 8 - 64 * 12))
+        with ssc.seekable.Container(self.filename) as container:
+            self.assertEqual(container.decode_range(5000, 1000), reference)
+
+    def test_validation(self):
+        '''Should reject bad arguments and files'''
+        bits, _ = ssc.lin2btc(self.fragment, 2, 21)
+        self.assertRaises(Exception, self.write, bits, ssc.BtcDecoder(2, 21), \
+                          100)
+        self.assertRaises(Exception, self.write, bits, None)
+        self.write(bits, ssc.BtcDecoder(2, 21))
+        with ssc.seekable.Container(self.filename) as container:
+            self.assertRaises(Exception, container.decode_range, -1, 10)
+            self.assertRaises(Exception, container.decode_range, 10004, 1)
+            self.assertRaises(IndexError, container.keyframe, 20)
+
+        with open(self.filename, 'r+b') as f:
+            f.truncate(ssc.seekable.HEADER_SIZE + 100)
+        self.assertRaises(Exception, ssc.seekable.Container, self.filename)
+        with open(self.filename, 'r+b') as f:
+            f.write(b'RIFF')
+        self.assertRaises(Exception, ssc.seekable.Container, self.filename)
+
+class ProgressReports(unittest.TestCase):
+
+    def setUp(self):
+        self.fragment = sine16(150000)
+        self.reports = []
+
+    def report(self, progress):
+        self.assertIsInstance(progress, ssc.progress.Progress)
+        self.reports.append((progress.stage, progress.done, progress.total))
+        self.assertGreaterEqual(progress.rate, 0)
+
+    def check_reports(self, stage, total):
+        self.assertEqual(self.reports, [(stage, min(total, n), total) \
+                         for n in range(65536, total + 65536, 65536)])
+        self.reports = []
+
+    def test_codecs(self):
+        '''Should report the progress and give the same output'''
+        for codec in ('1.0', '1.7'):
+            bits, state = ssc.lin2btc(self.fragment, 2, 21, codec)
+            self.assertEqual(ssc.lin2btc(self.fragment, 2, 21, codec, \
+                                         progress=self.report), (bits, state))
+            self.check_reports('encode', 150000)
+            samples, state = ssc.btc2lin(bits, 2, 21, codec)
+            self.assertEqual(ssc.btc2lin(bits, 2, 21, codec, \
+                                         progress=self.report), \
+                             (samples, state))
+            self.check_reports('decode', 150000)
+
+        bits, state = ssc.lin2dm(self.fragment, 2)
+        self.assertEqual(ssc.lin2dm(self.fragment, 2, progress=self.report), \
+                         (bits, state))
+        self.check_reports('encode', 150000)
+        samples, state = ssc.dm2lin(list(bits), 2)
+        self.assertEqual(ssc.dm2lin(iter(list(bits)), 2, \
+                                    progress=self.report), (samples, state))
+        self.check_reports('decode', 150000)
+
+    def test_workers(self):
+        '''Should report the progress of the parallel encoders and decoder'''
+        def check(stage, total):
+            self.assertGreater(len(self.reports), 1)
+            done = [report[1] for report in self.reports]
+            self.assertEqual(done, sorted(done))
+            self.assertEqual(self.reports[-1], (stage, total, total))
+            self.reports = []
+
+        bits, state = ssc.lin2btc(self.fragment, 2, 21, '1.7')
+        self.assertEqual(ssc.lin2btc(self.fragment, 2, 21, '1.7', workers=2, \
+                                     progress=self.report), (bits, state))
+        check('encode', 150000)
+        self.assertEqual(ssc.lin2btc(self.fragment, 2, 21, '1.7', workers=2, \
+                                     progress=self.report, q=16), \
+                         ssc.lin2btc(self.fragment, 2, 21, '1.7', q=16))
+        check('encode', 150000)
+        samples, _ = ssc.btc2lin(bits, 2, 21, '1.7', workers=2, \
+                                 progress=self.report)
+        self.assertEqual(len(samples), 150000 * 2)
+        check('decode', 150000)
+
+        bits, state = ssc.lin2dm(self.fragment, 2)
+        self.assertEqual(ssc.lin2dm(self.fragment, 2, workers=2, \
+                                    progress=self.report), (bits, state))
+        check('encode', 150000)
+
+        # Short sounds are encoded sequentially
+        self.assertEqual(ssc.lin2btc(self.fragment[:2000], 2, 21, workers=2, \
+                                     progress=self.report), \
+                         ssc.lin2btc(self.fragment[:2000], 2, 21))
+        self.check_reports('encode', 1000)
+
+    def test_resample(self):
+        '''Should report the progress of the input samples'''
+        fragment = self.fragment[:80000 * 2]
+        bits, state = ssc.resample.lin2btc(fragment, 2, 44100, 22050, 21)
+        self.assertEqual(ssc.resample.lin2btc(fragment, 2, 44100, 22050, 21, \
+                                              progress=self.report), \
+                         (bits, state))
+        self.check_reports('encode', 80000)
+
+
+    @unittest.skipUnless(os.path.exists(WAV2SSC), 'needs wav2ssc')
+    def test_wav2ssc_profile(self):
+        '''wav2ssc should write the time and counters of each stage'''
+        import csv
+        import json
+        import shutil
+        import subprocess
+        import tempfile
+        path = tempfile.mkdtemp()
+        try:
+            wav = os.path.normpath(os.path.join(os.path.dirname(WAV2SSC), \
+                                                '..', 'examples', 'hit.wav'))
+            env = dict(os.environ)
+            env['PYTHONPATH'] = os.path.dirname(os.path.abspath(__file__))
+            for name in ('profile.csv', 'profile.json'):
+                subprocess.check_call([sys.executable, WAV2SSC, wav, \
+                    '--no-cache', '-f', 'lib', '-o', \
+                    os.path.join(path, 'hit.btl'), \
+                    '--profile', os.path.join(path, name)], env=env, \
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            with open(os.path.join(path, 'profile.csv')) as f:
+                rows = list(csv.DictReader(f))
+            totals = dict((row['stage'], row) for row in rows \
+                          if row['sound'] == '')
+            self.assertEqual(sorted(totals), ['encode', 'normalize', 'pack', \
+                                              'read', 'resample', 'write'])
+            self.assertEqual(int(totals['read']['samples_in']), 16901)
+            self.assertEqual(int(totals['encode']['bits_out']), \
+                             int(totals['resample']['samples_out']))
+            self.assertEqual(int(totals['write']['bytes_written']), \
+                             os.path.getsize(os.path.join(path, 'hit.btl')))
+
+            with open(os.path.join(path, 'profile.json')) as f:
+                report = json.load(f)
+            self.assertIn('hit', report['sounds'])
+            self.assertGreater(report['total'], 0)
+        finally:
+            shutil.rmtree(path)
+
+
+
+@unittest.skipUnless(os.path.exists(WAV2SSC), 'needs wav2ssc')
+class Wav2ssc(unittest.TestCase):
+    '''Test the wav2ssc tool'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.wav2ssc = ssc.bench.load_wav2ssc(WAV2SSC)
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.path = tempfile.mkdtemp()
+        examples = os.path.join(os.path.dirname(WAV2SSC), '..', 'examples')
+        self.wavs = []
+        for name in ('hit.wav', 'robby.wav', 'r2d2.wav'):
+            self.wavs.append(os.path.join(self.path, name))
+            shutil.copy(os.path.join(examples, name), self.wavs[-1])
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.path)
+
+    def run_wav2ssc(self, output, wavs, *args):
+        '''Runs wav2ssc in a new interpreter and returns the output file'''
+        import subprocess
+        import tempfile
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.abspath(__file__))
+        env['XDG_CACHE_HOME'] = tempfile.mkdtemp(dir=self.path) # Empty cache
+        output = os.path.join(self.path, output)
+        subprocess.check_call([sys.executable, WAV2SSC] + list(wavs) + \
+                              ['-r', '8000', '-o', output] + list(args), \
+                              env=env, stdout=subprocess.DEVNULL, \
+                              stderr=subprocess.DEVNULL)
+        with open(output, 'rb') as f:
+            return f.read()
+
+    def test_jobs(self):
+        '''Should give the same output with a process pool'''
+        for codec in ('BTc1.7', 'DM'):
+            sequential = self.run_wav2ssc('seq.btl', self.wavs, '-f', 'lib', \
+                                          '-c', codec)
+            pool = self.run_wav2ssc('pool.btl', self.wavs, '-f', 'lib', '-c', \
+                                    codec, '-j', '2')
+            self.assertEqual(pool, sequential)
+
+    def test_cache_hits(self):
+        '''Should reuse the cached sounds only with the same parameters'''
+        cache = os.path.join(self.path, 'cache')
+        def run(soft):
+            '''Returns the output and the mtime of each cache entry'''
+            # Entries are touched when are read
+            for name in os.listdir(cache) if os.path.isdir(cache) else []:
+                os.utime(os.path.join(cache, name), (0, 0))
+            output = self.run_wav2ssc('lib.btl', self.wavs, '-f', 'lib', \
+                                      '-s', str(soft), '--cache-dir', cache)
+            return output, dict((name, os.path.getmtime( \
+                                 os.path.join(cache, name))) \
+                                for name in os.listdir(cache))
+
+        first, entries = run(21)
+        # Resampled PCM and bitstream of each sound
+        self.assertEqual(len(entries), 2 * len(self.wavs))
+        second, hits = run(21)
+        self.assertEqual(second, first)
+        self.assertEqual(sorted(hits), sorted(entries))
+        self.assertNotIn(0, hits.values())
+
+        # Other softness only reuses the resampled PCM
+        other, hits = run(16)
+        self.assertNotEqual(other, first)
+        self.assertEqual(len(hits), 3 * len(self.wavs))
+        self.assertEqual(list(hits.values()).count(0), len(self.wavs))
+        self.assertEqual(other, self.run_wav2ssc('nocache.btl', self.wavs, \
+                         '-f', 'lib', '-s', '16', '--no-cache'))
+
+    def test_incremental(self):
+        '''Updates of a library should give the same that a full rebuild'''
+        import shutil
+        hit, robby, r2d2 = self.wavs
+        def check(wavs, bias = '0'):
+            full = self.run_wav2ssc('full.btl', wavs, '-f', 'lib', \
+                                    '--no-cache', '-b', bias)
+            self.assertEqual(self.run_wav2ssc('lib.btl', wavs, '-f', 'lib', \
+                                              '--no-cache', '-i', '-b', \
+                                              bias), full)
+
+        check(self.wavs)
+        self.assertTrue(os.path.exists(os.path.join(self.path, \
+                                                    'lib.btl.manifest')))
+        shutil.copy(hit, robby)     # Modify
+        check(self.wavs)
+        check([r2d2, robby, hit])   # Reorder
+        check([r2d2, hit])          # Remove
+        check([robby, r2d2, hit])   # Add
+        # Padding bytes before the lib
+        check([robby, r2d2, hit], '100')
+        check([r2d2, hit], '100')
+        check([r2d2, hit], '64')
+        check([r2d2, hit])
+
+    def test_stream(self):
+        '''--stream should give the same output that write_to_file'''
+        for codec in ('BTc1.0', 'BTc1.7', 'DM'):
+            for output_format in ('lib', 'raw'):
+                whole = self.run_wav2ssc('whole.bin', self.wavs, '-f', \
+                                         output_format, '-c', codec, \
+                                         '--no-cache')
+                self.assertEqual(self.run_wav2ssc('stream.bin', self.wavs, \
+                                                  '-f', output_format, '-c', \
+                                                  codec, '--no-cache', \
+                                                  '--stream'), whole)
+            # With padding bytes before the data
+            whole = self.run_wav2ssc('whole.bin', self.wavs, '-f', 'lib', \
+                                     '-c', codec, '--no-cache', '-b', '100')
+            self.assertEqual(self.run_wav2ssc('stream.bin', self.wavs, '-f', \
+                                              'lib', '-c', codec, \
+                                              '--no-cache', '--stream', '-b', \
+                                              '100'), whole)
+
+    def test_layout(self):
+        '''lib and raw should be the 32 byte blocks of the sounds in order'''
+        import struct
+        lib = self.run_wav2ssc('lib.btl', self.wavs, '-f', 'lib', '--no-cache')
+        raw = self.run_wav2ssc('lib.raw', self.wavs, '-f', 'raw', '--no-cache')
+        sounds = [self.run_wav2ssc('sound.raw', [wav], '-f', 'raw', \
+                                   '--no-cache') for wav in self.wavs]
+
+        # Header of 256 big endian pointers to the end of each sound
+        self.assertEqual(raw, b''.join(sounds))
+        self.assertEqual(lib[1024:], raw)
+        ends = struct.unpack('>256I', lib[:1024])
+        self.assertEqual(ends[len(self.wavs):], (0,) * (256 - len(self.wavs)))
+        end = 0
+        for sound, pointer in zip(sounds, ends):
+            self.assertGreater(len(sound), 0)
+            self.assertEqual(len(sound) % 32, 0)
+            end += len(sound)
+            self.assertEqual(pointer * 32, end)
+
+        # Bias inserts padding bytes before the data
+        for output_format, data in (('lib', lib), ('raw', raw)):
+            self.assertEqual(self.run_wav2ssc('bias.bin', self.wavs, '-f', \
+                                              output_format, '-b', '100', \
+                                              '--no-cache'), \
+                             b'\0' * 100 + data)
+
+    def test_batch_groups(self):
+        '''Only groups of many sounds of similar length are batched'''
+        groups = self.wav2ssc.batch_groups
+        self.assertEqual(groups([200000, 3000, 5000]), [])
+        self.assertEqual(groups([5000] * 10), [])
+        self.assertEqual(groups([5000] * 30), [list(range(30))])
+        lengths = [200000] + [5000 - i for i in range(30)] + [3000, 100]
+        self.assertEqual(groups(lengths), [list(range(1, 31))])
+        self.assertEqual(groups([5000] * 600), \
+                         [list(range(256)), list(range(256, 512)), \
+                          list(range(512, 600))])
+        self.assertEqual(groups([]), [])
+
+    def test_c_array(self):
+        '''Should write a C array of each sound, named as the WAV file'''
+        import contextlib
+        import io
+        import re
+        import shutil
+        import tempfile
+        wav2ssc = self.wav2ssc
+        self.assertEqual(wav2ssc.sound_name('./sub/hit.wav'), 'hit')
+        self.assertEqual(wav2ssc.c_name('3-hit'), '_3_hit')
+
+        path = tempfile.mkdtemp()
+        try:
+            hit = os.path.join(os.path.dirname(WAV2SSC), '..', 'examples', \
+                               'hit.wav')
+            sub = os.path.join(path, 'sub')
+            os.mkdir(sub)
+            shutil.copy(hit, os.path.join(sub, 'hit.wav'))
+            shutil.copy(hit, os.path.join(sub, '2.wav'))
+
+            lib = wav2ssc.SoundsLib(8000)
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertTrue(lib.add_wav_sound(os.path.join(path, '.', \
+                                                               'sub', 'hit.wav')))
+                self.assertTrue(lib.add_wav_sound(os.path.join(sub, '2.wav')))
+                self.assertFalse(lib.add_wav_sound(os.path.join(sub, \
+                                                                'hit.wav')))
+                self.assertRaises(Exception, lib.add_wav_sound, hit)
+                lib.process()
+                lib.write_to_file(os.path.join(path, 'lib.c'), 'c')
+                lib.write_to_file(os.path.join(path, 'lib.raw'), 'raw')
+
+            with open(os.path.join(path, 'lib.c')) as f:
+                text = f.read()
+            with open(os.path.join(path, 'lib.raw'), 'rb') as f:
+                raw = f.read()
+            self.assertTrue(text.startswith('#include <stdlib.h>\n'))
+            arrays = re.findall(r'const size_t (\w+)_len = (\d+); ' \
+                                r'/\* Num. of Bytes \*/\n' \
+                                r'const unsigned char (\w+)_data\[(\d+)\] ' \
+                                r'= \{\n(.*?)\};\n', text, re.S)
+            self.assertEqual([(name, data) for name, _, data, _, _ in arrays], \
+                             [('hit', 'hit'), ('_2', '_2')])
+            image = b''
+            for name, length, _, size, body in arrays:
+                self.assertEqual(length, size)
+                rows = [row for row in body.split('\n') if row]
+                values = []
+                for i, row in enumerate(rows):
+                    if row.startswith('/*'):    # A separator each 32 bytes
+                        self.assertEqual(row, (wav2ssc.C_SEPARATOR % \
+                                               len(values)).strip())
+                        self.assertEqual(len(values) % 32, 0)
+                        continue
+                    self.assertTrue(re.match(r'^(0x[0-9A-F]{2}, ){1,8}$', \
+                                             row + ' '))
+                    values += [int(x, 16) for x in row.split(',') if x.strip()]
+                self.assertEqual(len(values), int(length))
+                self.assertEqual(int(length) % 32, 0)
+                image += bytes(values)
+            self.assertEqual(image, raw)
+        finally:
+            shutil.rmtree(path)
+
+    def test_cache(self):
+        '''The cache should keep its size when overwrites and evict old data'''
+        import shutil
+        import tempfile
+        path = tempfile.mkdtemp()
+        try:
+            cache = self.wav2ssc.EncodeCache(path, 1000)
+            size = lambda: sum(os.path.getsize(os.path.join(path, name)) \
+                               for name in os.listdir(path))
+            key = cache.key('hit', 8000)
+            self.assertIsNone(cache.get(key))
+            cache.put(key, b'a' * 300)
+            self.assertEqual(cache.get(key), b'a' * 300)
+            for i in range(10):     # Overwrites don't grow the cache
+                cache.put(key, b'b' * 400)
+            self.assertEqual(cache.get(key), b'b' * 400)
+            cache.put(cache.key('hit', 11025), b'c' * 400)
+            self.assertEqual(size(), 800)
+            self.assertEqual(len(os.listdir(path)), 2)
+
+            # The least recently used entry is evicted
+            os.utime(os.path.join(path, key), (0, 0))
+            cache.put(cache.key('hit', 22050), b'd' * 400)
+            self.assertIsNone(cache.get(key))
+            self.assertEqual(cache.get(cache.key('hit', 22050)), b'd' * 400)
+            self.assertLessEqual(size(), 900)
+        finally:
+            shutil.rmtree(path)
+
+    def test_cache_code_version(self):
+        '''The cache keys should change with the codec code'''
+        wav2ssc = self.wav2ssc
+        version = wav2ssc.code_version()
+        self.assertTrue(version.startswith(wav2ssc.CACHE_VERSION + '/'))
+        self.assertIn(ssc.__version__, version)
+        key = wav2ssc.EncodeCache.key('hit', 8000)
+        try:
+            wav2ssc._CODE_VERSION = version + '-changed'
+            self.assertNotEqual(wav2ssc.EncodeCache.key('hit', 8000), key)
+        finally:
+            wav2ssc._CODE_VERSION = version
+        self.assertEqual(wav2ssc.EncodeCache.key('hit', 8000), key)
+
+class Benchmarks(unittest.TestCase):
+
+    def test_corpora(self):
+        '''Should generate the same sound for the same seed'''
+        for name in ssc.bench.CORPORA:
+            for width in (1, 2, 4):
+                data = ssc.bench.corpus(name, 3000, width)
+                self.assertEqual(len(data), 3000 * width)
+                self.assertEqual(data, ssc.bench.corpus(name, 3000, width))
+        self.assertEqual(ssc.bench.corpus('silence', 100, 2), b'\0' * 200)
+        self.assertNotEqual(ssc.bench.corpus('noise', 100, 2), \
+                            ssc.bench.corpus('noise', 100, 2, seed=1))
+
+    def test_codecs(self):
+        '''Should measure all operations'''
+        results = ssc.bench.codecs(500, (1,), ['speech'], repeat=1)
+        self.assertEqual([row['operation'] for row in results], \
+                         ['lin2btc1.0', 'lin2btc1.7', 'lin2btc1.0q', \
+                          'lin2btc1.7q', 'lin2dm', 'btc2lin1.0', 'btc2lin1.7', \
+                          'btc2lin1.0q', 'btc2lin1.7q', 'dm2lin', 'pack', \
+                          'pack_lsb'])
+        for row in results:
+            self.assertEqual((row['corpus'], row['width'], row['samples']), \
+                             ('speech', 1, 500))
+            self.assertGreater(row['rate'], 0)
+            self.assertGreaterEqual(row['peak'], 0)
+
+    def test_compare(self):
+        '''Should flag the slower operations and the memory increases'''
+        def report(rate, peak):
+            row = {'operation' : 'pack', 'corpus' : 'sine', 'width' : 2, \
+                   'samples' : 100, 'seconds' : 100 / rate, 'rate' : rate, \
+                   'peak' : peak}
+            return ssc.bench.report([row], 100, 1)
+        baseline = report(1000, 100)
+        flags = lambda current: \
+            [row[3] for row in ssc.bench.compare(current, baseline, 0.1)]
+        self.assertEqual(flags(report(950, 105)), [[]])
+        self.assertEqual(flags(report(800, 100)), [['slower']])
+        self.assertEqual(flags(report(2000, 200)), [['memory']])
+        self.assertEqual(ssc.bench.compare(report(1, 1), {'results' : {}}), [])
+
+    def test_main(self):
+        '''Should save the results and compare them with a baseline'''
+        import io
+        import json
+        import tempfile
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        args = ['-s', '0.01', '-r', '1', '-w', '2', '--corpus', 'chirp', \
+                '--no-writers']
+        try:
+            stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            try:
+                self.assertEqual(ssc.bench.main(args + ['-o', filename]), 0)
+                self.assertEqual(ssc.bench.main(args + ['-c', filename, \
+                                                        '-t', '100']), 0)
+            finally:
+                sys.stdout = stdout
+            with open(filename) as f:
+                saved = json.load(f)
+            self.assertEqual(len(saved['results']), 12)
+            self.assertIn('lin2dm/chirp/2', saved['results'])
+
+            # A baseline 10 times faster
+            for row in saved['results'].values():
+                row['rate'] *= 10
+            with open(filename, 'w') as f:
+                json.dump(saved, f)
+            sys.stdout = io.StringIO()
+            try:
+                self.assertEqual(ssc.bench.main(args + ['-c', filename]), 1)
+            finally:
+                sys.stdout = stdout
+        finally:
+            os.remove(filename)
+
+    @unittest.skipUnless(ssc.aux._NUMPY, 'needs NumPy')
+    def test_batch(self):
+        '''Should measure the batch and sequential encoders'''
+        results = ssc.bench.batch((2, 3), 100, repeat=1)
+        self.assertEqual([(row['codec'], row['sounds']) for row in results], \
+                         [('BTc1.0', 2), ('DM', 2), ('BTc1.0', 3), ('DM', 3)])
+        for row in results:
+            self.assertGreater(row['batch'], 0)
+            self.assertGreater(row['sequential'], 0)
+
+    @unittest.skipUnless(os.path.exists(WAV2SSC), 'needs wav2ssc')
+    def test_writers(self):
+        '''Should measure the output formats of wav2ssc'''
+        wav2ssc = ssc.bench.load_wav2ssc(WAV2SSC)
+        results = ssc.bench.writers(200, wav2ssc, ('lib', 'c'), \
+                                    ['sine', 'silence'], repeat=1)
+        self.assertEqual([(row['operation'], row['samples']) \
+                          for row in results], \
+                         [('write_lib', 400), ('write_c', 400)])
+
+class LazyStartup(unittest.TestCase):
+
+    # Prints the loaded modules after run the code
+    LOADED = "\nimport sys\nprint(' '.join(sorted(m for m in sys.modules " \
+             "if m.startswith(('numpy.', 'pyaudio')))))"
+
+    def loaded(self, code):
+        '''Runs code in a new interpreter and returns the loaded modules'''
+        import subprocess
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.check_output([sys.executable, '-c', \
+                                          code + self.LOADED], env=env)
+        return output.decode('ascii').splitlines()[-1].split()
+
+    def test_import(self):
+        '''Should not load NumPy when ssc is imported'''
+        self.assertEqual(self.loaded('import ssc, ssc.aux, ssc.btl, '
+                                     'ssc.ihex, ssc.pcm, ssc.playback, '
+                                     'ssc.resample'), [])
+        if _BATCH:
+            self.assertEqual(self.loaded('import ssc.batch'), [])
+
+    def test_encode(self):
+        '''Should not load NumPy to encode and decode bytes'''
+        self.assertEqual(self.loaded('import ssc\n'
+                                     'bits, _ = ssc.lin2btc(b"\\1\\2" * 64, 2, 21)\n'
+                                     'ssc.btc2lin(bits, 2, 21)\n'
+                                     'ssc.lin2btc(b"\\1\\2" * 64, 2, 21, q=16)\n'
+                                     'ssc.lin2dm(b"\\0" * 128, 2, 1000)'), [])
+
+    def test_startup_time(self):
+        '''Should import ssc and encode a short sound faster that NumPy is
+        imported'''
+        import subprocess
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.abspath(__file__))
+        def measure(code):
+            # Best of some runs in new interpreters
+            code = 'from time import perf_counter\n' \
+                   't = perf_counter()\n' + code + \
+                   '\nprint(perf_counter() - t)'
+            return min(float(subprocess.check_output( \
+                               [sys.executable, '-c', code], env=env)) \
+                       for i in range(3))
+
+        startup = measure('import ssc\n'
+                          'ssc.lin2btc(b"\\1\\2" * 64, 2, 21)')
+        if ssc.aux._NUMPY:
+            self.assertLess(startup, measure('import numpy'))
+        self.assertLess(startup, 0.5)
+
+    @unittest.skipUnless(os.path.exists(WAV2SSC), 'needs wav2ssc')
+    def test_wav2ssc_version(self):
+        '''Should not load NumPy or pyaudio to show the version'''
+        code = 'import runpy, sys\n' \
+               'sys.argv = ["wav2ssc", "--version"]\n' \
+               'try:\n' \
+               '    runpy.run_path(%r, run_name="__main__")\n' \
+               'except SystemExit:\n' \
+               '    pass' % WAV2SSC
+        self.assertEqual(self.loaded(code), [])
+
+
 # MAIN
 if __name__ == '__main__':
     unittest.main()
@@ -11,37 +11,292 @@ from __future__ import division
 VERSION = '1.0a1'
 
 import ssc
-from ssc.aux import max_int
+import ssc.btl
+import ssc.ihex
+import ssc.pcm
+import ssc.playback
+import ssc.resample
+from ssc.aux import max_int, _lazy_import
 
-import array
 import sys
 import time
+import contextlib
+import csv
+import os
 import os.path
+import hashlib
+import struct
+import json
+import re
 import wave
-import audioop
-
-from intelhex import IntelHex
 
 CHUNK = 1024        # How many samples send to player
+LATENCY = 0.1       # Seconds of sound decoded before it's played
+STREAM_FRAMES = 65536   # How many frames read in each step in streaming mode
 
 COLUMN = 8          # Prety print of values
+C_CHUNK = 65536     # Bytes formated at same time in C arrays
+C_SEPARATOR = '/*---------------- %8d ----------------*/\n'
+C_BYTE = ['0x%02X, ' % byte for byte in range(256)]  # C literal of each byte
 PAD_FILL = b'\x00'  # Padding fill of 32 byte blocks
+MANIFEST_EXT = '.manifest'  # Extension of BotTalk Library manifest
+
+HEADER_SIZE = ssc.btl.HEADER_SIZE  # Size of BotTalk Library header
 
 BITS = 2
 MAX = max_int(BITS)
 
-# Try to grab pyaudio
+# Encode cache. Entries of other versions are never used
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', \
+                         os.path.expanduser('~/.cache')), 'wav2ssc')
+CACHE_SIZE = 512 * 2 ** 20  # Max. size in bytes of the cache
+
+# Sounds are encoded with ssc.batch only in groups of similar length (the
+# shortest one has at least BATCH_RATIO of the longest one) were the total
+# length is at least BATCH_GAIN times the longest one. Each batch step costs
+# like ~14 sequential samples (see python -m ssc.bench batch)
+BATCH_RATIO = 0.75
+BATCH_GAIN = 24
+BATCH_SIZE = 256    # Max. sounds in a batch. Limits the stacked array
+CACHE_VERSION = VERSION + '/' + ssc.__version__
+
+# Try to grab pyaudio. It's loaded when the first sound is played, and
+# PyAudio (that probes all the audio devices) is created then
 try:
-    import pyaudio
+    pyaudio = _lazy_import('pyaudio')
     _AUDIO = True
 except ImportError:
     _AUDIO = False
 
+# Try to grab batch encoders (needs NumPy)
+try:
+    import ssc.batch
+    _BATCH = True
+except ImportError:
+    _BATCH = False
+
+# Try to grab NumPy. It's loaded when it's used the first time
+try:
+    numpy = _lazy_import('numpy')
+    _NUMPY = True
+except ImportError:
+    _NUMPY = False
+
+
+ALL_SOUNDS = '*'    # Profile entries of work done for all sounds at same time
+
+
+class Profile(object):
+    """ Timers and counters of the stages of a run, by sound
+
+    Each stage of a sound (read, normalize, resample, encode, pack, write...)
+    keeps the seconds spent in it, how many times was run and his counters,
+    like samples_in, bits_out or bytes_written. Work done for all sounds at
+    same time, like encoding in a batch, is kept in the ALL_SOUNDS sound.
+    """
+
+    def __init__(self):
+        self.stages = {}          # (sound, stage) : dict of seconds, calls...
+        self.start = time.perf_counter()
+
+    def __entry(self, sound, stage):
+        """ Returns the dict of a stage of a sound, created if don't exists """
+        key = (sound, stage)
+        if key not in self.stages:
+            self.stages[key] = {'seconds': 0.0, 'calls': 0}
+        return self.stages[key]
+
+    @contextlib.contextmanager
+    def stage(self, stage, sound=ALL_SOUNDS):
+        """ Context manager that adds his time to a stage of a sound """
+        entry = self.__entry(sound, stage)
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry['seconds'] += time.perf_counter() - start
+            entry['calls'] += 1
+
+    def count(self, stage, counter, value, sound=ALL_SOUNDS):
+        """ Adds value to a counter of a stage of a sound """
+        entry = self.__entry(sound, stage)
+        entry[counter] = entry.get(counter, 0) + value
+
+    def totals(self):
+        """ Returns a dict with the sum of each stage over all sounds """
+        totals = {}
+        for (sound, stage), entry in self.stages.items():
+            total = totals.setdefault(stage, {})
+            for key, value in entry.items():
+                total[key] = total.get(key, 0) + value
+        return totals
+
+    def report(self):
+        """ Returns a JSON serializable dict with the per sound and per
+        stage breakdown
+        """
+        sounds = {}
+        for (sound, stage), entry in self.stages.items():
+            sounds.setdefault(sound, {})[stage] = dict(entry)
+        return {'total': time.perf_counter() - self.start, \
+                'stages': self.totals(), 'sounds': sounds}
+
+    def write(self, filename):
+        """ Writes the breakdown to a CSV file if filename ends with .csv,
+        else to a JSON file. CSV rows of sound '' are the totals by stage
+        """
+        if filename.lower().endswith('.csv'):
+            counters = sorted(set(key for entry in self.stages.values() \
+                                  for key in entry) - set(('seconds', 'calls')))
+            rows = [(sound, stage, entry) for (sound, stage), entry \
+                    in self.stages.items()]
+            rows += [('', stage, entry) for stage, entry \
+                     in self.totals().items()]
+            with open(filename, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['sound', 'stage', 'seconds', 'calls'] + \
+                                counters)
+                for sound, stage, entry in rows:
+                    writer.writerow([sound, stage, '%.6f' % entry['seconds'], \
+                                     entry['calls']] + \
+                                    [entry.get(key, '') for key in counters])
+        else:
+            with open(filename, 'w') as f:
+                json.dump(self.report(), f, indent=1)
+
+
+class EncodeCache(object):
+    """ Content addressed on disk cache of resampled PCM and bitstreams
+
+    Each entry is a file named with a hash of the source data and all the
+    parameters that affects the output. The files are touched when are read,
+    so when the cache grows over his maximum size, the least recently used
+    entries are removed first.
+    """
+
+    def __init__(self, path=None, max_size=CACHE_SIZE):
+        """
+        Opens (or creates) a cache directory
+
+        Keyword Arguments:
+            path -- Cache directory (Default CACHE_DIR)
+            max_size -- Maximum size in bytes (Default CACHE_SIZE)
+        """
+        self.path = path or CACHE_DIR
+        self.max_size = max_size
+        self.__size = None        # Total size, calculated when needed
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    @staticmethod
+    def key(*parts):
+        """ Returns the key of a entry from his source digest and parameters """
+        digest = hashlib.sha256(code_version().encode('utf-8'))
+        for part in parts:
+            digest.update(b'\0' + repr(part).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """ Returns the data of a entry, or None if it isn't in the cache """
+        filename = os.path.join(self.path, key)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            os.utime(filename, None)  # Most recently used
+        except (IOError, OSError):
+            return None
+        return data
+
+    def put(self, key, data):
+        """ Stores a entry and evicts old entries if the cache is full """
+        filename = os.path.join(self.path, key)
+        try:
+            old_size = os.path.getsize(filename)    # Overwrites a entry
+        except OSError:
+            old_size = 0
+        tmpname = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmpname, 'wb') as f:
+            f.write(data)
+        os.replace(tmpname, filename)
+
+        if self.__size is None:
+            self.__size = sum(size for _, size, _ in self.__entries())
+        else:
+            self.__size += len(data) - old_size
+        if self.__size > self.max_size:
+            self.__evict()
+
+    def __entries(self):
+        """ Returns a list of (mtime, size, filename) of all entries """
+        entries = []
+        for name in os.listdir(self.path):
+            filename = os.path.join(self.path, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, filename))
+        return entries
+
+    def __evict(self):
+        """ Removes the least recently used entries until fill the 90% """
+        entries = sorted(self.__entries())
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, filename in entries:
+            if size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(filename)
+                size -= entry_size
+            except OSError:
+                pass
+        self.__size = size
+
+
+_CODE_VERSION = None
+
+def code_version():
+    """ Returns CACHE_VERSION with a hash of the source code of ssc and
+    wav2ssc, so any change of the code invalidates the cached entries
+    """
+    global _CODE_VERSION
+    if _CODE_VERSION is None:
+        digest = hashlib.sha256()
+        path = os.path.dirname(os.path.abspath(ssc.__file__))
+        sources = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                   if name.endswith('.py')]
+        for filename in sources + [os.path.abspath(__file__)]:
+            try:
+                with open(filename, 'rb') as f:
+                    digest.update(f.read())
+            except (IOError, OSError):
+                digest.update(filename.encode('utf-8'))
+        _CODE_VERSION = '%s/%s' % (CACHE_VERSION, digest.hexdigest()[:16])
+    return _CODE_VERSION
+
+
+def sound_name(filename):
+    """ Returns the name of a sound from his WAV file name, without the
+    directory and the extension. './sub/hit.wav' is 'hit'
+    """
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def file_digest(filename):
+    """ Returns the SHA-256 hex digest of a file contents """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 
 class SoundsLib(object):
     """ Creates a sound lib of BTc encode sounds """
 
-    def __init__(self, bitrate =22000, soft=21, delta=MAX//21 , codec='BTc1.0'):
+    def __init__(self, bitrate =22000, soft=21, delta=MAX//21 , codec='BTc1.0', \
+                 cache=None, profile=None):
         """
         Initiate a BTc SoundLib
 
@@ -49,6 +304,10 @@ class SoundsLib(object):
             bitrate -- Desired bitrate (Default 22000Hz)
             soft -- Desired softness constant (Default 21)
             codec -- Desired BTc codec (Default 'BTc1.0')
+            cache -- EncodeCache to reuse the resampled and encoded sounds
+                     of previous runs (Default None)
+            profile -- Profile were add the time of each stage (Default
+                       None, a new Profile)
         """
         
         self.__btc_codec  = codec     # Sound codec
@@ -56,48 +315,70 @@ class SoundsLib(object):
         self.__soft       = soft      # Desired softness constant
         self.__delta      = delta     # Desired delta constant
         self.sounds     = {}
-        # Dict 'filename' : {inputwave, resultwave, bitstream, info}
+        # Dict 'filename' : {inputwave, bitstream, info, key}
         self.__snames     = []        # Sound names in insertion order
+        self.__cache      = cache     # Encode cache
+        self.profile      = profile if profile is not None else Profile()
 
         rval, cval = ssc.calc_rc(self.__bitrate, soft) 
         self.__info = "\tUsing %s at BitRate %d\n" % (codec, bitrate)
         if 'BTc' in codec:
             self.__info += "\tC = %.3f uF\tR = %.1f Ohm\n" % (cval / 10 ** -6, rval)
-        if _AUDIO:
-            self.paudio = pyaudio.PyAudio()
+        self.paudio       = None      # PyAudio, created when is used
 
     def __del__(self):
-        if _AUDIO and self.paudio:
+        if self.paudio is not None:
             self.paudio.terminate()
 
     def add_wav_sound(self, name):
         """ Adds a WAV file to the sound library """
 
-        if not name in self.sounds:
+        sound = sound_name(name)
+        if sound in self.sounds:
+            if os.path.normpath(self.sounds[sound]['file']) != \
+                    os.path.normpath(name):
+                raise Exception('Duplicated sound name %s' % sound, sound)
+            return False
+        else:
             if not os.path.exists(name):
                 raise IOError ("File %s don't exists" % name)
             
-            if self.__btc_codec == 'DM':
-                normalize = 0.85
+            normalize = self.__normalize()
+            profile = self.profile
+
+            key = cached = None
+            if self.__cache is not None:
+                with profile.stage('cache', sound):
+                    key = self.__pcm_key(file_digest(name))
+                    cached = self.__cache.get(key)
+
+            if cached is not None:
+                # Info without the first line with the file name
+                info, samples = cached.split(b'\0', 1)
+                info = "\tWAV file: " + name + "\n" + info.decode('utf-8')
+                profile.count('cache', 'hits', 1, sound)
             else:
-                normalize = 0.5
-
-            sr, samples, info = read_wav(name, normalize)
-
-            # Resample to lib bitrate
-            if sr != self.__bitrate:
-                samples, _ = audioop.ratecv(samples, BITS, 1, sr, \
-                                                self.__bitrate, None)
-
-            name = name.split('.')[0]
-
-            self.sounds[name] = {'inputwave': samples, 'resultwave': None, \
-                                    'bitstream': None, 'info': info}
-            self.__snames.append(name)
+                sr, samples, info = read_wav(name, normalize, profile, sound)
+
+                # Resample to lib bitrate
+                if sr != self.__bitrate:
+                    with profile.stage('resample', sound):
+                        samples = ssc.resample.resample(samples, BITS, sr, \
+                                                        self.__bitrate)
+                    profile.count('resample', 'samples_out', \
+                                  len(samples) // BITS, sound)
+
+                if key is not None:
+                    with profile.stage('cache', sound):
+                        self.__cache.put(key, \
+                            info.split('\n', 1)[1].encode('utf-8') + b'\0' + \
+                            samples)
+
+            self.sounds[sound] = {'inputwave': samples, 'bitstream': None, \
+                                  'info': info, 'key': key, 'file': name}
+            self.__snames.append(sound)
 
             return True
-        else:
-            return False
 
     
     def __delitem__(self, index):
@@ -108,53 +389,190 @@ class SoundsLib(object):
 
 
 
-    def process(self):
-        """ Process all sound with the desired codec and softness """
+    def process(self, jobs=1):
+        """ Process all sound with the desired codec and softness
+
+        Keyword Arguments:
+            jobs -- Number of worker processes. If it's greater than 1, the
+                    sounds are encoded in a process pool (Default 1)
+        """
         from math import ceil
 
-        for name in self.sounds.keys():
-            if self.sounds[name]['resultwave'] is None:
-                if 'BTc' in self.__btc_codec:
-                    if self.__btc_codec == 'BTc1.7':
-                        codec = '1.7'
+        names = [name for name in self.__snames \
+                        if self.sounds[name]['bitstream'] is None]
+
+        profile = self.profile
+        results = {}
+        if self.__cache is not None:
+            for name in names:
+                with profile.stage('cache', name):
+                    data = self.__cache.get(self.__bits_key(name))
+                if data is not None:
+                    nbits, = struct.unpack('>Q', data[:8])
+                    results[name] = ssc.BitStream(data[8:], nbits)
+                    profile.count('cache', 'hits', 1, name)
+            names = [name for name in names if name not in results]
+
+        encoded = {}
+        if jobs > 1 and len(names) > 1:
+            # All sounds are encoded at same time
+            with profile.stage('encode'):
+                bitstreams = self.__process_pool(names, jobs)
+            profile.count('encode', 'bits_out', \
+                          sum(len(bits) for bits in bitstreams))
+            encoded.update(zip(names, bitstreams))
+        elif _BATCH:
+            lengths = [len(self.sounds[name]['inputwave']) for name in names]
+            for group in batch_groups(lengths):
+                group = [names[i] for i in group]
+                waves = [self.sounds[name]['inputwave'] for name in group]
+                with profile.stage('encode'):
+                    if 'BTc' in self.__btc_codec:
+                        bitstreams, _ = ssc.batch.lin2btc_many(waves, BITS, \
+                                            self.__soft, self.__version())
                     else:
-                        codec = '1.0'
-                    tmp, _ = ssc.lin2btc(self.sounds[name]['inputwave'], BITS, \
-                                  self.__soft, codec)
-                else:
-                    tmp, _ = ssc.lin2dm(self.sounds[name]['inputwave'], BITS, \
-                                  self.__delta)
-
+                        bitstreams, _ = ssc.batch.lin2dm_many(waves, BITS, \
+                                            self.__delta)
+                profile.count('encode', 'bits_out', \
+                              sum(len(bits) for bits in bitstreams))
+                encoded.update(zip(group, bitstreams))
+
+        for name in names:
+            if name in encoded:
+                continue
+            with profile.stage('encode', name):
+                encoded[name] = encode_sound(self.sounds[name]['inputwave'], \
+                                    self.__btc_codec, self.__soft, self.__delta)
+            profile.count('encode', 'bits_out', len(encoded[name]), name)
+
+        for name in names:
+            tmp = encoded[name]
+            results[name] = tmp
+            if self.__cache is not None:
+                with profile.stage('cache', name):
+                    self.__cache.put(self.__bits_key(name), \
+                                     struct.pack('>Q', len(tmp)) + ssc.pack(tmp))
+
+        for name in self.__snames:
+            if name in results:
+                tmp = results[name]
                 self.sounds[name]['bitstream'] = tmp
                 self.sounds[name]['info'] += "\tSize: %d (bytes)\n" % \
                         ceil(len(tmp)/8.0)
 
+    def __normalize(self):
+        """ Returns the normalize factor of the sounds """
+        if self.__btc_codec == 'DM':
+            return 0.85
+        return 0.5
+
+    def __pcm_key(self, digest):
+        """ Returns the cache key of the resampled sound of a WAV digest """
+        return EncodeCache.key(digest, self.__bitrate, self.__normalize(), \
+                               BITS, 'polyphase', ssc.resample.ZEROS)
+
+    def __bits_key(self, name):
+        """ Returns the cache key of the encoded sound """
+        return EncodeCache.key(self.sounds[name]['key'], self.__btc_codec, \
+                               self.__soft, self.__delta)
+
+    def sound_key(self, digest):
+        """ Returns a key that changes if the encoded sound of a WAV file
+        changes. digest is the SHA-256 digest of the WAV file
+        """
+        return EncodeCache.key(self.__pcm_key(digest), self.__btc_codec, \
+                               self.__soft, self.__delta)
+
+    def __version(self):
+        """ Returns the BTc version of the codec """
+        if self.__btc_codec == 'BTc1.7':
+            return '1.7'
+        return '1.0'
+
+    def __process_pool(self, names, jobs):
+        """ Encodes the sounds in a pool of processes
 
-    def play_original(self, name):
+        PCM input and packed output are shared with the workers in two
+        shared memory blocks, so only offsets and sizes are pickled. The
+        longest sounds are submited first. Returns a list of BitStreams.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import shared_memory
+
+        waves = [self.sounds[name]['inputwave'] for name in names]
+        # Offsets of each sound in the input and output blocks
+        inputs = [0]
+        outputs = [0]
+        for samples in waves:
+            inputs.append(inputs[-1] + len(samples))
+            outputs.append(outputs[-1] + (len(samples) // BITS + 7) // 8)
+
+        shm_in = shared_memory.SharedMemory(create=True, \
+                                            size=max(1, inputs[-1]))
+        shm_out = shared_memory.SharedMemory(create=True, \
+                                             size=max(1, outputs[-1]))
+        try:
+            for i, samples in enumerate(waves):
+                shm_in.buf[inputs[i]:inputs[i + 1]] = samples
+
+            # Longest job first
+            order = sorted(range(len(waves)), key=lambda i: -len(waves[i]))
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = {}
+                for i in order:
+                    futures[i] = executor.submit(encode_shared, \
+                                    shm_in.name, inputs[i], inputs[i + 1], \
+                                    shm_out.name, outputs[i], \
+                                    self.__btc_codec, self.__soft, self.__delta)
+
+                bitstreams = []
+                for i in range(len(waves)):
+                    nbits = futures[i].result()
+                    data = bytes(shm_out.buf[outputs[i]:outputs[i + 1]])
+                    bitstreams.append(ssc.BitStream(data, nbits))
+        finally:
+            shm_in.close()
+            shm_in.unlink()
+            shm_out.close()
+            shm_out.unlink()
+
+        return bitstreams
+
+
+    def play_original(self, name, latency=LATENCY):
         """ Plays Original sound if exists """
         if _AUDIO and name in self.sounds:
-            play(self.paudio, self.__bitrate, self.sounds[name]['inputwave'])
+            self.__player(latency).play([self.sounds[name]['inputwave']])
 
 
-    def play_procesed(self, name):
-        """ Plays Procesed sound if exists """
+    def play_procesed(self, name, latency=LATENCY):
+        """ Plays Procesed sound if exists, decoding it while it's played """
         if _AUDIO and name in self.sounds:
-
-            if self.sounds[name]['resultwave'] is None:
-                if 'BTc' in self.__btc_codec:
-                    if self.__btc_codec == 'BTc1.7':
-                        codec = '1.7'
-                    else:
-                        codec = '1.0'
-                    self.sounds[name]['resultwave'], _ = \
-                        ssc.btc2lin(self.sounds[name]['bitstream'], BITS, \
-                                        self.__soft, codec)
+            if 'BTc' in self.__btc_codec:
+                if self.__btc_codec == 'BTc1.7':
+                    codec = '1.7'
                 else:
-                    self.sounds[name]['resultwave'], _ = \
-                        ssc.dm2lin(self.sounds[name]['bitstream'], BITS, \
-                                        self.__delta)
+                    codec = '1.0'
+                decoder = ssc.BtcDecoder(BITS, self.__soft, codec)
+            else:
+                decoder = ssc.DmDecoder(BITS, self.__delta)
 
-            play(self.paudio, self.__bitrate, self.sounds[name]['resultwave'])
+            self.__player(latency).play_bitstream( \
+                self.sounds[name]['bitstream'], decoder)
+
+    def __player(self, latency):
+        """ Returns a Player that plays in the audio device """
+        return ssc.playback.Player( \
+            ssc.playback.PyAudioSink(self.__audio(), CHUNK), \
+            self.__bitrate, BITS, CHUNK, latency)
+
+    def __audio(self):
+        """ Returns the PyAudio object, created when the first sound is
+        played
+        """
+        if self.paudio is None:
+            self.paudio = pyaudio.PyAudio()
+        return self.paudio
 
 
     def write_to_file(self, filen, output_format, bias=0):
@@ -173,62 +591,54 @@ class SoundsLib(object):
                     fich = open(filen, "w")
 
             # Writting
-            if output_format == 'lib_ihex' or output_format == 'lib':
-                ptr_addr = 0      # Were write Ptr to sound data end
-                addr = 1024       # Were write sound data
-                ih = IntelHex()
-                
-                for name in self.__snames:
-                    if not fich is sys.stdout:
+            if output_format == 'lib' or output_format == 'raw':
+                if not fich is sys.stdout:
+                    for name in self.__snames:
                         print(self.sounds[name]['info'])
-                  
-                    data = ssc.pack(self.sounds[name]['bitstream'])
-                    while len(data) % 32 != 0:  #Padding to fill 32 byte blocks
-                        data += PAD_FILL
-
-                    btl_output(data, ih, addr, ptr_addr, bias)
-                    ptr_addr += 4
-                    addr += len(data)
-                    # Fills the header with 0s
-                    for n in range(ptr_addr, 1024):
-                        ih[n] = 0
-                
-                # Binary o IntelHEX output
-                if output_format == 'lib':
-                    ih.tofile(fich, 'bin')
-                else:
-                    ih.tofile(fich, 'hex')
 
-            elif output_format == 'raw_ihex' or output_format == 'raw':
-                addr = 0          # Were write sound data
-                ih = IntelHex()
-            
-                for name in self.__snames:
+                image = self.image(output_format == 'lib')
+                out = getattr(fich, 'buffer', fich)  # Binary stdout
+                with self.profile.stage('write'):
+                    if bias: # Padding bytes before the data
+                        out.write(PAD_FILL * bias)
+                    out.write(image)
+                self.profile.count('write', 'bytes_written', bias + len(image))
+
+            elif output_format == 'lib_ihex' or output_format == 'raw_ihex':
+                header = output_format == 'lib_ihex'
+                sizes = self.__sizes()
+                end = bias + sum(sizes) + (HEADER_SIZE if header else 0)
+                writer = ssc.ihex.HexWriter(fich, end)
+                addr = bias
+                if header:
+                    writer.write(ssc.btl.header(sizes), addr)
+                    addr = None
+
+                # Each sound is written when it's packed
+                for name, size in zip(self.__snames, sizes):
                     if not fich is sys.stdout:
                         print(self.sounds[name]['info'])
-              
-                    data = ssc.pack(self.sounds[name]['bitstream'])
-                    while len(data) % 32 != 0: # Padding to fill 32 byte blocks
-                        data += PAD_FILL
+                    data = self.__pack(name)
+                    with self.profile.stage('write', name):
+                        writer.write(data, addr)
+                        writer.write(PAD_FILL * (size - len(data)))
+                    self.profile.count('write', 'bytes_written', size, name)
+                    addr = None
+                writer.close()
 
-                    btc_output(data, ih, addr, bias)
-                    addr += len(data)
-            
-                # Binary or IntelHEX output
-                if output_format == 'raw':
-                    ih.tofile(fich, 'bin')
-                else:
-                    ih.tofile(fich, 'hex')
-          
             elif output_format == 'c':
                 fich.write('#include <stdlib.h>\n\n')
-                fich.write('/*\n' + self.__info + '/*\n\n')
+                fich.write('/*\n' + self.__info + '*/\n\n')
                 for name in self.__snames:
                     if not fich is sys.stdout:
                         print(self.sounds[name]['info'])
                     
-                    data = ssc.pack(self.sounds[name]['bitstream'])
-                    c_array_print(data, fich, self.sounds[name]['info'], name)
+                    data = self.__pack(name)
+                    with self.profile.stage('write', name):
+                        c_array_print(data, fich, self.sounds[name]['info'], \
+                                      name)
+                    self.profile.count('write', 'bytes_written', len(data), \
+                                       name)
 
 
         finally:
@@ -236,13 +646,352 @@ class SoundsLib(object):
                 fich.close()
 
 
-def read_wav(filename, normalize = 0.5):
-    """ Reads a wave file and return sample rate and mono audio data """
-    from math import floor
+    def __pack(self, name):
+        """ Returns the packed bitstream of a sound """
+        with self.profile.stage('pack', name):
+            return ssc.pack(self.sounds[name]['bitstream'])
+
+    def __sizes(self):
+        """ Returns the size in bytes of each packed sound, padded to fill
+        32 byte blocks
+        """
+        sizes = [-(-len(self.sounds[name]['bitstream']) // 8) \
+                 for name in self.__snames]
+        return [size + (-size % 32) for size in sizes]
+
+    def image(self, header=True):
+        """ Returns a bytearray with the packed sounds, each one padded to
+        fill 32 byte blocks. The layout is calculated before, so each sound
+        is packed directly in his place.
+
+        Keyword Arguments:
+            header -- If it's True, it's a BotTalk Library with the header of
+                      end pointers. Else it's RAW data (Default True)
+        """
+        bitstreams = [self.sounds[name]['bitstream'] for name in self.__snames]
+        sizes = self.__sizes()
+
+        start = HEADER_SIZE if header else 0
+        image = bytearray(start + sum(sizes))   # PAD_FILL is zero
+        if header:
+            image[:HEADER_SIZE] = ssc.btl.header(sizes)
+        for name, bits, size in zip(self.__snames, bitstreams, sizes):
+            with self.profile.stage('pack', name):
+                ssc.pack_into(bits, image, start)
+            start += size
+        return image
+
+    def update_lib(self, filen, filenames, jobs=1, bias=0):
+        """ Updates a BotTalk Library file, only writing the changed sounds
+
+        A manifest file (filen + MANIFEST_EXT) keeps the WAV file, his
+        digest and the key of each sound of the lib. Sounds with the same
+        key are not encoded again, and are only moved if a previous sound
+        changed of size. The output is the same that write_to_file with
+        'lib' format.
+
+        Keyword Arguments:
+            filen -- BotTalk Library file to update. It's created if don't
+                     exists
+            filenames -- WAV files of the sounds, in order
+            jobs -- Number of processes used to encode (Default 1)
+            bias -- Padding bytes before the lib. A lib written with other
+                    bias is written again (Default 0)
+
+        Returns a list with the WAV files that were encoded and written
+        """
+        from math import ceil
+
+        if len(filenames) > HEADER_SIZE // 4:
+            raise Exception('Too many sounds %d' % len(filenames), \
+                            len(filenames))
+
+        manifest = read_manifest(filen + MANIFEST_EXT, bias)
+        if os.path.exists(filen):
+            f = open(filen, 'r+b')
+        else:
+            f = open(filen, 'w+b')
+            manifest = []
+
+        try:
+            if f.read(bias) != PAD_FILL * bias: # Padding bytes before the lib
+                f.seek(0)
+                f.write(PAD_FILL * bias)
+            header = f.read(HEADER_SIZE)
+            f.seek(0, os.SEEK_END)
+            filesize = f.tell()
+
+            # Regions of the sounds in the actual file
+            old = {}
+            start = bias + HEADER_SIZE
+            for entry, end in zip(manifest, btl_ends(header, len(manifest), \
+                                                     bias)):
+                if end < start or end > filesize:
+                    old = {}  # Manifest don't match the lib
+                    break
+                old[entry['file']] = (entry, start, end)
+                start = end
+
+            # Finds the changed sounds
+            entries = []
+            changed = []
+            for fname in filenames:
+                st = os.stat(fname)
+                prev = old.get(fname, (None, 0, 0))[0]
+                if prev is not None and prev['mtime'] == st.st_mtime and \
+                        prev['size'] == st.st_size:
+                    digest = prev['digest']
+                else:
+                    digest = file_digest(fname)
+
+                entry = {'file': fname, 'digest': digest, \
+                         'mtime': st.st_mtime, 'size': st.st_size, \
+                         'key': self.sound_key(digest)}
+                entries.append(entry)
+                if prev is None or prev['key'] != entry['key']:
+                    changed.append(fname)
+                    name = sound_name(fname)
+                    if name in self.sounds:
+                        del self[name]
+                    self.add_wav_sound(fname)
+
+            self.process(jobs)
+
+            # New layout. Reused sounds that move are read before writing
+            plan = []
+            addr = bias + HEADER_SIZE
+            for entry in entries:
+                fname = entry['file']
+                if fname in changed:
+                    data = self.__pack(sound_name(fname))
+                    data += PAD_FILL * (-len(data) % 32)
+                    size = len(data)
+                else:
+                    _, start, end = old[fname]
+                    size = end - start
+                    data = None
+                    if start != addr:
+                        f.seek(start)
+                        data = f.read(size)
+                plan.append((addr, data))
+                addr += size
+
+            with self.profile.stage('write'):
+                for start, data in plan:
+                    if data is not None:
+                        f.seek(start)
+                        f.write(data)
+                        self.profile.count('write', 'bytes_written', len(data))
+
+            ends = [start for start, data in plan[1:]] + [addr]
+            newheader = ssc.btl.header([end - start for (start, data), end \
+                                        in zip(plan, ends)])
+            if newheader != header:
+                f.seek(bias)
+                f.write(newheader)
+            f.truncate(addr)
+        finally:
+            f.close()
+
+        write_manifest(filen + MANIFEST_EXT, entries, bias)
+
+        if changed:
+            print(self.__info)
+            for fname in changed:
+                print(self.sounds[sound_name(fname)]['info'])
+        return changed
 
-    # Make header info
-    sys.stderr.write('Openining : ' + filename + '\n\n')
-    wf = wave.open(filename, 'rb')
+
+    def stream_to_file(self, filen, output_format, filenames, bias=0):
+        """ Encodes WAV files directly to a file, without keep the sounds in
+        memory. Each sound is read, conditioned, encoded and written in
+        chunks, so the memory usage don't depends of the length of the
+        sounds. The output is the same that write_to_file.
+
+        Keyword Arguments:
+            filen -- Output file
+            output_format -- 'lib' or 'raw'
+            filenames -- WAV files of the sounds, in order
+            bias -- Padding bytes before the data (Default 0)
+        """
+        if output_format == 'lib' and len(filenames) > HEADER_SIZE // 4:
+            raise Exception('Too many sounds %d' % len(filenames), \
+                            len(filenames))
+
+        if output_format != 'lib' and output_format != 'raw':
+            raise Exception('Invalid streaming format %s' % output_format, \
+                            output_format)
+
+        print(self.__info)
+        with open(filen, 'wb') as f:
+            if bias: # Padding bytes before the data
+                f.write(PAD_FILL * bias)
+            header = bytearray(HEADER_SIZE)
+            if output_format == 'lib':
+                f.write(header)
+
+            for i, fname in enumerate(filenames):
+                if self.__btc_codec == 'DM':
+                    encoder = ssc.DmEncoder(BITS, self.__delta)
+                else:
+                    encoder = ssc.BtcEncoder(BITS, self.__soft, \
+                                             self.__version())
+
+                sound = sound_name(fname)
+                with self.profile.stage('stream', sound):
+                    info, size = stream_sound(fname, f, encoder, \
+                                              self.__bitrate, \
+                                              self.__normalize())
+                self.profile.count('stream', 'bytes_written', size, sound)
+                print(info + "\tSize: %d (bytes)\n" % size)
+
+                f.write(PAD_FILL * (-size % 32)) # Padding to fill 32 byte blocks
+                if output_format == 'lib':
+                    ptr = (f.tell() - bias - HEADER_SIZE) // 32
+                    header[i * 4:i * 4 + 4] = struct.pack('>I', ptr & 0xFFFFFF)
+
+            if output_format == 'lib':
+                f.seek(bias)
+                f.write(header)
+
+
+def read_manifest(filename, bias=0):
+    """ Reads the manifest of a BotTalk Library. Returns a list of entries,
+    or a empty list if the lib was written with other version or bias
+    """
+    try:
+        with open(filename, 'r') as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return []
+    if manifest.get('version') != code_version() or \
+            manifest.get('bias', 0) != bias:
+        return []
+    return manifest['sounds']
+
+
+def write_manifest(filename, entries, bias=0):
+    """ Writes the manifest of a BotTalk Library """
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'w') as f:
+        json.dump({'version': code_version(), 'bias': bias, \
+                   'sounds': entries}, f, indent=1)
+    os.replace(tmpname, filename)
+
+
+def btl_ends(header, count, bias=0):
+    """ Returns the end address of the first count sounds of a BTL header,
+    in a file with bias padding bytes before the header
+    """
+    ends = []
+    for i in range(min(count, len(header) // 4)):
+        ptr, = struct.unpack('>I', bytes(header[i * 4:i * 4 + 4]))
+        ends.append(bias + HEADER_SIZE + ptr * 32)
+    return ends
+
+
+def watch(sl, filen, filenames, interval=1.0, jobs=1, bias=0):
+    """ Updates a BotTalk Library each time that a WAV file changes
+
+    Keywords arguments:
+    sl -- SoundsLib used to encode the sounds
+    filen -- BotTalk Library file to update
+    filenames -- WAV files of the sounds, in order
+    interval -- Seconds between each check of the WAV files
+    jobs -- Number of processes used to encode
+    bias -- Padding bytes before the lib
+
+    """
+    last = None
+    while True:
+        stamps = []
+        for fname in filenames:
+            try:
+                st = os.stat(fname)
+                stamps.append((st.st_mtime, st.st_size))
+            except OSError:
+                stamps.append(None)
+
+        if stamps != last and None not in stamps:
+            changed = sl.update_lib(filen, filenames, jobs, bias)
+            sys.stderr.write('%s: %d sounds updated\n' % \
+                             (time.strftime('%H:%M:%S'), len(changed)))
+            last = stamps
+        time.sleep(interval)
+
+
+def batch_groups(lengths):
+    """ Returns the groups of sounds that are faster to encode with
+    ssc.batch. Each group is a list of indexes of lengths, of sounds of
+    similar length (see BATCH_RATIO, BATCH_GAIN and BATCH_SIZE)
+
+    Keywords arguments:
+    lengths -- Length of each sound
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    groups = []
+    i = 0
+    while i < len(order):
+        longest = lengths[order[i]]
+        j = i + 1
+        while j < len(order) and j - i < BATCH_SIZE and \
+              lengths[order[j]] >= BATCH_RATIO * longest:
+            j += 1
+        group = order[i:j]
+        if longest and sum(lengths[k] for k in group) >= BATCH_GAIN * longest:
+            groups.append(sorted(group))
+        i = j
+    return groups
+
+
+def encode_sound(samples, codec, soft, delta):
+    """ Encodes a sound and returns a BitStream
+
+    Keywords arguments:
+    samples -- Audio data in a bytes like object
+    codec -- Codec to use, 'DM', 'BTc1.0' or 'BTc1.7'
+    soft -- Softness constant of BTc codecs
+    delta -- Delta constant of DM codec
+
+    """
+    if codec == 'DM':
+        bitstream, _ = ssc.lin2dm(samples, BITS, delta)
+    else:
+        bitstream, _ = ssc.lin2btc(samples, BITS, soft, codec[3:])
+    return bitstream
+
+
+def encode_shared(in_name, start, end, out_name, offset, codec, soft, delta):
+    """ Encodes a sound stored in a shared memory block. Used by the workers
+
+    Keywords arguments:
+    in_name -- Name of the shared memory block with the PCM input
+    start, end -- Slice of the input with the sound
+    out_name -- Name of the shared memory block were write the packed bits
+    offset -- Offset in the output block were write the packed bits
+    codec, soft, delta -- Like encode_sound
+
+    Returns the number of bits written
+    """
+    from multiprocessing import shared_memory
+
+    shm_in = shared_memory.SharedMemory(name=in_name)
+    shm_out = shared_memory.SharedMemory(name=out_name)
+    try:
+        samples = shm_in.buf[start:end]
+        bitstream = encode_sound(samples, codec, soft, delta)
+        samples.release()
+        ssc.pack_into(bitstream, shm_out.buf, offset)
+    finally:
+        shm_in.close()
+        shm_out.close()
+
+    return len(bitstream)
+
+
+def wav_info(wf, filename):
+    """ Returns a pretty text with the info of a opened wave file """
+    from math import floor
 
     info = "\tWAV file: " + filename + "\n"
     channels = wf.getnchannels()
@@ -259,149 +1008,241 @@ def read_wav(filename, normalize = 0.5):
     info += ") seconds \n"
     info += "\tSample Rate: " + str(sr) + "\n"
 
+    return info
 
-    samples = wf.readframes(total_samples)
-    wf.close()
-    if bits != BITS: # It isn't 16 bits, convert to 16
-        samples = audioop.lin2lin(samples, bits, BITS)
-    if bits == 1 and min(samples) >= 0: # It's unsigned 8 bits
-        samples = audioop.bias(samples, 2, ssc.MIN ) 
 
-    if channels > 1:
-        samples = audioop.tomono(samples, BITS, 0.75, 0.25)
+def read_wav(filename, normalize = 0.5, profile = None, sound = ALL_SOUNDS):
+    """ Reads a wave file and return sample rate and mono audio data
 
-    # Normalize at 50%
-    maxsample = audioop.max(samples, BITS)
-    samples = audioop.mul(samples, BITS, MAX * normalize / float(maxsample))
+    Keywords arguments:
+    filename -- WAV file
+    normalize -- Peak value, relative to the max sample value (Default 0.5)
+    profile -- Profile were add the read and normalize stages (Default None)
+    sound -- Name of the sound in the profile (Default ALL_SOUNDS)
+    """
+    if profile is None:
+        profile = Profile()
+
+    # Make header info
+    sys.stderr.write('Openining : ' + filename + '\n\n')
+    with profile.stage('read', sound):
+        wf = wave.open(filename, 'rb')
+        info = wav_info(wf, filename)
+        channels = wf.getnchannels()
+        bits = wf.getsampwidth()
+        sr = wf.getframerate()
+
+        samples = wf.readframes(wf.getnframes())
+        wf.close()
+        samples, maxsample = next(convert([samples], bits, channels))
+    profile.count('read', 'samples_in', len(samples) // BITS, sound)
+
+    # Normalize at 50%. Silence can't be normalized
+    if maxsample:
+        with profile.stage('normalize', sound):
+            samples = ssc.pcm.gain(samples, BITS, \
+                                   MAX * normalize / float(maxsample))
 
     return sr, samples, info
 
 
-def play(audio, sr, samples):
-    """Plays an audio data
+# Stages of the streaming pipeline. Each one is a generator that gets
+# chunks of the previous stage
+
+def read_frames(filename, frames=STREAM_FRAMES):
+    """ Reads a wave file in chunks of frames """
+    wf = wave.open(filename, 'rb')
+    try:
+        while True:
+            chunk = wf.readframes(frames)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        wf.close()
+
+
+def convert(chunks, width, channels):
+    """ Converts chunks of frames of width bytes to mono BITS bytes samples.
+    8 bit samples are unsigned, and stereo frames are mixed at 75% - 25%.
+    Yields tuples of (samples, peak)
+    """
+    if channels == 2:
+        weights = (0.75, 0.25)
+    else:
+        weights = None
+    for chunk in chunks:
+        yield ssc.pcm.condition(chunk, width, channels, weights, BITS, \
+                                unsigned=(width == 1))
 
-    Keywords arguments:
-    audio -- PyAduio Object
-    sr -- Sample Rate
-    samples -- Audio data in a string byte array (array.trostring())
 
+def apply_gain(chunks, factor):
+    """ Multiplies all samples by factor """
+    for chunk in chunks:
+        yield ssc.pcm.gain(chunk, BITS, factor)
+
+
+def resample(chunks, sr, rate):
+    """ Converts the sample rate from sr to rate, keeping the state between
+    chunks. The last samples are returned after the last chunk
+    """
+    if sr == rate:
+        for chunk in chunks:
+            yield chunk
+        return
+    resampler = ssc.resample.Resampler(BITS, sr, rate)
+    for chunk in chunks:
+        yield resampler.feed(chunk)
+    yield resampler.flush()
+
+
+def encode_chunks(chunks, encoder):
+    """ Encodes chunks of samples with a ssc encoder, keeping the state. The
+    pending bits are flushed at the end
     """
-    stream = audio.open(format=audio.get_format_from_width(BITS), \
-                channels=1, rate=sr, output=True)
+    for chunk in chunks:
+        yield encoder.feed(chunk)
+    yield encoder.flush()
 
-    data = samples[:CHUNK]
-    i = 0
-    while i < len(samples):
-        stream.write(data)
-        i += CHUNK
-        data = samples[i:min(i+CHUNK, len(samples))]
 
-    time.sleep(0.5) # delay half second
+def pack_chunks(bitstreams):
+    """ Packs the BitStreams of encode_chunks """
+    for bitstream in bitstreams:
+        yield ssc.pack(bitstream)
 
-    stream.stop_stream()
-    stream.close()
 
+def write_chunks(chunks, f):
+    """ Writes all chunks to a file. Returns the number of bytes written """
+    size = 0
+    for chunk in chunks:
+        f.write(chunk)
+        size += len(chunk)
+    return size
 
-def c_array_print(bytedata, f, head, name, ):
-    """ Prints a Byte Array in a pretty C array format. 
-    
-    Keywords arguments:
-    bytedata -- Stream of bytes to write
-    f -- File were to write
-    head -- Pretty comment text for the bytedata array
-    name -- Name of the bytedata array
 
-    """
-    if head:
-        f.write("/*\n" + head + "*/\n\n")
-    
-    data = array.array('B')
-    data.fromstring(bytedata)
+def stream_sound(filename, f, encoder, rate, normalize=0.5, \
+                 frames=STREAM_FRAMES):
+    """ Encodes a WAV file and writes the packed bitstream to a file, in
+    chunks of frames. Memory usage don't depends of the length of the sound
 
-    data_str = [("0x%02X" % byte) for byte in data]
-    # map(lambda x: "0x%02X" % x, data)
-    
-    f.write('size_t ' +name + "_len = " + str(len(data)) + "; /* Num. of Bytes */\n")
+    Keywords arguments:
+    filename -- WAV file
+    f -- Binary file were write the packed bitstream
+    encoder -- ssc encoder object (BtcEncoder or DmEncoder)
+    rate -- Desired BitRate
+    normalize -- Peak value, relative to the max sample value (Default 0.5)
+    frames -- Frames read in each step (Default STREAM_FRAMES)
+
+    Returns a tuple of (info, size) with the WAV info and the bytes written
+    """
+    sys.stderr.write('Openining : ' + filename + '\n\n')
+    wf = wave.open(filename, 'rb')
+    info = wav_info(wf, filename)
+    channels = wf.getnchannels()
+    width = wf.getsampwidth()
+    sr = wf.getframerate()
+    wf.close()
 
-    # Print Bytedata
-    f.write('unsigned char ' +  name + "_data  = {\n")
-    
-    blq = data_str[:COLUMN]
-    i = 0
-    while i < len(data_str): 
-        f.write(', '.join(blq) + ',\n')
-        i += COLUMN
-        if i % 32 == 0:
-            f.write('/*---------------- %8d ----------------*/\n' % i)
+    def converted():
+        return convert(read_frames(filename, frames), width, channels)
 
-        blq = data_str[i:min(i + COLUMN, len(data_str))]
+    # First pass only searchs the peak
+    peak = 0
+    for _, chunk_peak in converted():
+        peak = max(peak, chunk_peak)
 
-    f.write("}; \n")
+    chunks = (chunk for chunk, _ in converted())
+    if peak:    # Silence can't be normalized
+        chunks = apply_gain(chunks, MAX * normalize / float(peak))
+    chunks = resample(chunks, sr, rate)
+    size = write_chunks(pack_chunks(encode_chunks(chunks, encoder)), f)
+    return info, size
 
 
-def btl_output(bytedata, ih, addr, ptr_addr, bias=0):
-    """ Write BTL Lib to a IHEX datastructure. 
+def c_array_print(bytedata, f, head, name):
+    """ Prints a Byte Array in a pretty C array format. The array is const,
+    so it can be keep in the flash memory of the micro
 
     Keywords arguments:
     bytedata -- Stream of bytes to write
-    ih -- IntelHex Object wre to write
-    addr -- Address were store the bytedata
-    ptr_addr -- Address were store the pointer to the end of the data
-    biar -- Offset of addresses were write all
+    f -- File were to write
+    head -- Pretty comment text for the bytedata array
+    name -- Name of the bytedata array
 
     """
-    data = array.array('B')
-    data.fromstring(bytedata)
-    
-    ptr = len(data) + addr - 1024 # Relative to the end of header
-    ptr = ptr // 32   # Points to 32 bytes block, not real address
+    if head:
+        f.write("/*\n" + head + "*/\n\n")
 
-    ptr_addr += bias
-    # Writes the pointer in the header
-    ih[ptr_addr] = 0 # (ptr >> 24)
-    ptr = ptr & 0x00FFFFFF
+    name = c_name(name)
+    data = memoryview(bytedata).cast('B')
+    f.write('const size_t %s_len = %d; /* Num. of Bytes */\n' % \
+            (name, len(data)))
+    f.write('const unsigned char %s_data[%d] = {\n' % (name, len(data)))
 
-    ptr_addr += 1
-    ih[ptr_addr] = ptr >> 16
-    ptr = ptr & 0x0000FFFF
+    # C_CHUNK is a multiple of 32, so the separators keep his place
+    for i in range(0, len(data), C_CHUNK):
+        f.write(c_rows(data[i:i + C_CHUNK], i))
 
-    ptr_addr += 1
-    ih[ptr_addr] = ptr >> 8
-    ptr = ptr & 0x000000FF
+    f.write("};\n")
 
-    ptr_addr += 1
-    ih[ptr_addr] = ptr
 
-    # Writes Data
-    addr += bias
-    for byte in data:
-        ih[addr] = byte
-        addr += 1
+def c_name(name):
+    """ Returns a valid C identifier from a sound name """
+    name = re.sub(r'\W', '_', os.path.basename(name))
+    if not name or name[0].isdigit():
+        name = '_' + name
+    return name
 
-def btc_output(bytedata, ih, addr, bias=0):
-    """ Write BTC RAW to a IHEX datastructure. 
+
+def c_rows(data, offset):
+    """ Returns the C text of the rows of COLUMN bytes of data, with a
+    separator comment after each 32 bytes block
 
     Keywords arguments:
-    bytedata -- Stream of bytes to write
-    ih -- IntelHex Object wre to write
-    addr -- Address were store the bytedata
-    ptr_addr -- Address were store the pointer to the end of the data
-    biar -- Offset of addresses were write all
-
-    """ 
-    data = array.array('B')
-    data.fromstring(bytedata)
-    
-    # Writes Data
-    addr += bias
-    for byte in data:
-        ih[addr] = byte
-        addr += 1
+    data -- Bytes to format
+    offset -- Offset of data in the array. Must be a multiple of 32
+    """
+    text = ''
+    blocks = len(data) // 32
+    if _NUMPY and blocks:
+        # The chars of each byte from the table, and a line break instead
+        # of the space of the last byte of each row
+        table = numpy.frombuffer(''.join(C_BYTE).encode('ascii'), \
+                                 dtype='S%d' % len(C_BYTE[0]))
+        chars = table[numpy.frombuffer(data[:blocks * 32], dtype=numpy.uint8)]
+        chars = chars.view(numpy.uint8).reshape(-1, COLUMN, table.itemsize)
+        chars[:, -1, -1] = ord('\n')
+
+        # Separators with the offset at the end of each block
+        separators = numpy.frombuffer((C_SEPARATOR % 0).encode('ascii'), \
+                                      dtype=numpy.uint8)
+        separators = numpy.tile(separators, (blocks, 1))
+        ends = offset + 32 * numpy.arange(1, blocks + 1)
+        last = C_SEPARATOR.index('%') + 7   # Column of the units
+        for k in range(8):
+            digits = ends // 10 ** k
+            separators[:, last - k] = numpy.where(digits > 0, \
+                                                  ord('0') + digits % 10, \
+                                                  ord(' '))
+
+        text = numpy.concatenate((chars.reshape(blocks, -1), separators), \
+                                 axis=1).tobytes().decode('ascii')
+        data = data[blocks * 32:]
+        offset += blocks * 32
+
+    rows = []
+    for i in range(0, len(data), COLUMN):
+        rows.append(''.join([C_BYTE[byte] for byte in data[i:i + COLUMN]]) \
+                    [:-1] + '\n')
+        if (offset + i + COLUMN) % 32 == 0:
+            rows.append(C_SEPARATOR % (offset + i + COLUMN))
+    return text + ''.join(rows)
 
 
 # MAIN !
 if __name__ == '__main__':
     import argparse
+    import atexit
 
     # Args parsing
     parser = argparse.ArgumentParser(description="Reads a WAV file, play it " +\
@@ -449,6 +1290,47 @@ if __name__ == '__main__':
                             help='Plays procesed file')
         parser.add_argument('--playorig', action='store_true', default=False, \
                             help='Plays original file')
+        parser.add_argument('--latency', metavar='S', type=float, \
+                            default=LATENCY, help='Seconds of sound ' \
+                            'decoded before it is played. ' \
+                            'Default: %(default)s')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1, \
+      help='Number of processes used to encode the sounds. ' \
+      'Default: %(default)s')
+
+    parser.add_argument('--cache-dir', metavar='DIR', type=str, \
+      default=CACHE_DIR, help='Directory of the encode cache. ' \
+      'Default: %(default)s')
+
+    parser.add_argument('--cache-size', metavar='MB', type=int, \
+      default=CACHE_SIZE // 2 ** 20, help='Maximum size of the encode cache ' \
+      'in MiB. Default: %(default)s')
+
+    parser.add_argument('--no-cache', action='store_true', default=False, \
+      help='Not use the encode cache')
+
+    parser.add_argument('-i', '--incremental', action='store_true', \
+      default=False, help='Updates the BotTalk Library of OUTPUT, only ' \
+      'encoding and writing the changed sounds. Only with lib format')
+
+    parser.add_argument('--watch', metavar='SECONDS', type=float, \
+      nargs='?', const=1.0, default=None, help='Updates the BotTalk ' \
+      'Library each time that a WAV file changes, checking it each ' \
+      'SECONDS. Only with lib format. Default: 1.0')
+
+    parser.add_argument('--stream', action='store_true', default=False, \
+      help='Encodes each sound in chunks, writing it directly to the ' \
+      'output file, so the memory usage is bounded. Only with lib and raw ' \
+      'formats')
+
+    parser.add_argument('--profile', metavar='FILE', type=str, \
+      default=None, help='Writes the time of each stage (read, normalize, ' \
+      'resample, encode, pack, write) by sound and his counters to FILE, ' \
+      'in CSV format if FILE ends with .csv, else in JSON')
+
+    parser.add_argument('--cprofile', metavar='FILE', type=str, \
+      default=None, help='Runs with cProfile and dumps the stats to FILE')
+
     parser.add_argument('--version', action='version', \
                         version="%(prog)s version "+ VERSION)
 
@@ -467,6 +1349,19 @@ if __name__ == '__main__':
         print("Invalid value of bias/padding. Must be a positive value.")
         sys.exit(0)
 
+    if args.jobs < 1:
+        print("Invalid number of jobs. Must be >= 1.")
+        sys.exit(0)
+
+    if (args.incremental or args.watch) and \
+            (args.f != 'lib' or args.output is None):
+        print("Incremental and watch modes needs a output file in lib format.")
+        sys.exit(0)
+
+    if args.stream and (args.f not in ('lib', 'raw') or args.output is None):
+        print("Streaming mode needs a output file in lib or raw format.")
+        sys.exit(0)
+
     if args.rate < 1000:
         print("Invalid BitRate. Must be >= 1000.")
         sys.exit(0)
@@ -476,25 +1371,55 @@ if __name__ == '__main__':
             print("The input file %s don't exists." % fname)
             sys.exit(0)
 
-    sl = SoundsLib(args.rate, args.soft, args.delta, args.c)
+    cache = None
+    if not args.no_cache:
+        cache = EncodeCache(args.cache_dir, args.cache_size * 2 ** 20)
+
+    sl = SoundsLib(args.rate, args.soft, args.delta, args.c, cache)
+
+    # Profiles are written at exit, even in the modes that exit before
+    if args.profile:
+        atexit.register(sl.profile.write, args.profile)
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        atexit.register(profiler.dump_stats, args.cprofile)
+        profiler.enable()
+
+    if args.watch:
+        try:
+            watch(sl, args.output, args.infile, args.watch, args.jobs, \
+                  args.bias)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    if args.incremental:
+        sl.update_lib(args.output, args.infile, args.jobs, args.bias)
+        sys.exit(0)
+
+    if args.stream:
+        sl.stream_to_file(args.output, args.f, args.infile, args.bias)
+        sys.exit(0)
+
     for fi in args.infile:
         sl.add_wav_sound(fi)
 
     if _AUDIO and args.playorig:
         for k in sl.sounds.keys():
             print("Playing Original Sound: " + k)
-            sl.play_original(k)
+            sl.play_original(k, args.latency)
 
     # Process all sounds in the lib
-    sl.process()
+    sl.process(args.jobs)
 
     # Play procesed sounds
     if _AUDIO and args.p:
         for k in sl.sounds.keys():
             print("Playing Procesed Sound: " + k)
-            sl.play_procesed(k)
+            sl.play_procesed(k, args.latency)
 
     # Write to output
-    sl.write_to_file(args.output, args.f)
+    sl.write_to_file(args.output, args.f, args.bias)
       
 
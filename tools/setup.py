@@ -18,7 +18,6 @@ setup(
 
     scripts=['bin/wav2ssc.py'],
     install_requires=[
-        "intelhex >= 1.4",
         "ssc",
     ],
 